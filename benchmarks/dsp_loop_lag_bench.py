@@ -0,0 +1,78 @@
+"""
+Event-loop lag with many concurrent TTS streams, resampling inline vs on the DSP pool.
+Each simulated stream converts Cartesia-sized float32 chunks (24 kHz) to
+16 kHz int16 and then paces itself like stream_tts_response. A probe task
+sleeps PROBE_INTERVAL_S in a loop and records how late it wakes up, which is
+the delay every other connection on the loop would see.
+
+Usage: python benchmarks/dsp_loop_lag_bench.py [streams] [seconds] [chunk_ms]
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+import numpy as np
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from server.dsp import DspExecutor, convert_audio_chunk
+
+SOURCE_RATE = 24000
+TARGET_RATE = 16000
+SLEEP_MULTIPLIER = 0.5  # TTS_SLEEP_MULTIPLIER in server/main.py
+PROBE_INTERVAL_S = 0.005
+
+
+async def probe_lag(lags, stop):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(PROBE_INTERVAL_S)
+        lags.append((loop.time() - start - PROBE_INTERVAL_S) * 1000)
+
+
+async def tts_stream(chunk, executor, deadline):
+    loop = asyncio.get_running_loop()
+    chunk_s = len(chunk) / 4 / SOURCE_RATE
+    converted = 0
+    while loop.time() < deadline:
+        if executor:
+            await executor.run(convert_audio_chunk, chunk, SOURCE_RATE, TARGET_RATE)
+        else:
+            convert_audio_chunk(chunk, SOURCE_RATE, TARGET_RATE)
+        converted += 1
+        await asyncio.sleep(chunk_s * SLEEP_MULTIPLIER)
+    return converted
+
+
+async def run(streams, seconds, chunk_ms, executor):
+    rng = np.random.default_rng(0)
+    chunk = (rng.standard_normal(SOURCE_RATE * chunk_ms // 1000) * 0.1).astype(np.float32).tobytes()
+    lags, stop = [], asyncio.Event()
+    probe = asyncio.create_task(probe_lag(lags, stop))
+    deadline = asyncio.get_running_loop().time() + seconds
+    started = time.perf_counter()
+    chunks = await asyncio.gather(*(tts_stream(chunk, executor, deadline) for _ in range(streams)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await probe
+    return np.array(lags), sum(chunks) / elapsed
+
+
+def main():
+    streams = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+    chunk_ms = int(sys.argv[3]) if len(sys.argv) > 3 else 100
+    print(f"{streams} streams, {seconds:.0f}s, {chunk_ms} ms chunks, {os.cpu_count()} CPUs")
+    print(f"{'mode':<18} {'lag p50 ms':>10} {'p99 ms':>8} {'max ms':>8} {'chunks/s':>9}")
+    for name, make_executor in (("inline", lambda: None), ("dsp executor", DspExecutor)):
+        lags, rate = asyncio.run(run(streams, seconds, chunk_ms, make_executor()))
+        print(f"{name:<18} {np.percentile(lags, 50):>10.2f} {np.percentile(lags, 99):>8.2f} "
+              f"{lags.max():>8.2f} {rate:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
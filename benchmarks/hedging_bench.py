@@ -0,0 +1,97 @@
+"""
+Tail latency of STT and LLM calls with one provider, with failover only, and with hedging.
+Two mock providers stall now and then (MOCK_*_SLOW_RATE) and sometimes fail
+(MOCK_*_ERROR_RATE). Calls run one after another, like turns of a single
+toy; for the LLM the latency is time to the first streamed token.
+
+Usage: python benchmarks/hedging_bench.py [calls] [slow_rate] [error_rate]
+"""
+
+import logging
+import os
+import sys
+import tempfile
+import time
+import wave
+
+CALLS = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+SLOW_RATE = sys.argv[2] if len(sys.argv) > 2 else "0.05"
+ERROR_RATE = sys.argv[3] if len(sys.argv) > 3 else "0.02"
+
+# The mocks read their settings at import time
+os.environ.update({
+    "MOCK_STT_LATENCY_S": "0.02", "MOCK_STT_SLOW_S": "0.5",
+    "MOCK_STT_SLOW_RATE": SLOW_RATE, "MOCK_STT_ERROR_RATE": ERROR_RATE,
+    "MOCK_LLM_FIRST_TOKEN_S": "0.03", "MOCK_LLM_TOKENS_PER_S": "1000", "MOCK_LLM_SLOW_S": "0.5",
+    "MOCK_LLM_SLOW_RATE": SLOW_RATE, "MOCK_LLM_ERROR_RATE": ERROR_RATE,
+    "MOCK_LLM_RESPONSE": "Жили-были дед и баба.",
+    "ROUTER_HEDGE_MIN_S": "0.05",
+})
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+import numpy as np
+
+from utils.mock_backends import MockChatModel, transcribe_audio_mock
+from utils.routing import AllProvidersFailed, ProviderRouter, RoutedChatModel
+
+
+def timed_calls(call):
+    latencies, failures = [], 0
+    for _ in range(CALLS):
+        start = time.perf_counter()
+        try:
+            ok = call() is not None
+        except (AllProvidersFailed, ConnectionError):
+            ok = False
+        latencies.append((time.perf_counter() - start) * 1000)
+        failures += not ok
+    return np.array(latencies), failures
+
+
+def stt_modes(wav_path):
+    def single():
+        return transcribe_audio_mock(wav_path)
+
+    def routed(hedging):
+        router = ProviderRouter("stt", [("mock:a", "a"), ("mock:b", "b")], timeout_s=10,
+                                hedging=hedging, stats_path="")
+        return lambda: router.call(lambda _: transcribe_audio_mock(wav_path))
+
+    return [("single", single), ("failover", routed(False)), ("hedged", routed(True))]
+
+
+def llm_modes():
+    models = [("mock:a", MockChatModel("a")), ("mock:b", MockChatModel("b"))]
+
+    def first_token(model):
+        return lambda: next(iter(model.stream("Расскажи сказку")), None)
+
+    def routed(hedging):
+        return first_token(RoutedChatModel(models, timeout_s=10, hedging=hedging, stats_path=""))
+
+    return [("single", first_token(models[0][1])), ("failover", routed(False)), ("hedged", routed(True))]
+
+
+def main():
+    logging.disable(logging.WARNING)  # failover warnings would drown the table
+    with tempfile.TemporaryDirectory() as tmp:
+        wav_path = os.path.join(tmp, "utterance.wav")
+        with wave.open(wav_path, 'wb') as wf:
+            wf.setnchannels(1)
+            wf.setsampwidth(2)
+            wf.setframerate(16000)
+            wf.writeframes(b"\0\0" * 16000)
+
+        print(f"{CALLS} calls, slow rate {SLOW_RATE}, error rate {ERROR_RATE}")
+        print(f"{'call':<5} {'mode':<10} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} {'failed':>7}")
+        for kind, modes in (("stt", stt_modes(wav_path)), ("llm", llm_modes())):
+            for name, call in modes:
+                latencies, failures = timed_calls(call)
+                print(f"{kind:<5} {name:<10} {np.percentile(latencies, 50):>8.1f} {np.percentile(latencies, 95):>8.1f} "
+                      f"{np.percentile(latencies, 99):>8.1f} {latencies.max():>8.1f} {failures:>7}")
+
+
+if __name__ == "__main__":
+    main()
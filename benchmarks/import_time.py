@@ -0,0 +1,61 @@
+"""
+Import-time profile of the pipeline worker.
+Imports a module in a fresh interpreter with `python -X importtime`, prints
+the slowest imports and exits non-zero when the total exceeds the budget.
+
+Usage: python benchmarks/import_time.py [module] [budget_ms] [top_n]
+"""
+
+import os
+import subprocess
+import sys
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_MODULE = "server.pipeline_script"
+DEFAULT_BUDGET_MS = 1500
+DEFAULT_TOP_N = 15
+
+
+def profile_imports(module):
+    """Returns [(module, self_us, cumulative_us)] as reported by -X importtime."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=project_root,
+        capture_output=True,
+        text=True,
+        env={**os.environ, "PYTHONIOENCODING": "utf-8"},
+    )
+    if result.returncode != 0:
+        print(result.stderr[-2000:])
+        raise SystemExit(f"Importing {module} failed (code {result.returncode})")
+
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def main():
+    module = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_MODULE
+    budget_ms = float(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_BUDGET_MS
+    top_n = int(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_TOP_N
+
+    rows = profile_imports(module)
+    total_ms = sum(self_us for _, self_us, _ in rows) / 1000
+
+    print(f"Slowest imports for {module} (cumulative):")
+    for name, _, cumulative_us in sorted(rows, key=lambda row: row[2], reverse=True)[:top_n]:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+    print(f"Total import time: {total_ms:.1f} ms (budget {budget_ms:.0f} ms, {len(rows)} modules)")
+
+    if total_ms > budget_ms:
+        print("!!! Import-time budget exceeded")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""
+Load test with simulated ESP32 clients.
+Each fake device speaks the firmware protocol: START_RECORDING, binary
+16 kHz/16-bit PCM frames at real-time pace, STOP_RECORDING, then consumes
+the TTS stream until it goes quiet. The test runs once per device count and
+reports latency percentiles to the first audio (including server cues such
+as the "please wait" beeps), to the reply itself and to the end of the turn,
+plus server CPU and memory (the server process and its pipeline
+subprocesses, read from /proc).
+
+Run against a server started with the local stand-in backends:
+    TTS_PROVIDER=mock PIPELINE_SCRIPT_PATH=benchmarks/stub_pipeline.py python server/main.py
+    python benchmarks/loadtest.py --devices 1,10,50 --server-pid <pid>
+or let the test start that server itself:
+    python benchmarks/loadtest.py --devices 1,10,50 --spawn-server
+"""
+
+import argparse
+import asyncio
+import math
+import os
+import subprocess
+import sys
+import time
+import wave
+
+import websockets
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ESP32_RATE = 16000
+ESP32_WIDTH = 2
+ESP32_BYTES_PER_SECOND = ESP32_RATE * ESP32_WIDTH
+FRAME_BYTES = 2048  # 1024 mic samples per firmware read, sent as 16-bit
+# Silence after a short burst that marks it as a server cue; TTS chunks arrive closer together
+CUE_GAP_S = 0.3
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def load_pcm(wav_path, utterance_s):
+    """Returns 16 kHz/16-bit mono PCM from a WAV file, or a synthetic tone."""
+    if wav_path:
+        with wave.open(wav_path, 'rb') as wf:
+            if (wf.getframerate(), wf.getsampwidth(), wf.getnchannels()) != (ESP32_RATE, ESP32_WIDTH, 1):
+                raise SystemExit(f"{wav_path} must be {ESP32_RATE} Hz, 16-bit, mono")
+            return wf.readframes(wf.getnframes())
+    count = int(utterance_s * ESP32_RATE)
+    samples = (int(3000 * math.sin(2 * math.pi * 220 * i / ESP32_RATE)) for i in range(count))
+    return b"".join(sample.to_bytes(2, "little", signed=True) for sample in samples)
+
+
+def percentile(values, fraction):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered), math.ceil(fraction * len(ordered))) - 1)]
+
+
+# --- Server resource sampling (Linux /proc) ---
+def _process_tree(root_pid):
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            children.setdefault(ppid, []).append(int(entry))
+        except (OSError, IndexError, ValueError):
+            continue
+    pids, stack = [], [root_pid]
+    while stack:
+        pid = stack.pop()
+        pids.append(pid)
+        stack.extend(children.get(pid, []))
+    return pids
+
+
+def sample_resources(root_pid):
+    """Returns (cpu_seconds, rss_bytes) summed over the process and its children."""
+    cpu_ticks, rss_pages = 0, 0
+    for pid in _process_tree(root_pid):
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            cpu_ticks += int(fields[11]) + int(fields[12])
+            with open(f"/proc/{pid}/statm") as f:
+                rss_pages += int(f.read().split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+    return cpu_ticks / CLOCK_TICKS, rss_pages * PAGE_SIZE
+
+
+async def monitor_resources(root_pid, interval, samples):
+    previous_cpu, previous_time = sample_resources(root_pid)[0], time.monotonic()
+    while True:
+        await asyncio.sleep(interval)
+        cpu, rss = sample_resources(root_pid)
+        now = time.monotonic()
+        samples.append(((cpu - previous_cpu) / (now - previous_time) * 100, rss))
+        previous_cpu, previous_time = cpu, now
+
+
+# --- Simulated device ---
+async def run_device(url, pcm, turns, response_timeout, idle_timeout, cue_max_bytes, results, errors):
+    loop = asyncio.get_running_loop()
+    try:
+        async with websockets.connect(url, max_size=None) as ws:
+            for _ in range(turns):
+                await ws.send("START_RECORDING")
+                start = loop.time()
+                for offset in range(0, len(pcm), FRAME_BYTES):
+                    await ws.send(pcm[offset:offset + FRAME_BYTES])
+                    delay = start + (offset + FRAME_BYTES) / ESP32_BYTES_PER_SECOND - loop.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                await ws.send("STOP_RECORDING")
+                stop = loop.time()
+
+                first_audio = first = last = None
+                received = 0
+                while True:
+                    try:
+                        message = await asyncio.wait_for(ws.recv(), idle_timeout if first else response_timeout)
+                    except asyncio.TimeoutError:
+                        if first and received <= cue_max_bytes:
+                            # A short burst then silence is a server cue; keep waiting for the reply
+                            first, received = None, 0
+                            continue
+                        break
+                    if isinstance(message, bytes):
+                        now = loop.time()
+                        if first and received <= cue_max_bytes and now - last > CUE_GAP_S:
+                            # The earlier burst was a cue (cues arrive in one go); the reply starts here
+                            first, received = None, 0
+                        last = now
+                        first = first or last
+                        first_audio = first_audio or last
+                        received += len(message)
+                if first is None:
+                    errors.append("no audio response")
+                    continue
+                playback_end = max(last, first + received / ESP32_BYTES_PER_SECOND)
+                results.append((first_audio - stop, playback_end - stop, received, first - stop))
+    except (OSError, websockets.exceptions.WebSocketException) as e:
+        errors.append(f"{type(e).__name__}: {e}")
+
+
+async def run_step(args, pcm, devices):
+    results, errors, samples = [], [], []
+    monitor = asyncio.create_task(monitor_resources(args.server_pid, 0.5, samples)) if args.server_pid else None
+    started = time.monotonic()
+    # Stagger connections over one utterance so turns do not all align
+    stagger = len(pcm) / ESP32_BYTES_PER_SECOND / max(devices, 1)
+
+    async def delayed(i):
+        await asyncio.sleep(i * stagger)
+        await run_device(args.url, pcm, args.turns, args.response_timeout, args.idle_timeout,
+                         int(args.cue_max_s * ESP32_BYTES_PER_SECOND), results, errors)
+
+    await asyncio.gather(*(delayed(i) for i in range(devices)))
+    elapsed = time.monotonic() - started
+    if monitor:
+        monitor.cancel()
+
+    first_byte = [r[0] * 1000 for r in results]
+    turn = [r[1] * 1000 for r in results]
+    reply = [r[3] * 1000 for r in results]
+    cpu = [s[0] for s in samples]
+    rss = [s[1] for s in samples]
+    return {
+        "devices": devices,
+        "turns": len(results),
+        "errors": len(errors),
+        "first_p50": percentile(first_byte, 0.5),
+        "first_p95": percentile(first_byte, 0.95),
+        "first_p99": percentile(first_byte, 0.99),
+        "reply_p50": percentile(reply, 0.5),
+        "reply_p95": percentile(reply, 0.95),
+        "turn_p50": percentile(turn, 0.5),
+        "turn_p95": percentile(turn, 0.95),
+        "cpu_avg": sum(cpu) / len(cpu) if cpu else float("nan"),
+        "cpu_max": max(cpu) if cpu else float("nan"),
+        "rss_max_mb": max(rss) / 1e6 if rss else float("nan"),
+        "elapsed": elapsed,
+        "sample_errors": sorted(set(errors))[:3],
+    }
+
+
+def spawn_server():
+    env = {
+        **os.environ,
+        "TTS_PROVIDER": "mock",
+        "PIPELINE_SCRIPT_PATH": os.path.join("benchmarks", "stub_pipeline.py"),
+        "PYTHONIOENCODING": "utf-8",
+    }
+    process = subprocess.Popen([sys.executable, os.path.join("server", "main.py")], cwd=project_root,
+                               env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    time.sleep(3)
+    if process.poll() is not None:
+        raise SystemExit("Server failed to start")
+    return process
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="ws://127.0.0.1:8765")
+    parser.add_argument("--devices", default="1,5,10", help="comma-separated device counts, one step each")
+    parser.add_argument("--turns", type=int, default=3, help="turns per device per step")
+    parser.add_argument("--wav", help="16 kHz/16-bit mono utterance (default: synthetic tone)")
+    parser.add_argument("--utterance-s", type=float, default=2.0, help="length of the synthetic utterance")
+    parser.add_argument("--response-timeout", type=float, default=30.0)
+    parser.add_argument("--idle-timeout", type=float, default=1.5, help="silence that ends a TTS stream")
+    parser.add_argument("--cue-max-s", type=float, default=0.5,
+                        help="audio bursts up to this long followed by silence are cues, not the reply")
+    parser.add_argument("--server-pid", type=int, help="server PID to sample CPU/memory from")
+    parser.add_argument("--spawn-server", action="store_true", help="start server/main.py with stand-in backends")
+    args = parser.parse_args()
+
+    server = spawn_server() if args.spawn_server else None
+    if server:
+        args.server_pid = server.pid
+    pcm = load_pcm(args.wav, args.utterance_s)
+
+    print(f"{'devices':>7} {'turns':>6} {'errors':>6} {'first p50':>10} {'p95':>8} {'p99':>8} "
+          f"{'reply p50':>10} {'p95':>8} {'turn p50':>9} {'p95':>8} {'cpu avg%':>9} {'cpu max%':>9} {'rss MB':>8}")
+    try:
+        for devices in (int(n) for n in args.devices.split(",")):
+            row = asyncio.run(run_step(args, pcm, devices))
+            print(f"{row['devices']:>7} {row['turns']:>6} {row['errors']:>6} {row['first_p50']:>10.0f} "
+                  f"{row['first_p95']:>8.0f} {row['first_p99']:>8.0f} {row['reply_p50']:>10.0f} {row['reply_p95']:>8.0f} "
+                  f"{row['turn_p50']:>9.0f} {row['turn_p95']:>8.0f} "
+                  f"{row['cpu_avg']:>9.1f} {row['cpu_max']:>9.1f} {row['rss_max_mb']:>8.1f}")
+            for error in row["sample_errors"]:
+                print(f"        error: {error}")
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Microphone frames per second per core on the server's receive path.
+Replays recordings through the per-message work of connection_handler.
+The "wave" handler is the old one: an isinstance() chain and a
+wave.writeframesraw() (header rewrite, file write) per frame. The "buffer"
+handler is the current one: a type check and a memoryview copy into the
+connection's RecordingBuffer, with one WAV write when the recording stops.
+WebSocket parsing is not included: it costs the same in both.
+
+Usage: python benchmarks/recv_frames_bench.py [recordings] [seconds] [frame_bytes]
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import wave
+
+RECORDINGS = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+SECONDS = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+FRAME_BYTES = int(sys.argv[3]) if len(sys.argv) > 3 else 2048  # 1024 samples per firmware read
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from server.recording import RecordingBuffer
+
+
+async def messages(frames):
+    yield "START_RECORDING"
+    for frame in frames:
+        yield frame
+    yield "STOP_RECORDING"
+
+
+async def wave_handler(frames, path):
+    is_recording, audio_file, received = False, None, 0
+    async for message in messages(frames):
+        if isinstance(message, str):
+            if message == "START_RECORDING" and not is_recording:
+                is_recording, received = True, 0
+                audio_file = wave.open(path, 'wb')
+                audio_file.setnchannels(1)
+                audio_file.setsampwidth(2)
+                audio_file.setframerate(16000)
+            elif message == "STOP_RECORDING" and is_recording:
+                is_recording = False
+                audio_file.close()
+        elif isinstance(message, bytes):
+            if is_recording and audio_file:
+                audio_file.writeframesraw(message)
+                received += len(message)
+
+
+async def buffer_handler(frames, path, recording):
+    is_recording = False
+    async for message in messages(frames):
+        if type(message) is bytes:
+            if is_recording:
+                recording.append(message)
+            continue
+        if message == "START_RECORDING" and not is_recording:
+            is_recording = True
+            recording.clear()
+        elif message == "STOP_RECORDING" and is_recording:
+            is_recording = False
+            recording.write_wav(path)
+
+
+async def run(handler, frames, path):
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    for _ in range(RECORDINGS):
+        await handler(frames, path)
+    return time.process_time() - cpu_start, time.perf_counter() - wall_start
+
+
+def main():
+    frame = bytes(range(256)) * (FRAME_BYTES // 256) + b"\0" * (FRAME_BYTES % 256)
+    frames = [bytes(frame) for _ in range(int(SECONDS * 32000 / FRAME_BYTES))]
+    total = RECORDINGS * len(frames)
+    recording = RecordingBuffer()  # one per connection, reused across its recordings
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "utterance.wav")
+        print(f"{RECORDINGS} recordings of {SECONDS:.1f}s, {len(frames)} frames of {FRAME_BYTES} bytes each")
+        print(f"{'handler':<8} {'frames/s/core':>14} {'us/frame cpu':>13} {'wall s':>8}")
+        for name, handler in (("wave", wave_handler),
+                              ("buffer", lambda f, p: buffer_handler(f, p, recording))):
+            cpu_s, wall_s = asyncio.run(run(handler, frames, path))
+            print(f"{name:<8} {total / cpu_s:>14,.0f} {cpu_s / total * 1e6:>13.2f} {wall_s:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
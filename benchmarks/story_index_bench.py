@@ -0,0 +1,87 @@
+"""
+Benchmark for story_teller tag matching.
+Compares the previous linear scan over every story tag with the inverted
+StoryIndex on a synthetic library, and building the index against loading
+the saved copy (what each pipeline process does).
+
+Usage: python benchmarks/story_index_bench.py [num_stories] [num_queries]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from langgraph.story_index import StoryIndex
+
+VOCABULARY = [
+    "лиса", "заяц", "волк", "медведь", "колобок", "репка", "рыбка", "царь",
+    "принцесса", "дракон", "море", "лес", "зима", "дружба", "смелость",
+    "жадность", "пушкин", "волшебство", "кот", "собака", "fox", "bear",
+    "dragon", "forest", "friendship", "magic", "princess", "winter",
+]
+QUERIES = [
+    "расскажи сказку про лису",
+    "хочу историю про медведя и зайца",
+    "tell me a story about a fox and a dragon",
+    "сказку про дружбу",
+    "something about magic in the forest",
+    "а что было дальше",
+]
+
+
+def make_library(num_stories, rng):
+    stories = []
+    for i in range(num_stories):
+        tags = rng.sample(VOCABULARY, 3) + [f"тема{i % 500}", "русская сказка"]
+        stories.append({"title": f"История {i}", "text": "...", "tags": tags})
+    return stories
+
+
+def linear_scan(stories, user_input):
+    input_lower = user_input.lower()
+    return [story for story in stories
+            if any(tag.lower() in input_lower for tag in story.get("tags", []))]
+
+
+def time_queries(fn, queries):
+    start = time.perf_counter()
+    for query in queries:
+        fn(query)
+    return (time.perf_counter() - start) / len(queries)
+
+
+def main():
+    num_stories = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    num_queries = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    rng = random.Random(42)
+    stories = make_library(num_stories, rng)
+    queries = [rng.choice(QUERIES) for _ in range(num_queries)]
+
+    start = time.perf_counter()
+    index = StoryIndex(stories)
+    build_s = time.perf_counter() - start
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "stories.tags.json")
+        index.save(path, {"source_size": num_stories})
+        start = time.perf_counter()
+        StoryIndex.load(path, {"source_size": num_stories})
+        load_s = time.perf_counter() - start
+
+    scan_s = time_queries(lambda q: linear_scan(stories, q), queries)
+    index_s = time_queries(index.best_matches, queries)
+
+    print(f"Stories: {num_stories}, queries: {num_queries}")
+    print(f"Index build:      {build_s * 1000:8.1f} ms (when the stories change)")
+    print(f"Index load:       {load_s * 1000:8.1f} ms (once per process)")
+    print(f"Linear scan:      {scan_s * 1000:8.3f} ms/query")
+    print(f"Inverted index:   {index_s * 1000:8.3f} ms/query")
+    print(f"Speedup:          {scan_s / index_s:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
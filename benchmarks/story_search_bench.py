@@ -0,0 +1,63 @@
+"""
+Benchmark for story similarity retrieval.
+Builds a synthetic library in a temporary directory, embeds it once and
+reports per-query search latency against the configured budget.
+
+Usage: python benchmarks/story_search_bench.py [num_stories] [num_queries]
+"""
+
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from langgraph.story_store import StoryStore
+from langgraph.story_search import StorySearch, SEARCH_BUDGET_MS
+
+WORDS = ("лиса заяц волк медведь колобок репка рыбка царь лес море дед баба "
+         "девочка мальчик дракон принцесса зима дружба хлеб кот").split()
+QUERIES = ["сказка про лису и колобка", "про деда и бабку", "история про дракона и принцессу",
+           "про кота зимой в лесу", "a story about a fox and bread"]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def main():
+    num_stories = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    num_queries = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    rng = random.Random(7)
+    with tempfile.TemporaryDirectory() as tmp:
+        source_path = os.path.join(tmp, "stories.json")
+        stories = [{"title": f"История {i}", "tags": rng.sample(WORDS, 2),
+                    "text": " ".join(rng.choices(WORDS, k=120))} for i in range(num_stories)]
+        with open(source_path, 'w', encoding='utf-8') as f:
+            json.dump(stories, f, ensure_ascii=False)
+
+        store = StoryStore(source_path)
+        start = time.perf_counter()
+        search = StorySearch.build(store)
+        build_s = time.perf_counter() - start
+
+        latencies = []
+        for _ in range(num_queries):
+            start = time.perf_counter()
+            search.search(rng.choice(QUERIES), k=3)
+            latencies.append((time.perf_counter() - start) * 1000)
+        store.close()
+
+    print(f"Stories: {num_stories}, queries: {num_queries}, encoder: {search.encoder_name}")
+    print(f"Embedding build: {build_s:8.2f} s (once per corpus change)")
+    print(f"Search p50:      {percentile(latencies, 0.5):8.2f} ms")
+    print(f"Search p95:      {percentile(latencies, 0.95):8.2f} ms (budget {SEARCH_BUDGET_MS:.0f} ms)")
+
+
+if __name__ == "__main__":
+    main()
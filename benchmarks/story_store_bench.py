@@ -0,0 +1,65 @@
+"""
+Benchmark for story corpus loading.
+Compares json.load of the whole library with opening the compiled
+StoryStore and reading a single story, on a synthetic library written to a
+temporary directory.
+
+Usage: python benchmarks/story_store_bench.py [num_stories]
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from langgraph.story_store import StoryStore, build_store
+
+STORY_TEXT = "Жили-были дед да баба. Однажды баба испекла колобка и положила его остывать на оконце. " * 20
+
+
+def measure(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    num_stories = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    with tempfile.TemporaryDirectory() as tmp:
+        source_path = os.path.join(tmp, "stories.json")
+        stories = [{"title": f"История {i}", "text": STORY_TEXT, "tags": ["колобок", f"тема{i}"]}
+                   for i in range(num_stories)]
+        with open(source_path, 'w', encoding='utf-8') as f:
+            json.dump(stories, f, ensure_ascii=False)
+        del stories
+        build_store(source_path)
+
+        def load_json():
+            with open(source_path, 'r', encoding='utf-8') as f:
+                return json.load(f)[num_stories // 2]["text"]
+
+        def load_store():
+            store = StoryStore(source_path)
+            text = store.text(num_stories // 2)
+            store.close()
+            return text
+
+        _, json_s, json_peak = measure(load_json)
+        _, store_s, store_peak = measure(load_store)
+
+    print(f"Stories: {num_stories} ({len(STORY_TEXT)} chars each)")
+    print(f"json.load:   {json_s * 1000:8.1f} ms, peak {json_peak / 1e6:8.2f} MB")
+    print(f"StoryStore:  {store_s * 1000:8.1f} ms, peak {store_peak / 1e6:8.2f} MB")
+
+
+if __name__ == "__main__":
+    main()
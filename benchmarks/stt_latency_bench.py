@@ -0,0 +1,129 @@
+"""
+Transcription latency of the offline model against the remote API.
+Sends the same utterances through each STT provider one at a time, then
+CONCURRENCY at once (several toys that stopped talking together), and
+reports latency per utterance, real-time factor (latency / audio length)
+and throughput (audio seconds transcribed per wall second). Each provider
+gets one untimed call first, which loads the local model and opens the
+remote connection pool. Providers that are not set up (no DEEP_INFRA_KEY,
+faster-whisper not installed) are skipped.
+
+Utterances are the given WAV files, else the server's recordings in
+received_audio_wav/, else synthetic tones (fine for the remote API's
+round trip, meaningless for the local model's decoding time).
+
+Usage: python benchmarks/stt_latency_bench.py [--providers deepinfra,local] [--concurrency 4]
+                                               [--rounds 3] [wav ...]
+"""
+
+import argparse
+import glob
+import logging
+import math
+import os
+import struct
+import sys
+import tempfile
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from utils.utils import transcribe_audio
+
+logging.getLogger("utils.utils").setLevel(logging.WARNING)
+
+
+def wav_seconds(path):
+    with wave.open(path, 'rb') as wf:
+        return wf.getnframes() / wf.getframerate()
+
+
+def synthetic_utterances(directory, count=6):
+    paths = []
+    for i in range(count):
+        seconds = 1.5 + i
+        samples = (int(8000 * math.sin(2 * math.pi * (220 + 40 * i) * n / 16000)) for n in range(int(seconds * 16000)))
+        path = os.path.join(directory, f"tone_{i}.wav")
+        with wave.open(path, 'wb') as wf:
+            wf.setnchannels(1)
+            wf.setsampwidth(2)
+            wf.setframerate(16000)
+            wf.writeframes(b"".join(struct.pack("<h", s) for s in samples))
+        paths.append(path)
+    return paths
+
+
+def skip_reason(provider):
+    kind = provider.split(":", 1)[0]
+    if kind == "deepinfra" and not os.getenv("DEEP_INFRA_KEY"):
+        return "DEEP_INFRA_KEY not set"
+    if kind == "assemblyai" and not os.getenv("ASSEMBLYAI_API_KEY"):
+        return "ASSEMBLYAI_API_KEY not set"
+    if kind == "local":
+        from utils.local_stt import WhisperModel
+        if WhisperModel is None:
+            return "faster-whisper not installed"
+    return None
+
+
+def timed(provider, path):
+    started = time.perf_counter()
+    text = transcribe_audio(path, provider)
+    return time.perf_counter() - started, text
+
+
+def run(provider, paths, concurrency, rounds):
+    """Returns (latencies s, real-time factors, failures, wall s)."""
+    latencies, rtfs, failures = [], [], 0
+    with ThreadPoolExecutor(concurrency) as pool:
+        wall_start = time.perf_counter()
+        for _ in range(rounds):
+            for i in range(0, len(paths), concurrency):
+                group = paths[i:i + concurrency]
+                for path, (latency, text) in zip(group, pool.map(lambda p: timed(provider, p), group)):
+                    latencies.append(latency)
+                    rtfs.append(latency / wav_seconds(path))
+                    failures += text is None
+        wall_s = time.perf_counter() - wall_start
+    return np.array(latencies), np.array(rtfs), failures, wall_s
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("wavs", nargs="*")
+    parser.add_argument("--providers", default="deepinfra,local")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = args.wavs or sorted(glob.glob(os.path.join(project_root, "received_audio_wav", "*.wav")))[:16]
+        if not paths:
+            print("No recordings found; using synthetic tones")
+            paths = synthetic_utterances(tmp)
+        audio_s = sum(wav_seconds(p) for p in paths) * args.rounds
+        print(f"{len(paths)} utterances ({audio_s / args.rounds:.1f}s of audio) x {args.rounds} rounds")
+        print(f"{'provider':<14} {'conc':>4} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} {'RTF':>6} "
+              f"{'audio s/s':>10} {'failed':>7}")
+        for provider in [p.strip() for p in args.providers.split(",") if p.strip()]:
+            reason = skip_reason(provider)
+            if reason:
+                print(f"{provider:<14} skipped: {reason}")
+                continue
+            warm_start = time.perf_counter()
+            timed(provider, paths[0])
+            print(f"{provider:<14} (first call {time.perf_counter() - warm_start:.1f}s)")
+            for concurrency in sorted({1, args.concurrency}):
+                latencies, rtfs, failures, wall_s = run(provider, paths, concurrency, args.rounds)
+                print(f"{provider:<14} {concurrency:>4} {np.median(latencies) * 1000:>8.0f} "
+                      f"{np.percentile(latencies, 95) * 1000:>8.0f} {latencies.max() * 1000:>8.0f} "
+                      f"{np.median(rtfs):>6.2f} {audio_s / wall_s:>10.1f} {failures:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Stand-in for server/pipeline_script.py in load tests.
+Speaks the same contract (WAV path or --text <utterance> in argv,
+FINAL_LLM_RESPONSE:<text> on stdout) but replaces STT and the LLM with fixed sleeps, so a load test
+measures the server rather than the remote APIs.
+
+Enable with PIPELINE_SCRIPT_PATH=benchmarks/stub_pipeline.py.
+Latencies: STUB_STT_LATENCY_S (default 0.5), STUB_LLM_LATENCY_S (default 1.0).
+"""
+
+import os
+import sys
+import time
+import wave
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from utils.tracing import trace_from_env
+
+STUB_STT_LATENCY_S = float(os.getenv("STUB_STT_LATENCY_S", "0.5"))
+STUB_LLM_LATENCY_S = float(os.getenv("STUB_LLM_LATENCY_S", "1.0"))
+STUB_RESPONSE = os.getenv("STUB_RESPONSE", "Hello! I am Mishka, and I love telling stories to my friends.")
+
+
+def main() -> None:
+    if len(sys.argv) == 3 and sys.argv[1] == "--text":
+        # Prefetcher request: no STT
+        time.sleep(STUB_LLM_LATENCY_S)
+        print(f"FINAL_LLM_RESPONSE:{STUB_RESPONSE}")
+        return
+    if len(sys.argv) != 2:
+        print("Usage: python stub_pipeline.py <path_to_wav_file> | --text <utterance>", file=sys.stderr)
+        sys.exit(1)
+
+    trace = trace_from_env()
+    with trace.span("stt"):
+        with wave.open(sys.argv[1], 'rb') as wf:
+            wf.readframes(wf.getnframes())
+        time.sleep(STUB_STT_LATENCY_S)
+    with trace.span("llm"):
+        time.sleep(STUB_LLM_LATENCY_S)
+
+    print(f"FINAL_LLM_RESPONSE:{STUB_RESPONSE}")
+    sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
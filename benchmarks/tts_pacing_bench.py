@@ -0,0 +1,128 @@
+"""
+Reply audio gaps and drops on the device under network jitter, in virtual time.
+Replays TTS replies (chunks of random length, synthesized faster than real
+time) through three senders:
+  passthrough  TTS chunks as they come, next one after half its duration (the old sender)
+  fixed        512-byte-frame messages, fixed TTS_PREBUFFER_MIN_S lead
+  adaptive     512-byte-frame messages, lead from the device's measured RTT variation
+The network delivers messages in order with a base delay plus random jitter.
+The device model follows the firmware: each message is written to an I2S
+DMA ring of 8 x 512 bytes, waiting up to 100 ms for room, after which the
+rest is dropped. Gaps are times the ring ran dry before the reply ended.
+
+Usage: python benchmarks/tts_pacing_bench.py [replies] [seed]
+"""
+
+import os
+import sys
+
+import numpy as np
+
+REPLIES = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+SEED = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from server.playback import TTS_PREBUFFER_MIN_S, NetworkEstimate, PlaybackPacer, Rechunker
+
+BPS = 32000
+DMA_BYTES = 8 * 512
+I2S_WRITE_TIMEOUT_S = 0.1
+TTS_REALTIME_FACTOR = 4.0
+# (name, base one-way delay s, mean jitter s, spike probability)
+NETWORKS = [("lan", 0.002, 0.002, 0.0), ("wifi", 0.01, 0.015, 0.02), ("poor wifi", 0.03, 0.04, 0.05)]
+
+
+def tts_source(rng):
+    """(ready time, bytes) of one reply's chunks: 2-8 s of audio in 20-400 ms chunks."""
+    total_s, t, out = rng.uniform(2, 8), rng.uniform(0.05, 0.2), []
+    produced = 0.0
+    while produced < total_s:
+        chunk_s = min(total_s - produced, rng.uniform(0.02, 0.4))
+        t += chunk_s / TTS_REALTIME_FACTOR
+        out.append((t, int(chunk_s * BPS) // 2 * 2))
+        produced += chunk_s
+    return out
+
+
+def one_way_delay(rng, base, jitter, spike_p):
+    delay = base + rng.exponential(jitter) if jitter else base
+    if rng.random() < spike_p:
+        delay += rng.uniform(0.05, 0.3)  # Wi-Fi retransmission burst
+    return delay
+
+
+def send_passthrough(source):
+    sends, t = [], 0.0
+    for ready, nbytes in source:
+        t = max(t, ready)
+        sends.append((t, nbytes))
+        t += 0.5 * nbytes / BPS
+    return sends
+
+
+def send_paced(source, target_s):
+    rechunker, pacer, sends, t = Rechunker(), PlaybackPacer(target_s), [], 0.0
+    pieces = [(ready, m) for ready, nbytes in source for m in rechunker.push(bytes(nbytes))]
+    pieces += [(source[-1][0], m) for m in rechunker.flush()]
+    for ready, message in pieces:
+        t = max(t, ready)
+        t += pacer.wait_s(t)
+        pacer.sent(t, len(message))
+        sends.append((t, len(message)))
+    return sends
+
+
+def device(sends, rng, network):
+    """Returns (startup s, gaps, gap s, dropped s, peak lead s) of one reply on the device."""
+    arrival, arrivals = 0.0, []
+    for sent, nbytes in sends:
+        arrival = max(arrival, sent + one_way_delay(rng, *network))  # TCP keeps order
+        arrivals.append((arrival, nbytes))
+    dma, clock, gaps, gap_s, dropped = 0.0, arrivals[0][0], 0, 0.0, 0.0
+    for i, (arrived, nbytes) in enumerate(arrivals):
+        t = max(arrived, clock)
+        played = (t - clock) * BPS
+        if played > dma and i:
+            gaps += 1
+            gap_s += (played - dma) / BPS
+        dma = max(0.0, dma - played)
+        room = DMA_BYTES - dma
+        if nbytes <= room:
+            dma += nbytes
+        else:
+            # i2s_write blocks while the ring drains, for up to the timeout; the rest is dropped
+            wait = min(I2S_WRITE_TIMEOUT_S, (nbytes - room) / BPS)
+            dropped += nbytes - (room + wait * BPS)
+            dma, t = DMA_BYTES, t + wait
+        clock = t
+    # Lead = audio sent but not yet played (in flight, in the socket and in the ring)
+    sent_s = np.cumsum([nbytes for _, nbytes in sends]) / BPS
+    peak = float(np.max(sent_s - (np.array([t for t, _ in sends]) - sends[0][0])))
+    return arrivals[0][0] - sends[0][0], gaps, gap_s, max(0.0, dropped) / BPS, peak
+
+
+def main():
+    print(f"{REPLIES} replies per network, seed {SEED}")
+    print(f"{'network':<10} {'sender':<12} {'lead ms':>8} {'gaps/reply':>11} {'gap ms/reply':>13} "
+          f"{'dropped ms':>11} {'startup ms':>11} {'peak lead s':>12}")
+    for name, base, jitter, spike_p in NETWORKS:
+        network = (base, jitter, spike_p)
+        estimate = NetworkEstimate()
+        probe_rng = np.random.default_rng(SEED + 1)
+        for _ in range(10):  # pings at connect and at each STOP_RECORDING
+            estimate.observe(one_way_delay(probe_rng, *network) + one_way_delay(probe_rng, *network))
+        senders = [("passthrough", None, send_passthrough),
+                   ("fixed", TTS_PREBUFFER_MIN_S, lambda src: send_paced(src, TTS_PREBUFFER_MIN_S)),
+                   ("adaptive", estimate.prebuffer_s(), lambda src: send_paced(src, estimate.prebuffer_s()))]
+        for sender, lead_s, send in senders:
+            source_rng, network_rng = np.random.default_rng(SEED), np.random.default_rng(SEED + 2)
+            rows = np.array([device(send(tts_source(source_rng)), network_rng, network) for _ in range(REPLIES)])
+            lead = f"{lead_s * 1000:.0f}" if lead_s is not None else "-"
+            print(f"{name:<10} {sender:<12} {lead:>8} {rows[:, 1].mean():>11.2f} {rows[:, 2].mean() * 1000:>13.1f} "
+                  f"{rows[:, 3].mean() * 1000:>11.1f} {np.median(rows[:, 0]) * 1000:>11.1f} {np.median(rows[:, 4]):>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
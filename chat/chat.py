@@ -12,21 +12,18 @@ from langgraph.agent import Agent
 
 load_dotenv()
 
-# Initialize database connection and memory
-conn, cursor, memory = initialize_db()
-
 # Get personality path - use absolute path to ensure it works
 current_dir = os.path.dirname(os.path.abspath(__file__))
 project_root = os.path.dirname(current_dir)
 personality_path = os.path.join(project_root, "data", "toy.json")
-print(f"Loading personality from: {personality_path}") 
-
-
-llm = setup_llm()
 
 # tools = [history_search, story_teller, input_validator]
 
 def main():
+    # Database and LLM are opened when the chat starts, not at import
+    conn, cursor, memory = initialize_db()
+    print(f"Loading personality from: {personality_path}")
+    llm = setup_llm()
     agent = Agent(llm, memory, personality_path)
     while True:
 
@@ -3,6 +3,7 @@ Shared configuration settings for the chat application.
 This avoids circular imports between modules.
 """
 import logging
+import os
 
 
 def setup_logging(level=logging.INFO):
@@ -17,5 +18,5 @@ def setup_logging(level=logging.INFO):
 # Initialize logger
 logger = setup_logging()
 
-# LangGraph thread configuration
-langgraph_config = {"configurable": {"thread_id": "main_thread"}} 
\ No newline at end of file
+# LangGraph thread configuration; the server sets THREAD_ID per device
+langgraph_config = {"configurable": {"thread_id": os.getenv("THREAD_ID", "main_thread")}}
\ No newline at end of file
@@ -1,9 +1,11 @@
 import os
 import sqlite3
-from typing import Tuple, Optional, List, Dict, Any
-from langgraph.checkpoint.sqlite import SqliteSaver
+from typing import TYPE_CHECKING, Tuple, Optional, List, Dict, Any
 import logging
 
+if TYPE_CHECKING:
+    from langgraph.checkpoint.sqlite import SqliteSaver
+
 def get_db_path() -> str:
     """Get the database path from environment or default"""
     current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -67,11 +69,13 @@ def create_db(db_path: str = None) -> Tuple[sqlite3.Connection, sqlite3.Cursor]:
     conn.commit()
     return conn, cursor
 
-def create_memory_saver(conn: sqlite3.Connection) -> SqliteSaver:
+def create_memory_saver(conn: sqlite3.Connection) -> "SqliteSaver":
     """Create a SqliteSaver for graph memory"""
+    # Imported here so the server can read chat history without loading langgraph
+    from langgraph.checkpoint.sqlite import SqliteSaver
     return SqliteSaver(conn)
 
-def initialize_db() -> Tuple[sqlite3.Connection, sqlite3.Cursor, SqliteSaver]:
+def initialize_db() -> Tuple[sqlite3.Connection, sqlite3.Cursor, "SqliteSaver"]:
     """Initialize the database and return connection, cursor and memory saver"""
     db_path = get_db_path()
     db_exists = os.path.exists(db_path)
@@ -117,4 +121,23 @@ def create_conversation(cursor: sqlite3.Cursor, user_id: str, session_id: str) -
         (user_id, session_id)
     )
     cursor.connection.commit()
-    return cursor.lastrowid 
\ No newline at end of file
+    return cursor.lastrowid 
+
+def get_or_create_conversation(cursor: sqlite3.Cursor, user_id: str, session_id: str) -> int:
+    """Return the latest conversation ID for user/session, creating one if there is none"""
+    cursor.execute(
+        "SELECT id FROM conversations WHERE user_id = ? AND session_id = ? ORDER BY id DESC LIMIT 1",
+        (user_id, session_id)
+    )
+    row = cursor.fetchone()
+    return row[0] if row else create_conversation(cursor, user_id, session_id)
+
+def get_recent_user_turns(cursor: sqlite3.Cursor, limit: int = 5000) -> List[Tuple[int, str]]:
+    """Get the most recent user messages as (conversation_id, content), oldest first within each conversation"""
+    cursor.execute(
+        "SELECT conversation_id, content FROM ("
+        " SELECT id, conversation_id, content FROM messages WHERE role = 'user' ORDER BY id DESC LIMIT ?"
+        ") ORDER BY conversation_id, id",
+        (limit,)
+    )
+    return cursor.fetchall()
@@ -1,4 +1,8 @@
+import asyncio
+from typing import AsyncIterator
+
 from langgraph.graph import StateGraph, START, END
+from langgraph.config import get_stream_writer
 from langchain_core.messages import HumanMessage
 from langchain_core.output_parsers import JsonOutputParser
 import logging
@@ -13,6 +17,7 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 
 from config.config import langgraph_config
+from utils.tracing import get_current_trace
 
 
 
@@ -20,12 +25,14 @@ logger = logging.getLogger(__name__)
 
 
 class Agent:
-    def __init__(self, model, checkpointer, personality_path, system="", memory_treshold=5):
+    def __init__(self, model, checkpointer, personality_path, system="", memory_treshold=5, asynchronous=False):
         self.system = system
         # self.tools = {t.name: t for t in tools}
         self.model = model
         self.checkpointer = checkpointer
         self.personality_path = personality_path
+        # An asynchronous agent runs with astream_reply() (and an async checkpointer) on an event loop
+        self.asynchronous = asynchronous
         self.graph = self._build_graph()
         self.memory_treshold = memory_treshold
         # logger.info("Agent initialized with %d tools", len(tools))
@@ -49,13 +56,27 @@ class Agent:
         # logger.debug("Graph built with nodes: thinking, execute_tool, chatbot")
         # return graph.compile(checkpointer=self.checkpointer)
     
-        graph.add_node("chatbot", self.chatbot)
+        graph.add_node("chatbot", self._traced("chatbot", self.achatbot if self.asynchronous else self.chatbot))
         graph.add_edge(START, "chatbot")
         graph.add_edge("chatbot",END)
         
         logger.debug("Graph built with nodes: chatbot")
         return graph.compile(checkpointer=self.checkpointer)
 
+    @staticmethod
+    def _traced(name, node):
+        """Wraps a graph node so its run time is recorded as a node.<name> span."""
+        if asyncio.iscoroutinefunction(node):
+            async def run_async(state: State):
+                with get_current_trace().span(f"node.{name}"):
+                    return await node(state)
+            return run_async
+
+        def run(state: State):
+            with get_current_trace().span(f"node.{name}"):
+                return node(state)
+        return run
+
     def input_validation(self, state: State) -> State:
         user_input = state.messages[-1].content
         validated_input = self.input_validator(user_input)
@@ -195,15 +216,37 @@ class Agent:
 
     def chatbot(self, state: State):
         if state.tool == "story_teller" and state.tool_output:
-            logger.info("Using story_teller output for response")
-            story_msg = HumanMessage(content=state.tool_output)
-            return State(
-                messages=state.messages + [story_msg],
-                tool="",
-                tool_output="",
-                safety_issue=False
-            )
+            return self._story_reply(state)
+        return self._reply_state(state, self._generate(self._chatbot_prompt(state)))
+
+    async def achatbot(self, state: State):
+        """chatbot() for the asynchronous graph; the reply is streamed to astream_reply() as it is generated."""
+        if state.tool == "story_teller" and state.tool_output:
+            get_stream_writer()(state.tool_output)
+            return self._story_reply(state)
+        return self._reply_state(state, await self._agenerate(self._chatbot_prompt(state)))
 
+    def _story_reply(self, state: State):
+        logger.info("Using story_teller output for response")
+        story_msg = HumanMessage(content=state.tool_output)
+        return State(
+            messages=state.messages + [story_msg],
+            tool="",
+            tool_output="",
+            safety_issue=False
+        )
+
+    def _reply_state(self, state: State, response_text: str):
+        new_messages = state.messages + [HumanMessage(content=response_text)]
+
+        return State(
+            messages = new_messages,
+            tool="",
+            tool_output = "",
+            safety_issue=False
+        )
+
+    def _chatbot_prompt(self, state: State) -> str:
         current_message = state.messages[-1].content if state.messages else ""
         short_memory = [msg.content for msg in state.messages[-10:-1]]
 
@@ -251,15 +294,58 @@ class Agent:
             "инструкция": {prompt_instructions}
         """
         logger.debug("Generating chatbot response")
-        response = self.model.invoke(info)
-        new_messages = state.messages + [HumanMessage(content=response.content)]
-        
-        return State(
-            messages = new_messages,
-            tool="",
-            tool_output = "",
-            safety_issue=False
-        )
+        return info
+
+    def _generate(self, prompt: str) -> str:
+        """Streams the model response, recording time to first token and total LLM time."""
+        trace = get_current_trace()
+        llm_span = trace.start_span("llm")
+        first_token_span = trace.start_span("llm_first_token")
+        parts = []
+        for chunk in self.model.stream(prompt):
+            if chunk.content:
+                first_token_span.end()
+                parts.append(chunk.content if isinstance(chunk.content, str) else str(chunk.content))
+        llm_span.end(chunks=len(parts))
+        return "".join(parts)
+
+    async def _agenerate(self, prompt: str) -> str:
+        """_generate() without blocking the event loop; each piece also goes to the graph's custom stream."""
+        trace = get_current_trace()
+        write = get_stream_writer()
+        llm_span = trace.start_span("llm")
+        first_token_span = trace.start_span("llm_first_token")
+        parts = []
+        async for chunk in self.model.astream(prompt):
+            if chunk.content:
+                first_token_span.end()
+                part = chunk.content if isinstance(chunk.content, str) else str(chunk.content)
+                parts.append(part)
+                write(part)
+        llm_span.end(chunks=len(parts))
+        return "".join(parts)
+
+    async def astream_reply(self, user_input: str, thread_id: str = None) -> AsyncIterator[str]:
+        """Runs the asynchronous graph and yields the reply as it is generated.
+        thread_id selects the conversation memory (default: the process's langgraph_config)."""
+        logger.info("Processing user input: %s", user_input[:50] + "..." if len(user_input) > 50 else user_input)
+        config = {"configurable": {"thread_id": thread_id}} if thread_id else langgraph_config
+        async for part in self.graph.astream({"messages": [HumanMessage(content=user_input)]}, config,
+                                             stream_mode="custom"):
+            yield part
+        logger.info("Assistant response ready")
+
+    def _turn_update(self, user_input: str, reply: str, thread_id: str = None):
+        config = {"configurable": {"thread_id": thread_id}} if thread_id else langgraph_config
+        return config, {"messages": [HumanMessage(content=user_input), HumanMessage(content=reply)]}
+
+    def remember_turn(self, user_input: str, reply: str, thread_id: str = None) -> None:
+        """Adds a turn answered without running the graph (a prefetched reply) to the conversation memory."""
+        self.graph.update_state(*self._turn_update(user_input, reply, thread_id), as_node="chatbot")
+
+    async def aremember_turn(self, user_input: str, reply: str, thread_id: str = None) -> None:
+        """remember_turn() for the asynchronous graph."""
+        await self.graph.aupdate_state(*self._turn_update(user_input, reply, thread_id), as_node="chatbot")
 
     def stream_graph_updates(self, user_input: str):
         # Use shared configuration
@@ -0,0 +1,149 @@
+"""
+Inverted tag index for the story_teller tool.
+Tags are normalized and stemmed once when the index is built, so matching a
+request costs one dictionary lookup per input word instead of a scan over
+every tag of every story. The built index is saved next to the story store
+(stories.tags.json), so the per-turn pipeline process loads it instead of
+rebuilding it from the whole corpus.
+"""
+import json
+import logging
+import math
+import os
+import re
+from collections import defaultdict
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Bump when normalize()/stem() change: saved indexes hold stemmed words
+INDEX_FORMAT_VERSION = 2
+
+_TOKEN_RE = re.compile(r"[0-9a-zа-я]+")
+
+# Longest suffixes first so "ами" is stripped before "и".
+_RU_SUFFIXES = sorted((
+    "иями", "ями", "ами", "ого", "его", "ому", "ему", "ыми", "ими", "ией",
+    "ой", "ей", "ий", "ый", "ая", "яя", "ое", "ее", "ые", "ие", "ую", "юю", "ам", "ям",
+    "ах", "ях", "ом", "ем", "ов", "ев", "ью", "ия", "ья", "ию",
+    "а", "я", "о", "е", "ы", "и", "у", "ю", "ь", "й",
+), key=len, reverse=True)
+_EN_SUFFIXES = ("ing", "ies", "ed", "ly")
+# Plural "es" only follows these ("foxes", "princesses"); elsewhere it is "e" + "s" ("tales", "horses")
+_EN_SIBILANTS = ("ss", "x", "z", "ch", "sh")
+# Words ending in these keep their final "s" ("princess", "bus", "iris")
+_EN_NOT_PLURAL = ("ss", "us", "is")
+_MIN_STEM_LEN = 3
+
+
+@lru_cache(maxsize=65536)
+def stem(token: str) -> str:
+    """Strips a common Russian or English inflection from a lowercase token."""
+    if token.isascii():
+        for suffix in _EN_SUFFIXES:
+            if token.endswith(suffix) and len(token) - len(suffix) >= _MIN_STEM_LEN:
+                return token[:-len(suffix)] + ("y" if suffix == "ies" else "")
+        if token.endswith("es") and token[:-2].endswith(_EN_SIBILANTS) and len(token) - 2 >= _MIN_STEM_LEN:
+            return token[:-2]
+        if token.endswith("s") and not token.endswith(_EN_NOT_PLURAL) and len(token) - 1 >= _MIN_STEM_LEN:
+            return token[:-1]
+        return token
+    for suffix in _RU_SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= _MIN_STEM_LEN:
+            return token[:-len(suffix)]
+    # Fleeting vowel: "колобок" declines to "колобка", so both stem to "колобк".
+    if len(token) >= 6 and token[-2:] in ("ок", "ек"):
+        return token[:-2] + token[-1]
+    return token
+
+
+def normalize(text: str) -> List[str]:
+    """Lowercases text, folds 'ё' to 'е' and returns the stemmed words."""
+    text = text.lower().replace("ё", "е")
+    return [stem(token) for token in _TOKEN_RE.findall(text)]
+
+
+class StoryIndex:
+    """Maps stemmed tag words to the stories carrying them.
+
+    Identical tags are stored once, so a tag shared by the whole library
+    ("русская сказка") costs a single lookup. A multi-word tag matches only
+    when every one of its words appears in the request. Matches are ranked by
+    the sum of the inverse document frequency of the matched tags, so a rare
+    tag ("колобок") outweighs a common one.
+    """
+
+    def __init__(self, stories: Iterable[dict] = ()):
+        self._postings: Dict[str, List[Tuple[str, ...]]] = defaultdict(list)
+        self._tag_stories: Dict[Tuple[str, ...], List[int]] = defaultdict(list)
+        self._tag_weights: Dict[Tuple[str, ...], float] = {}
+        self.size = 0
+
+        for story_id, story in enumerate(stories):
+            seen = set()
+            for tag in story.get("tags", []):
+                words = tuple(dict.fromkeys(normalize(tag)))
+                if words and words not in seen:
+                    seen.add(words)
+                    self._tag_stories[words].append(story_id)
+            self.size = story_id + 1
+        self._finish()
+
+    def _finish(self) -> None:
+        for words, story_ids in self._tag_stories.items():
+            self._tag_weights[words] = math.log(1 + self.size / len(story_ids))
+            for word in words:
+                self._postings[word].append(words)
+
+    def save(self, path: str, signature: dict) -> None:
+        """Writes the index with the signature of the corpus it was built from."""
+        data = {"version": INDEX_FORMAT_VERSION, **signature, "size": self.size,
+                "tags": [[list(words), story_ids] for words, story_ids in self._tag_stories.items()]}
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str, signature: dict) -> Optional["StoryIndex"]:
+        """Reads a saved index; None if it is missing or was built from another corpus."""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("version") != INDEX_FORMAT_VERSION or any(data.get(k) != v for k, v in signature.items()):
+            return None
+        index = cls()
+        index.size = data["size"]
+        for words, story_ids in data["tags"]:
+            index._tag_stories[tuple(words)] = story_ids
+        index._finish()
+        return index
+
+    def __len__(self) -> int:
+        return self.size
+
+    def match(self, text: str, limit: int = None) -> List[Tuple[int, float]]:
+        """Returns (story_id, score) pairs for stories whose tags occur in text, best first."""
+        words = set(normalize(text))
+        matched_tags = {tag for word in words for tag in self._postings.get(word, ())
+                        if len(tag) == 1 or words.issuperset(tag)}
+
+        scores: Dict[int, float] = defaultdict(float)
+        for tag in matched_tags:
+            weight = self._tag_weights[tag]
+            for story_id in self._tag_stories[tag]:
+                scores[story_id] += weight
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return ranked[:limit] if limit else ranked
+
+    def best_matches(self, text: str) -> List[int]:
+        """Returns the ids of all stories sharing the top match score."""
+        ranked = self.match(text)
+        if not ranked:
+            return []
+        top_score = ranked[0][1]
+        return [story_id for story_id, score in ranked if math.isclose(score, top_score)]
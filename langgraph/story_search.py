@@ -0,0 +1,266 @@
+"""
+Similarity retrieval over story titles, tags and text.
+Used by story_teller when a request matches no tag. Every story is embedded
+once into a vector saved next to the corpus (stories.emb.npy, memory-mapped
+on load); a request is embedded the same way and stories are ranked by
+cosine similarity within a latency budget.
+
+The embeddings are built offline, never during a turn:
+
+    python langgraph/story_search.py
+
+after data/stories.json or STORY_EMBEDDING_MODEL changes. While they are
+missing or stale, story_teller picks a random story instead. The encoder is
+loaded on a process's first search, which only happens when no tag matched,
+and that load counts against the search budget.
+
+The default encoder hashes stemmed words and character trigrams into a
+fixed-size vector and needs no model download. Set STORY_EMBEDDING_MODEL to a
+sentence-transformers model name (e.g.
+"paraphrase-multilingual-MiniLM-L12-v2") for semantic, cross-language
+matching.
+"""
+import json
+import logging
+import os
+import sys
+import time
+import zlib
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langgraph.story_index import normalize
+from langgraph.story_store import StoryStore
+
+logger = logging.getLogger(__name__)
+
+HASH_DIM = 512
+BLOCK_ROWS = 4096
+ENCODE_BATCH = 256
+SEARCH_BUDGET_MS = float(os.getenv("STORY_SEARCH_BUDGET_MS", "50"))
+MIN_SCORE = float(os.getenv("STORY_SEARCH_MIN_SCORE", "0.1"))
+
+_STOP_WORDS = frozenset(normalize(
+    "a an the and or of about with story stories tale tell me please want some "
+    "и или про о об с а сказка сказку историю история расскажи расскажите пожалуйста хочу мне"
+))
+
+
+class HashingEncoder:
+    """Signed feature hashing of stemmed words and character trigrams."""
+
+    def __init__(self, dim: int = HASH_DIM):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    @staticmethod
+    def _features(text: str):
+        for word in normalize(text):
+            if word in _STOP_WORDS:
+                continue
+            yield "w:" + word
+            padded = f" {word} "
+            for i in range(len(padded) - 2):
+                yield "c:" + padded[i:i + 3]
+
+    def encode(self, texts: Sequence[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        hashes = {}
+        for row, text in enumerate(texts):
+            features = list(self._features(text))
+            if not features:
+                continue
+            for feature in features:
+                if feature not in hashes:
+                    hashes[feature] = zlib.crc32(feature.encode('utf-8'))
+            buckets = np.fromiter((hashes[feature] for feature in features), dtype=np.int64, count=len(features))
+            signs = np.where(buckets & 0x80000000, -1.0, 1.0)
+            vectors[row] = np.bincount(buckets % self.dim, weights=signs, minlength=self.dim)
+        vectors = np.sign(vectors) * np.log1p(np.abs(vectors))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1.0, norms)
+
+
+class SentenceTransformerEncoder:
+    """Dense embeddings from a local sentence-transformers model (CPU)."""
+
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+        self._model = SentenceTransformer(model_name, device="cpu")
+        self.name = f"st-{model_name}"
+
+    def encode(self, texts: Sequence[str]) -> np.ndarray:
+        vectors = self._model.encode(list(texts), normalize_embeddings=True)
+        return np.asarray(vectors, dtype=np.float32)
+
+
+def encoder_name() -> str:
+    """Name of the encoder get_encoder() returns, without loading a model."""
+    model_name = os.getenv("STORY_EMBEDDING_MODEL")
+    return f"st-{model_name}" if model_name else HashingEncoder().name
+
+
+def get_encoder():
+    """Returns the encoder selected by STORY_EMBEDDING_MODEL, falling back to hashing."""
+    model_name = os.getenv("STORY_EMBEDDING_MODEL")
+    if model_name:
+        try:
+            return SentenceTransformerEncoder(model_name)
+        except ImportError:
+            logger.warning("sentence-transformers is not installed; using hashing encoder for story search")
+        except Exception as e:
+            logger.error("Failed to load embedding model %s: %s", model_name, e)
+    return HashingEncoder()
+
+
+def embedding_paths(store: StoryStore) -> Tuple[str, str]:
+    """Returns the (vectors, metadata) paths of a store's embeddings."""
+    base = os.path.splitext(store.blob_path)[0]
+    return base + ".emb.npy", base + ".emb.json"
+
+
+def _expected_meta(store: StoryStore, name: str) -> dict:
+    return {"encoder": name, "stories": len(store), **store.signature}
+
+
+def _is_current(store: StoryStore, name: str) -> bool:
+    vectors_path, meta_path = embedding_paths(store)
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            return json.load(f) == _expected_meta(store, name) and os.path.exists(vectors_path)
+    except (OSError, ValueError):
+        return False
+
+
+def _document(store: StoryStore, story_id: int) -> str:
+    story = store.story(story_id)
+    return f"{story['title']}. {' '.join(story['tags'])}. {story['text']}"
+
+
+class StorySearch:
+    """Cosine top-k search over precomputed story embeddings."""
+
+    min_score = MIN_SCORE
+
+    def __init__(self, store: StoryStore, encoder=None):
+        """Search over the saved embeddings. Without encoder, the one they were
+        built with is loaded on the first search."""
+        self.store = store
+        self.vectors_path, self.meta_path = embedding_paths(store)
+        self.encoder_name = encoder.name if encoder else encoder_name()
+        self._encoder = encoder
+        self._encoder_failed = False
+        self.vectors = np.load(self.vectors_path, mmap_mode='r')
+
+    @classmethod
+    def open(cls, store: StoryStore) -> Optional["StorySearch"]:
+        """Search over the saved embeddings; None if they are missing or stale.
+        Never embeds the corpus and loads no model."""
+        if not _is_current(store, encoder_name()):
+            logger.warning("Story embeddings are missing or stale; run python langgraph/story_search.py")
+            return None
+        return cls(store)
+
+    @classmethod
+    def build(cls, store: StoryStore, encoder=None) -> "StorySearch":
+        """Embeds every story and saves the vectors (the offline step; see main())."""
+        encoder = encoder or get_encoder()
+        vectors_path, meta_path = embedding_paths(store)
+        logger.info("Embedding %d stories with %s", len(store), encoder.name)
+        start = time.monotonic()
+        blocks = []
+        for first in range(0, len(store), ENCODE_BATCH):
+            ids = range(first, min(first + ENCODE_BATCH, len(store)))
+            blocks.append(encoder.encode([_document(store, story_id) for story_id in ids]))
+        vectors = np.concatenate(blocks) if blocks else np.zeros((0, 1), dtype=np.float32)
+
+        vectors_tmp = f"{vectors_path}.{os.getpid()}.tmp"
+        with open(vectors_tmp, 'wb') as f:
+            np.save(f, vectors)
+        meta_tmp = f"{meta_path}.{os.getpid()}.tmp"
+        with open(meta_tmp, 'w', encoding='utf-8') as f:
+            json.dump(_expected_meta(store, encoder.name), f)
+        os.replace(vectors_tmp, vectors_path)
+        os.replace(meta_tmp, meta_path)
+        logger.info("Story embeddings saved to %s (%.2fs)", vectors_path, time.monotonic() - start)
+        return cls(store, encoder)
+
+    def _load_encoder(self):
+        """The encoder the embeddings were built with, loaded once; None if it cannot be loaded."""
+        if self._encoder is None and not self._encoder_failed:
+            encoder = get_encoder()
+            if encoder.name == self.encoder_name:
+                self._encoder = encoder
+            else:
+                # get_encoder() fell back to another encoder; its vectors are not comparable
+                self._encoder_failed = True
+                logger.error("Story embeddings were built with %s, which could not be loaded; story search is off",
+                             self.encoder_name)
+        return self._encoder
+
+    def search(self, query: str, k: int = 1, budget_ms: float = SEARCH_BUDGET_MS) -> List[Tuple[int, float]]:
+        """Returns up to k (story_id, score) pairs, best first.
+
+        Stories are scanned in blocks; once the budget is spent the best
+        matches found so far are returned. Loading the encoder on the first
+        search counts against the budget too.
+        """
+        total = len(self.vectors)
+        if total == 0:
+            return []
+        start = time.perf_counter()
+        deadline = start + budget_ms / 1000
+        encoder = self._load_encoder()
+        if encoder is None:
+            return []
+        query_vector = encoder.encode([query])[0]
+        if not query_vector.any():
+            return []
+        if time.perf_counter() > deadline:
+            logger.warning("Story search spent its %.0f ms budget before scanning (encoder load and query: %.0f ms)",
+                           budget_ms, (time.perf_counter() - start) * 1000)
+            return []
+
+        candidate_ids, candidate_scores = [], []
+        scanned = 0
+        while scanned < total:
+            block = np.asarray(self.vectors[scanned:scanned + BLOCK_ROWS]) @ query_vector
+            top = min(k, len(block))
+            best = np.argpartition(-block, top - 1)[:top]
+            candidate_ids.append(best + scanned)
+            candidate_scores.append(block[best])
+            scanned += len(block)
+            if scanned < total and time.perf_counter() > deadline:
+                logger.warning("Story search hit the %.0f ms budget after %d/%d stories", budget_ms, scanned, total)
+                break
+
+        ids = np.concatenate(candidate_ids)
+        scores = np.concatenate(candidate_scores)
+        order = np.argsort(-scores)[:k]
+        logger.debug("Story search took %.1f ms", (time.perf_counter() - start) * 1000)
+        return [(int(ids[i]), float(scores[i])) for i in order]
+
+
+def main() -> None:
+    """Builds (or refreshes) the story store and its embeddings."""
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    store = StoryStore()
+    vectors_path = embedding_paths(store)[0]
+    if _is_current(store, encoder_name()):
+        print(f"{len(store)} stories already embedded with {encoder_name()}: {vectors_path}")
+        return
+    encoder = get_encoder()
+    if encoder.name != encoder_name():
+        # Hashing vectors saved under the model's settings would never match at search time
+        print(f"!!! {encoder_name()} could not be loaded; the embeddings were not built.")
+        sys.exit(1)
+    StorySearch.build(store, encoder)
+    print(f"{len(store)} stories embedded with {encoder.name}: {vectors_path}")
+
+
+if __name__ == "__main__":
+    main()
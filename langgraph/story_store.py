@@ -0,0 +1,128 @@
+"""
+Compact on-disk story store.
+stories.json is compiled once into an offset index (titles, tags and byte
+ranges) plus a UTF-8 text blob. The blob is memory-mapped, so a process only
+pages in the text of the story it actually tells, and the page cache is
+shared between the server and every pipeline subprocess.
+"""
+import json
+import logging
+import mmap
+import os
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STORIES_PATH = os.path.join(PROJECT_ROOT, "data", "stories.json")
+STORE_FORMAT_VERSION = 1
+
+
+def store_paths(source_path: str) -> Tuple[str, str]:
+    """Returns the (index, blob) paths compiled from a stories JSON file."""
+    base = os.path.splitext(source_path)[0]
+    return base + ".idx.json", base + ".bin"
+
+
+def _source_signature(source_path: str) -> Dict[str, int]:
+    stat = os.stat(source_path)
+    return {"source_mtime_ns": stat.st_mtime_ns, "source_size": stat.st_size}
+
+
+def build_store(source_path: str = STORIES_PATH) -> None:
+    """Compiles a stories JSON file into an offset index and a text blob."""
+    index_path, blob_path = store_paths(source_path)
+    logger.info("Building story store from %s", source_path)
+    with open(source_path, 'r', encoding='utf-8') as f:
+        stories = json.load(f)
+
+    entries = []
+    offset = 0
+    blob_tmp = f"{blob_path}.{os.getpid()}.tmp"
+    with open(blob_tmp, 'wb') as blob:
+        for story in stories:
+            text = story.get("text", "").encode('utf-8')
+            blob.write(text)
+            entries.append({
+                "title": story.get("title", ""),
+                "tags": story.get("tags", []),
+                "offset": offset,
+                "length": len(text),
+            })
+            offset += len(text)
+
+    index = {"version": STORE_FORMAT_VERSION, **_source_signature(source_path), "stories": entries}
+    index_tmp = f"{index_path}.{os.getpid()}.tmp"
+    with open(index_tmp, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False)
+
+    # Blob first: a current index always points into a complete blob.
+    os.replace(blob_tmp, blob_path)
+    os.replace(index_tmp, index_path)
+    logger.info("Story store built: %d stories, %d text bytes", len(entries), offset)
+
+
+def _is_current(index: dict, source_path: str) -> bool:
+    if index.get("version") != STORE_FORMAT_VERSION:
+        return False
+    if not os.path.exists(source_path):
+        return True
+    signature = _source_signature(source_path)
+    return all(index.get(key) == value for key, value in signature.items())
+
+
+class StoryStore:
+    """Read-only access to a compiled story library.
+
+    Titles and tags are held in memory; story text is read from the
+    memory-mapped blob on demand.
+    """
+
+    def __init__(self, source_path: str = STORIES_PATH):
+        self.index_path, self.blob_path = store_paths(source_path)
+        index = self._read_index()
+        if index is None or not _is_current(index, source_path):
+            build_store(source_path)
+            index = self._read_index()
+        self._entries: List[dict] = index["stories"]
+        self.signature = {key: index.get(key) for key in ("source_mtime_ns", "source_size")}
+        self._blob = None
+
+    def _read_index(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _blob_view(self):
+        if self._blob is None:
+            with open(self.blob_path, 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return b''
+                self._blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._blob
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def metadata(self) -> List[dict]:
+        """Returns the in-memory title/tags entries, one per story id."""
+        return self._entries
+
+    def title(self, story_id: int) -> str:
+        return self._entries[story_id]["title"]
+
+    def text(self, story_id: int) -> str:
+        entry = self._entries[story_id]
+        start = entry["offset"]
+        return self._blob_view()[start:start + entry["length"]].decode('utf-8')
+
+    def story(self, story_id: int) -> dict:
+        entry = self._entries[story_id]
+        return {"title": entry["title"], "tags": entry["tags"], "text": self.text(story_id)}
+
+    def close(self) -> None:
+        if self._blob is not None:
+            self._blob.close()
+            self._blob = None
@@ -2,76 +2,109 @@ import random
 from langchain_core.tools import tool
 from langchain_core.messages import HumanMessage
 from typing import List
-from langchain_together import ChatTogether
 import os
 import json
 from dotenv import load_dotenv
 import logging
+from functools import lru_cache
+from langgraph.story_index import StoryIndex
+from langgraph.story_store import StoryStore
 
 # Set up logger
 logger = logging.getLogger(__name__)
 
 load_dotenv()
-# Get API keys from environment
-TOGETHER_API_KEY = os.getenv("TOGETHER_API_KEY")
-# Set OpenAI API key for ChatTogether which uses OpenAI under the hood
+TOOLS_MODEL_PROVIDER = os.getenv("TOOLS_MODEL_PROVIDER", "together")
+TOOLS_MODEL_NAME = "meta-llama/Llama-3.3-70B-Instruct-Turbo"
 
 
-llm = ChatTogether(
-    together_api_key=TOGETHER_API_KEY,
-    model = "meta-llama/Llama-3.3-70B-Instruct-Turbo"
-)
+# LLM clients are created on first tool call, not at import, and come from
+# the process-wide registry in utils so tools share the pipeline's
+# connection pool.
+def get_llm():
+    """Returns the shared LLM client used by the history_search tool."""
+    from utils.utils import setup_llm
+    return setup_llm(TOOLS_MODEL_PROVIDER, TOOLS_MODEL_NAME)
 
-llm_validate = ChatTogether(
-    together_api_key=TOGETHER_API_KEY,
-    model = "meta-llama/Llama-3.3-70B-Instruct-Turbo"
-)
 
-# Load stories from JSON file
-def load_stories():
+def get_validation_llm():
+    """Returns the shared LLM client used by the input_validator tool."""
+    from utils.utils import setup_llm
+    return setup_llm(TOOLS_MODEL_PROVIDER, TOOLS_MODEL_NAME)
+
+
+@lru_cache(maxsize=1)
+def get_story_store():
+    """Opens the compiled story store on first use (built from data/stories.json if stale)."""
     try:
-        # Look for stories in the data directory instead of the langgraph directory
-        project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        stories_path = os.path.join(project_root, 'data', 'stories.json')
-        logger.info("Loading stories from %s", stories_path)
-        with open(stories_path, 'r', encoding='utf-8') as f:
-            stories = json.load(f)
-            logger.info("Successfully loaded %d stories", len(stories))
-            return stories
+        store = StoryStore()
+        logger.info("Story store ready with %d stories", len(store))
+        return store
     except Exception as e:
         logger.error("Error loading stories: %s", e)
-        return []
+        return None
+
+
+@lru_cache(maxsize=1)
+def get_story_index():
+    """Loads the saved tag index on first use, building and saving it if the store changed."""
+    store = get_story_store()
+    if not store:
+        return StoryIndex()
+    path = os.path.splitext(store.blob_path)[0] + ".tags.json"
+    index = StoryIndex.load(path, store.signature)
+    if index is None:
+        index = StoryIndex(store.metadata())
+        try:
+            index.save(path, store.signature)
+        except OSError as e:
+            logger.warning("Could not save the story tag index to %s: %s", path, e)
+    return index
+
+
+@lru_cache(maxsize=1)
+def get_story_search():
+    """Loads the story embeddings on first use; None until they are built (python langgraph/story_search.py)."""
+    store = get_story_store()
+    if not store:
+        return None
+    try:
+        # Imported here so NumPy is only loaded when retrieval is needed
+        from langgraph.story_search import StorySearch
+        return StorySearch.open(store)
+    except Exception as e:
+        logger.error("Error preparing story search: %s", e)
+        return None
 
-# Load stories at module initialization
-CHILDREN_STORIES = load_stories()
 
 @tool("story_teller")
 def story_teller(user_input: str) -> str:
     """Tells a children's story based on user input preferences.
     Uses tags to find relevant stories based on user input."""
     
-    stories = CHILDREN_STORIES
-    if not stories:
+    store = get_story_store()
+    if not store:
         logger.warning("No stories found. Check stories.json file.")
         return json.dumps({"context": "Error", "answer": "Не могу найти истории. Пожалуйста, проверьте файл stories.json."})
     
-    # Convert input to lowercase for case-insensitive matching
-    input_lower = user_input.lower()
-    
-    # Search through tags to find relevant stories
-    matched_stories = []
-    for story in stories:
-        # Check if any tag matches parts of the user input
-        if any(tag.lower() in input_lower for tag in story.get("tags", [])):
-            matched_stories.append(story)
+    # Rank stories by the tags found in the input
+    matched_ids = get_story_index().best_matches(user_input)
     
-    # If no matches found, return a random story
-    if not matched_stories:
-        logger.info("No matching stories found, selecting random story")
-        selected_story = random.choice(stories)
+    # If no tag matches, retrieve the most similar story by text
+    if not matched_ids:
+        search = get_story_search()
+        results = search.search(user_input, k=1) if search else []
+        if results and results[0][1] >= search.min_score:
+            story_id, score = results[0]
+            logger.info("No matching tags, retrieved story %d by text similarity (%.2f)", story_id, score)
+        else:
+            logger.info("No matching stories found, selecting random story")
+            story_id = random.randrange(len(store))
     else:
-        logger.info("Found %d matching stories, selecting one at random", len(matched_stories))
-        selected_story = random.choice(matched_stories)
+        logger.info("Found %d best matching stories, selecting one at random", len(matched_ids))
+        story_id = random.choice(matched_ids)
+    # Only the selected story's text is read from the store
+    selected_story = store.story(story_id)
     
     # Create character and style context
     character_context = "Дружелюбный рассказчик детских историй"
@@ -110,7 +143,7 @@ def input_validator(user_input: str):
     If there is no any suspisious behaviour end your answer with "FINE". 
     """
 
-    validation = llm_validate.invoke(instruction).content
+    validation = get_validation_llm().invoke(instruction).content
 
     if validation.endswith("FINE"):
         logger.debug("Input validation passed: Input is safe")
@@ -151,7 +184,7 @@ def history_search(messages: List[HumanMessage]) -> str:
   """
   
   logger.debug("Generating response based on conversation history")
-  response = llm.invoke(prompt)
+  response = get_llm().invoke(prompt)
   
   tool_response = {
       "context": "Conversation history search",
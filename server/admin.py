@@ -0,0 +1,100 @@
+"""
+Admin API for live device sessions, served by the metrics HTTP server.
+
+    GET  /admin/sessions                 all sessions with state and counters
+    GET  /admin/sessions/<id>            one session, by session id or device id
+    POST /admin/sessions/<id>/cancel     cancels its in-flight turn and reply
+    POST /admin/sessions/<id>/disconnect closes its WebSocket
+
+Everything is read from the session registry when a request comes in, so
+the API costs nothing on the audio path. Only loopback clients are served
+unless ADMIN_ALLOW_REMOTE is set. In multi-process mode each worker serves
+its own sessions on its private metrics port, and the supervisor serves the
+same routes on METRICS_PORT by asking every worker (server/supervisor.py).
+"""
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from server.http_server import add_route, local_only
+from server.scheduler import PipelineScheduler
+from server.sessions import Session, SessionRegistry
+
+logger = logging.getLogger(__name__)
+
+SESSION_PATH = r"/admin/sessions/(?P<id>[^/]+)"
+
+
+def session_info(session: Session, scheduler: PipelineScheduler) -> dict:
+    """JSON view of a session."""
+    now = time.monotonic()
+    state = session.state
+    in_turn = state in ("processing", "speaking") and session.turn_started is not None
+    return {
+        "session_id": session.session_id,
+        "device_id": session.device_id,
+        "persona": session.persona,
+        "firmware": session.firmware,
+        "codec": session.codec,
+        "thread_id": session.thread_id,
+        "state": state,
+        "queue_position": scheduler.queue_position(session.device_id) if state == "processing" else None,
+        "turn_s": round(now - session.turn_started, 3) if in_turn else None,
+        "last_response_s": session.last_response_s,
+        "rtt_ms": round(session.network.srtt_s * 1000, 1) if session.network.srtt_s is not None else None,
+        "jitter_ms": round(session.network.rttvar_s * 1000, 1),
+        "prebuffer_ms": round(session.network.prebuffer_s() * 1000),
+        "connected_s": round(time.time() - session.connected_at, 1),
+        "idle_s": round(now - session.last_active, 1),
+        "turns": session.turns,
+        "frames_in": session.frames_in,
+        "bytes_in": session.bytes_in,
+        "bytes_out": session.bytes_out,
+    }
+
+
+def install(sessions: SessionRegistry, scheduler: PipelineScheduler) -> None:
+    """Registers the /admin routes for sessions and the scheduler they queue on."""
+
+    def find(request) -> Optional[Session]:
+        return sessions.get(request.params["id"]) or sessions.for_device(request.params["id"])
+
+    def guarded(handler):
+        return local_only(handler, "admin API")
+
+    def list_sessions(request):
+        return 200, {"sessions": [session_info(s, scheduler) for s in sessions],
+                     "pipelines": {"running": scheduler.running, "waiting": scheduler.waiting,
+                                   "max_concurrent": scheduler.max_concurrent}}
+
+    def get_session(request):
+        session = find(request)
+        return (200, session_info(session, scheduler)) if session else (404, {"error": "no such session"})
+
+    def cancel_turn(request):
+        session = find(request)
+        if not session:
+            return 404, {"error": "no such session"}
+        cancelled = []
+        for name in ("pipeline_task", "tts_task"):
+            task = getattr(session, name)
+            if task is not None and not task.done():
+                task.cancel()
+                cancelled.append(name.split("_")[0])
+        logger.info("ADMIN> Cancelled %s of %s.", ", ".join(cancelled) or "nothing", session.session_id)
+        return 200, {"session_id": session.session_id, "cancelled": cancelled}
+
+    def disconnect(request):
+        session = find(request)
+        if not session:
+            return 404, {"error": "no such session"}
+        logger.info("ADMIN> Disconnecting %s.", session.session_id)
+        # The close handshake can take close_timeout; the handler cleans up when it ends
+        asyncio.ensure_future(session.websocket.close(code=1001, reason="disconnected by admin"))
+        return 200, {"session_id": session.session_id, "disconnecting": True}
+
+    add_route("GET", "/admin/sessions", guarded(list_sessions))
+    add_route("GET", SESSION_PATH, guarded(get_session))
+    add_route("POST", SESSION_PATH + "/cancel", guarded(cancel_turn))
+    add_route("POST", SESSION_PATH + "/disconnect", guarded(disconnect))
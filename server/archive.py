@@ -0,0 +1,324 @@
+"""
+Archive of recorded utterances for QA.
+Utterances are appended to rotating segment files instead of one WAV each:
+
+    <segment>.seg    utterance blobs, each compressed on its own
+    <segment>.idx    fixed-size records, record n at n * RECORD_SIZE
+    <segment>.jsonl  one line per utterance (id, device, trace id, time, length)
+    <segment>.open   present (holding the writer's PID) while a process writes the segment
+
+An utterance id is "<segment>:<n>", so reading one back is a seek into the
+index and a seek into the data file, whatever the archive size. Samples are
+delta-coded (a first-order predictor, like FLAC's simplest one) and then
+compressed with zstd when the zstandard package is installed, else zlib.
+Compression and file writes happen on a background thread; when its queue
+is full, utterances are dropped and counted instead of blocking the server.
+That thread also applies retention, after each segment it closes and every
+ARCHIVE_RETENTION_CHECK_S. Workers share the directory, so segments another
+live process still has open are never deleted.
+
+Usage: python server/archive.py list [archive_dir]
+       python server/archive.py extract <utterance_id> <out.wav> [archive_dir]
+"""
+import json
+import logging
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+import wave
+import zlib
+from typing import Iterator, Optional, Tuple
+
+import numpy as np
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from server import metrics
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ARCHIVE_ENABLED = os.getenv("ARCHIVE_ENABLED", "false").lower() in ("1", "true", "yes")
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", os.path.join(project_root, "archive"))
+# A segment is closed after this much raw audio or this long, whichever comes first
+ARCHIVE_SEGMENT_MB = float(os.getenv("ARCHIVE_SEGMENT_MB", "64"))
+ARCHIVE_SEGMENT_S = float(os.getenv("ARCHIVE_SEGMENT_S", "3600"))
+# Oldest segments are deleted beyond this total size or age (0 keeps everything)
+ARCHIVE_MAX_GB = float(os.getenv("ARCHIVE_MAX_GB", "10"))
+ARCHIVE_RETENTION_DAYS = float(os.getenv("ARCHIVE_RETENTION_DAYS", "30"))
+ARCHIVE_RETENTION_CHECK_S = float(os.getenv("ARCHIVE_RETENTION_CHECK_S", "600"))
+ARCHIVE_QUEUE_MAX = int(os.getenv("ARCHIVE_QUEUE_MAX", "256"))
+ARCHIVE_CODEC = os.getenv("ARCHIVE_CODEC", "zstd" if zstandard else "zlib").lower()
+
+ARCHIVE_RATE = 16000  # ESP32 microphone format: 16 kHz, 16-bit mono
+CODECS = {"zlib": 1, "zstd": 2}
+FLAG_DELTA = 1
+# offset, stored bytes, PCM bytes, unix time, CRC32 of the PCM, codec, flags
+RECORD = struct.Struct("<QIIdIBBxx")
+RECORD_SIZE = RECORD.size
+
+
+def _delta_encode(pcm: bytes) -> bytes:
+    samples = np.frombuffer(pcm[:len(pcm) // 2 * 2], dtype='<i2')
+    deltas = samples.copy()
+    deltas[1:] = samples[1:] - samples[:-1]  # int16 arithmetic wraps, and so does the decode
+    return deltas.tobytes()
+
+
+def _delta_decode(data: bytes) -> bytes:
+    return np.cumsum(np.frombuffer(data, dtype='<i2'), dtype='<i2').tobytes()
+
+
+def encode(pcm: bytes, codec: str = ARCHIVE_CODEC) -> Tuple[bytes, int, int]:
+    """Returns (stored bytes, codec id, flags) for a PCM utterance."""
+    data = _delta_encode(pcm)
+    if codec == "zstd" and zstandard:
+        return zstandard.ZstdCompressor(level=3).compress(data), CODECS["zstd"], FLAG_DELTA
+    return zlib.compress(data, 6), CODECS["zlib"], FLAG_DELTA
+
+
+def decode(stored: bytes, codec_id: int, flags: int) -> bytes:
+    if codec_id == CODECS["zstd"]:
+        if not zstandard:
+            raise RuntimeError("This utterance is zstd-compressed; install the zstandard package to read it")
+        data = zstandard.ZstdDecompressor().decompress(stored)
+    else:
+        data = zlib.decompress(stored)
+    return _delta_decode(data) if flags & FLAG_DELTA else data
+
+
+class ArchiveWriter:
+    """Appends utterances to rotating segments from a background thread."""
+
+    def __init__(self, directory: str = ARCHIVE_DIR, segment_bytes: int = int(ARCHIVE_SEGMENT_MB * 1024 * 1024),
+                 segment_s: float = ARCHIVE_SEGMENT_S, max_bytes: int = int(ARCHIVE_MAX_GB * 1024 ** 3),
+                 retention_s: float = ARCHIVE_RETENTION_DAYS * 86400, queue_max: int = ARCHIVE_QUEUE_MAX,
+                 codec: str = ARCHIVE_CODEC, retention_check_s: float = ARCHIVE_RETENTION_CHECK_S):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.segment_s = segment_s
+        self.max_bytes = max_bytes
+        self.retention_s = retention_s
+        self.retention_check_s = retention_check_s
+        self.codec = codec
+        os.makedirs(directory, exist_ok=True)
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_max)
+        self._lock = threading.Lock()
+        self._segment: Optional[str] = None
+        self._segment_started = 0.0
+        self._segment_raw = 0
+        self._segment_count = 0
+        self._sequence = 0
+        self._thread = threading.Thread(target=self._run, name="archive-writer", daemon=True)
+        self._thread.start()
+
+    def _next_segment(self) -> None:
+        # The PID keeps segments of different workers apart
+        self._sequence += 1
+        self._segment = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self._sequence}"
+        self._segment_started = time.monotonic()
+        self._segment_raw = 0
+        self._segment_count = 0
+
+    def submit(self, pcm: bytes, device: str = "", trace_id: str = None) -> Optional[str]:
+        """Queues an utterance; returns its id, or None if the writer is backed up and it was dropped."""
+        if not pcm:
+            return None
+        with self._lock:
+            if (self._segment is None or self._segment_raw + len(pcm) > self.segment_bytes
+                    or time.monotonic() - self._segment_started > self.segment_s):
+                self._next_segment()
+            utterance_id = f"{self._segment}:{self._segment_count}"
+            meta = {"id": utterance_id, "device": device, "trace_id": trace_id, "time": time.time(),
+                    "seconds": round(len(pcm) / (ARCHIVE_RATE * 2), 3)}
+            try:
+                self._queue.put_nowait((self._segment, self._segment_count, pcm, meta))
+            except queue.Full:
+                metrics.ARCHIVE_UTTERANCES.inc(result="dropped")
+                return None
+            self._segment_raw += len(pcm)
+            self._segment_count += 1
+        return utterance_id
+
+    def _run(self) -> None:
+        files = None  # (segment, data, index, manifest) of the open segment
+        next_retention = time.monotonic()  # also once at startup
+        while True:
+            if time.monotonic() >= next_retention:
+                self._apply_retention()
+                next_retention = time.monotonic() + self.retention_check_s
+            try:
+                item = self._queue.get(timeout=max(0.0, next_retention - time.monotonic()))
+            except queue.Empty:
+                continue
+            if item is None or (files and item[0] != files[0]):
+                if files:
+                    self._close_segment(files)
+                    files = None
+                    self._apply_retention()
+            if item is None:
+                return
+            segment, number, pcm, meta = item
+            try:
+                if files is None:
+                    base = os.path.join(self.directory, segment)
+                    with open(base + ".open", "w") as marker:
+                        marker.write(str(os.getpid()))
+                    files = (segment, open(base + ".seg", "ab"), open(base + ".idx", "r+b" if os.path.exists(base + ".idx") else "w+b"),
+                             open(base + ".jsonl", "a", encoding="utf-8"))
+                _, data, index, manifest = files
+                stored, codec_id, flags = encode(pcm, self.codec)
+                offset = data.tell()
+                data.write(stored)
+                data.flush()
+                index.seek(number * RECORD_SIZE)
+                index.write(RECORD.pack(offset, len(stored), len(pcm), meta["time"], zlib.crc32(pcm), codec_id, flags))
+                index.flush()
+                manifest.write(json.dumps(meta, ensure_ascii=False) + "\n")
+                manifest.flush()
+                metrics.ARCHIVE_UTTERANCES.inc(result="written")
+                metrics.ARCHIVE_BYTES.inc(len(pcm), kind="raw")
+                metrics.ARCHIVE_BYTES.inc(len(stored), kind="stored")
+            except Exception as e:
+                metrics.ARCHIVE_UTTERANCES.inc(result="failed")
+                logger.error("ARCHIVE> Could not write utterance %s: %s", meta["id"], e)
+
+    def _close_segment(self, files: tuple) -> None:
+        for f in files[1:]:
+            f.close()
+        try:
+            os.remove(os.path.join(self.directory, files[0] + ".open"))
+        except FileNotFoundError:
+            pass
+
+    def _is_open(self, segment: str) -> bool:
+        """Whether a live process (this one or another worker) is still writing the segment."""
+        marker = os.path.join(self.directory, segment + ".open")
+        try:
+            with open(marker) as f:
+                pid = int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError):
+            return True  # being written right now
+        if pid == os.getpid():
+            return True
+        try:
+            os.kill(pid, 0)
+            return True
+        except PermissionError:
+            return True
+        except (ProcessLookupError, OverflowError, ValueError):
+            # Its writer died without closing it
+            try:
+                os.remove(marker)
+            except FileNotFoundError:
+                pass
+            return False
+
+    def _apply_retention(self) -> None:
+        """Deletes the oldest closed segments beyond the size or age limit."""
+        try:
+            names = os.listdir(self.directory)
+        except OSError as e:
+            logger.error("ARCHIVE> Cannot list %s for retention: %s", self.directory, e)
+            return
+        segments = sorted(segment for segment in {name.rsplit(".", 1)[0] for name in names if name.endswith(".seg")}
+                          if segment != self._segment and not self._is_open(segment))
+        sizes = {s: sum(os.path.getsize(p) for p in _segment_paths(self.directory, s) if os.path.exists(p))
+                 for s in segments}
+        total = sum(sizes.values())
+        now = time.time()
+        for segment in segments:
+            too_big = self.max_bytes and total > self.max_bytes
+            try:
+                too_old = self.retention_s and now - os.path.getmtime(os.path.join(self.directory, segment + ".seg")) > self.retention_s
+            except FileNotFoundError:
+                continue  # another worker deleted it
+            if not (too_big or too_old):
+                break
+            for path in _segment_paths(self.directory, segment):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total -= sizes[segment]
+            logger.info("ARCHIVE> Deleted segment %s (retention).", segment)
+
+    def close(self, timeout: float = 10.0) -> None:
+        """Writes what is queued and stops the writer thread."""
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+
+def _segment_paths(directory: str, segment: str) -> Tuple[str, str, str]:
+    base = os.path.join(directory, segment)
+    return base + ".seg", base + ".idx", base + ".jsonl"
+
+
+def read_utterance(utterance_id: str, directory: str = ARCHIVE_DIR) -> bytes:
+    """Returns the PCM of an archived utterance; raises KeyError if it is not in the archive."""
+    segment, _, number = utterance_id.rpartition(":")
+    if not segment or not number.isdigit() or os.sep in segment or "/" in segment:
+        raise KeyError(utterance_id)
+    data_path, index_path, _ = _segment_paths(directory, segment)
+    try:
+        with open(index_path, "rb") as index:
+            index.seek(int(number) * RECORD_SIZE)
+            record = index.read(RECORD_SIZE)
+        if len(record) < RECORD_SIZE:
+            raise KeyError(utterance_id)
+        offset, stored_len, pcm_len, _, crc, codec_id, flags = RECORD.unpack(record)
+        if not stored_len:
+            raise KeyError(utterance_id)
+        with open(data_path, "rb") as data:
+            data.seek(offset)
+            stored = data.read(stored_len)
+    except FileNotFoundError:
+        raise KeyError(utterance_id) from None
+    pcm = decode(stored, codec_id, flags)
+    if len(pcm) != pcm_len or zlib.crc32(pcm) != crc:
+        raise ValueError(f"Archived utterance {utterance_id} is corrupt")
+    return pcm
+
+
+def list_utterances(directory: str = ARCHIVE_DIR) -> Iterator[dict]:
+    """Yields the manifest entries of every segment, oldest first."""
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".jsonl"):
+            with open(os.path.join(directory, name), encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+
+
+def main() -> None:
+    if len(sys.argv) >= 2 and sys.argv[1] == "list":
+        for entry in list_utterances(sys.argv[2] if len(sys.argv) > 2 else ARCHIVE_DIR):
+            print(f"{entry['id']}\t{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['time']))}\t"
+                  f"{entry['seconds']:.2f}s\t{entry['device']}\t{entry.get('trace_id') or ''}")
+    elif len(sys.argv) >= 4 and sys.argv[1] == "extract":
+        pcm = read_utterance(sys.argv[2], sys.argv[4] if len(sys.argv) > 4 else ARCHIVE_DIR)
+        with wave.open(sys.argv[3], "wb") as wf:
+            wf.setnchannels(1)
+            wf.setsampwidth(2)
+            wf.setframerate(ARCHIVE_RATE)
+            wf.writeframes(pcm)
+        print(f"Wrote {len(pcm) / (ARCHIVE_RATE * 2):.2f}s to {sys.argv[3]}")
+    else:
+        print(__doc__.split("Usage:")[1].strip())
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
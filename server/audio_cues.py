@@ -0,0 +1,121 @@
+"""
+Short audio cues the server plays to a device outside of TTS replies.
+Cues are held in memory in the ESP32 playback format (16 kHz, 16-bit mono
+PCM), either loaded from a WAV file or synthesized as soft tones. They go
+out like reply audio (server/playback.py): whole firmware frames per
+message, paced so the device's DMA ring is never handed more than it holds.
+"""
+import asyncio
+import logging
+import os
+import re
+import time
+import wave
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+from server.playback import PLAYBACK_BYTES_PER_SECOND, PlaybackPacer, Rechunker
+
+logger = logging.getLogger(__name__)
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+THINKING_CUE_ENABLED = os.getenv("THINKING_CUE_ENABLED", "true").lower() in ("1", "true", "yes")
+# <persona>.wav in this directory overrides the built-in thinking sound for that persona
+THINKING_CUE_DIR = os.getenv("THINKING_CUE_DIR", os.path.join(project_root, "config", "cues"))
+# Persona of devices that do not send ?persona=; defaults to the personality file's name
+DEFAULT_PERSONA = os.getenv("TOY_PERSONA") or os.path.splitext(os.path.basename(os.getenv("PERSONALITY_PATH", "toy.json")))[0]
+_PERSONA_NAME = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+CUE_RATE = 16000
+CUE_WIDTH = 2
+FADE_S = 0.01
+
+
+def tone_sequence(notes: Iterable[Tuple[float, float]], amplitude: float = 0.25, rate: int = CUE_RATE) -> bytes:
+    """Renders (frequency_hz, duration_s) notes as int16 PCM; frequency 0 is silence."""
+    parts = []
+    fade = int(FADE_S * rate)
+    for frequency, duration_s in notes:
+        t = np.arange(int(duration_s * rate)) / rate
+        note = np.zeros_like(t) if frequency <= 0 else amplitude * np.sin(2 * np.pi * frequency * t)
+        if frequency > 0 and len(note) > 2 * fade:
+            envelope = np.ones_like(note)
+            envelope[:fade] = np.linspace(0, 1, fade)
+            envelope[-fade:] = np.linspace(1, 0, fade)
+            note *= envelope
+        parts.append(note)
+    samples = np.concatenate(parts) if parts else np.zeros(0)
+    return (samples * 32767).astype('<i2').tobytes()
+
+
+def load_wav_cue(path: str) -> bytes:
+    """Reads a 16 kHz, 16-bit mono WAV file into raw PCM."""
+    with wave.open(path, 'rb') as wf:
+        if (wf.getframerate(), wf.getsampwidth(), wf.getnchannels()) != (CUE_RATE, CUE_WIDTH, 1):
+            raise ValueError(f"{path} must be {CUE_RATE} Hz, 16-bit, mono")
+        return wf.readframes(wf.getnframes())
+
+
+def load_cue(path: Optional[str], default: bytes) -> bytes:
+    """Returns the cue from path, or default when path is unset or unreadable."""
+    if not path:
+        return default
+    try:
+        return load_wav_cue(path)
+    except (OSError, EOFError, ValueError, wave.Error) as e:
+        logger.warning("Cannot load audio cue %s, using the built-in one: %s", path, e)
+        return default
+
+
+async def send_cue(websocket, pcm: bytes, pacer: PlaybackPacer, on_first_sent: Callable[[], None] = None) -> float:
+    """
+    Sends a cue to the device in firmware-sized messages, paced by pacer;
+    returns the seconds of audio sent. pacer.play_end only ever covers what
+    was actually sent, also when the connection closes part-way.
+    """
+    rechunker = Rechunker()
+    sent = 0
+    for message in rechunker.push(pcm) + rechunker.flush():
+        wait_s = pacer.wait_s(time.monotonic())
+        if wait_s > 0.001:
+            await asyncio.sleep(wait_s)
+        send_start = time.monotonic()
+        await websocket.send(message)
+        pacer.sent(send_start, len(message))
+        if not sent and on_first_sent:
+            on_first_sent()
+        sent += len(message)
+    return sent / PLAYBACK_BYTES_PER_SECOND
+
+
+# Two soft beeps: "hold on, I'm busy"
+WAIT_CUE = load_cue(os.getenv("WAIT_CUE_PATH"), tone_sequence([(660, 0.12), (0, 0.08), (660, 0.12)]))
+# A quiet rising "hmm", played as soon as the device stops recording
+DEFAULT_THINKING_CUE = tone_sequence([(523, 0.09), (659, 0.09), (784, 0.16)], amplitude=0.15)
+
+
+def load_thinking_cues(directory: str = THINKING_CUE_DIR) -> Dict[str, bytes]:
+    """Reads every <persona>.wav in directory; unreadable files fall back to the built-in cue."""
+    try:
+        names = sorted(os.listdir(directory))
+    except OSError:
+        return {}
+    cues = {}
+    for name in names:
+        persona, extension = os.path.splitext(name)
+        if extension.lower() == ".wav" and _PERSONA_NAME.match(persona):
+            cues[persona] = load_cue(os.path.join(directory, name), DEFAULT_THINKING_CUE)
+    return cues
+
+
+# Loaded once at startup, so a turn never touches the disk for its cue (new files need a restart)
+_thinking_cues: Dict[str, bytes] = load_thinking_cues() if THINKING_CUE_ENABLED else {}
+
+
+def thinking_cue(persona: Optional[str] = None) -> bytes:
+    """The thinking earcon for persona: its WAV from THINKING_CUE_DIR, else the built-in one."""
+    if not persona or not _PERSONA_NAME.match(persona):
+        persona = DEFAULT_PERSONA
+    return _thinking_cues.get(persona, DEFAULT_THINKING_CUE)
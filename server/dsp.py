@@ -0,0 +1,82 @@
+"""
+Audio DSP for the TTS path and the thread pool it runs on.
+Conversion and resampling are NumPy/SciPy FFT work that releases the GIL,
+so running it on a small dedicated pool keeps the event loop free to
+service other connections. A semaphore bounds the jobs in flight: when the
+pool is saturated, streams wait for a slot instead of queueing unbounded
+work (backpressure).
+"""
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+import numpy as np
+from scipy.signal import resample
+
+from server import metrics
+from server.log import log_rate_limited
+
+logger = logging.getLogger(__name__)
+
+DSP_WORKERS = int(os.getenv("DSP_WORKERS", str(min(4, os.cpu_count() or 1))))
+DSP_MAX_PENDING = int(os.getenv("DSP_MAX_PENDING", str(DSP_WORKERS * 4)))
+
+
+def convert_audio_chunk(buffer_f32le, source_rate, target_rate):
+    """Converts a float32 little-endian chunk to int16 little-endian and resamples."""
+    try:
+        float32_array = np.frombuffer(buffer_f32le, dtype=np.float32)
+        num_samples_in = len(float32_array)
+        if num_samples_in == 0: return b''
+
+        if source_rate != target_rate:
+            num_samples_out = int(np.round(num_samples_in * target_rate / source_rate))
+            if num_samples_out <= 0: return b''
+            resampled_array = resample(float32_array, num_samples_out)
+        else:
+            resampled_array = float32_array
+
+        int16_array = np.clip(resampled_array * 32767, -32768, 32767).astype(np.int16)
+        return int16_array.tobytes()
+    except Exception as conv_err:
+        log_rate_limited(logger, "audio_conversion", logging.ERROR, "ERROR during audio conversion: %s", conv_err)
+        return b''
+
+
+def _timed_call(fn: Callable, args: tuple):
+    cpu_start = time.thread_time()
+    wall_start = time.perf_counter()
+    result = fn(*args)
+    return result, time.thread_time() - cpu_start, time.perf_counter() - wall_start
+
+
+class DspExecutor:
+    """Bounded thread pool for CPU-bound audio jobs, awaited from the event loop."""
+
+    def __init__(self, workers: int = DSP_WORKERS, max_pending: int = DSP_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dsp")
+        self._slots = asyncio.Semaphore(max_pending)
+
+    async def run(self, fn: Callable, *args) -> Any:
+        """Runs fn(*args) on the pool, waiting for a free slot first when max_pending jobs are in flight."""
+        wait_start = time.perf_counter()
+        async with self._slots:
+            metrics.DSP_QUEUE_WAIT.observe(time.perf_counter() - wait_start)
+            metrics.DSP_JOBS_PENDING.inc()
+            try:
+                result, cpu_s, wall_s = await asyncio.get_running_loop().run_in_executor(
+                    self._pool, _timed_call, fn, args
+                )
+            finally:
+                metrics.DSP_JOBS_PENDING.dec()
+        metrics.DSP_JOB_SECONDS.observe(wall_s)
+        metrics.CONVERSION_CPU_SECONDS.inc(cpu_s)
+        return result
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,134 @@
+"""
+Minimal HTTP/1.1 server running on the WebSocket server's event loop.
+Serves /metrics and any other routes registered with add_route(); handlers
+are plain functions, so nothing here depends on a web framework. There is
+no authentication: listen on loopback (METRICS_HOST) unless the network in
+front of it is trusted.
+"""
+import asyncio
+import json
+import os
+import re
+from typing import Callable, List, Pattern, Tuple
+
+from server.metrics import REGISTRY
+
+MAX_BODY_BYTES = 64 * 1024
+# A client gets this long to send its whole request; slow or idle ones are disconnected
+METRICS_READ_TIMEOUT_S = float(os.getenv("METRICS_READ_TIMEOUT_S", "10"))
+# Lets remote clients use the admin and debug routes (see local_only())
+ADMIN_ALLOW_REMOTE = os.getenv("ADMIN_ALLOW_REMOTE", "false").lower() in ("1", "true", "yes")
+LOOPBACK_PEERS = ("127.0.0.1", "::1", "::ffff:127.0.0.1")
+_STATUS_TEXT = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed",
+                500: "Internal Server Error", 502: "Bad Gateway"}
+
+# (method, compiled path pattern, handler); handler(request) -> (status, body[, content_type])
+_routes: List[Tuple[str, Pattern, Callable]] = []
+
+
+class Request:
+    __slots__ = ("method", "path", "query", "body", "params", "peer")
+
+    def __init__(self, method: str, path: str, query: str, body: bytes, params: dict, peer: str = None):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.body = body
+        self.params = params
+        self.peer = peer  # client IP address
+
+
+def add_route(method: str, path_pattern: str, handler: Callable) -> None:
+    """Registers handler for method and a path regex (named groups become request.params).
+    Registering the same method and pattern again replaces the earlier handler."""
+    route = (method.upper(), re.compile(path_pattern), handler)
+    for i, (route_method, pattern, _) in enumerate(_routes):
+        if route_method == route[0] and pattern.pattern == path_pattern:
+            _routes[i] = route
+            return
+    _routes.append(route)
+
+
+def local_only(handler: Callable, what: str = "this endpoint") -> Callable:
+    """Wraps a route handler so only loopback clients get past it, unless ADMIN_ALLOW_REMOTE is set."""
+    def route(request: Request):
+        if not ADMIN_ALLOW_REMOTE and request.peer not in LOOPBACK_PEERS:
+            return 403, {"error": f"{what} is only served to local clients"}
+        return handler(request)
+    return route
+
+
+def _encode(body, content_type: str = None) -> Tuple[bytes, str]:
+    if isinstance(body, (dict, list)):
+        return json.dumps(body, ensure_ascii=False, default=str).encode('utf-8'), "application/json"
+    if isinstance(body, str):
+        return body.encode('utf-8'), content_type or "text/plain; charset=utf-8"
+    return body or b"", content_type or "application/octet-stream"
+
+
+async def _dispatch(method: str, target: str, body: bytes, peer: str = None):
+    path, _, query = target.partition("?")
+    allowed = False
+    for route_method, pattern, handler in _routes:
+        match = pattern.fullmatch(path)
+        if not match:
+            continue
+        if route_method != method:
+            allowed = True
+            continue
+        result = handler(Request(method, path, query, body, match.groupdict(), peer))
+        if asyncio.iscoroutine(result):
+            result = await result
+        return result
+    return (405, {"error": "method not allowed"}) if allowed else (404, {"error": "not found"})
+
+
+async def _read_request(reader: asyncio.StreamReader):
+    """Returns (method, target, body), or None for a malformed request line."""
+    request_line = await reader.readline()
+    parts = request_line.decode('latin-1').split()
+    if len(parts) < 2:
+        return None
+    method, target = parts[0].upper(), parts[1]
+    content_length = 0
+    while True:
+        header = await reader.readline()
+        if header in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = header.decode('latin-1').partition(":")
+        if name.strip().lower() == "content-length":
+            content_length = min(int(value.strip() or 0), MAX_BODY_BYTES)
+    body = await reader.readexactly(content_length) if content_length else b""
+    return method, target, body
+
+
+async def _handle_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request = await asyncio.wait_for(_read_request(reader), METRICS_READ_TIMEOUT_S)
+        if request is None:
+            return
+        method, target, body = request
+
+        try:
+            peername = writer.get_extra_info("peername")
+            result = await _dispatch(method, target, body, peername[0] if peername else None)
+        except Exception as e:
+            result = (500, {"error": f"{type(e).__name__}: {e}"})
+        status, payload = result[0], result[1]
+        data, content_type = _encode(payload, result[2] if len(result) > 2 else None)
+        head = (f"HTTP/1.1 {status} {_STATUS_TEXT.get(status, '')}\r\n"
+                f"Content-Type: {content_type}\r\nContent-Length: {len(data)}\r\nConnection: close\r\n\r\n")
+        writer.write(head.encode('latin-1') + data)
+        await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_http_server(host: str, port: int) -> asyncio.AbstractServer:
+    """Starts serving the registered routes on host:port."""
+    return await asyncio.start_server(_handle_connection, host, port)
+
+
+add_route("GET", "/metrics", lambda request: (200, REGISTRY.render(), "text/plain; version=0.0.4; charset=utf-8"))
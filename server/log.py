@@ -0,0 +1,90 @@
+"""
+Non-blocking, leveled logging for the WebSocket server.
+Loggers under "server" hand records to a QueueHandler, so the event loop
+only formats and enqueues; a QueueListener thread does the writes to stdout
+and logs/server.log. Each record carries the client id of the connection it
+was logged for (the `client_context` variable, or extra={"client": ...}
+from executor threads).
+"""
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+from contextvars import ContextVar
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Defaults; setup_logging() reads SERVER_LOG_LEVEL, SERVER_LOG_FILE and LOG_RATE_LIMIT_S
+# again, so values from a .env loaded after this import still apply
+SERVER_LOG_LEVEL = os.getenv("SERVER_LOG_LEVEL", "INFO").upper()
+# Empty disables the file
+SERVER_LOG_FILE = os.getenv("SERVER_LOG_FILE", os.path.join(project_root, "logs", "server.log"))
+LOG_RATE_LIMIT_S = float(os.getenv("LOG_RATE_LIMIT_S", "5"))
+LOG_FORMAT = "%(asctime)s %(levelname)-7s %(threadName)s [%(client)s] %(message)s"
+
+client_context: ContextVar[str] = ContextVar("client", default="-")
+
+_listener = None
+_rate_limits: dict = {}
+
+
+class _ClientFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, "client"):
+            record.client = client_context.get()
+        return True
+
+
+def setup_logging(level: str = None, log_file: str = None) -> None:
+    """Routes the "server" loggers through a queue to a background writer thread.
+    Call it once the environment (.env) is loaded."""
+    global _listener, LOG_RATE_LIMIT_S
+    if _listener:
+        return
+    level = level or os.getenv("SERVER_LOG_LEVEL", SERVER_LOG_LEVEL).upper()
+    if log_file is None:
+        log_file = os.getenv("SERVER_LOG_FILE", SERVER_LOG_FILE)
+    LOG_RATE_LIMIT_S = float(os.getenv("LOG_RATE_LIMIT_S", LOG_RATE_LIMIT_S))
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if log_file:
+        os.makedirs(os.path.dirname(log_file), exist_ok=True)
+        handlers.append(logging.FileHandler(log_file, encoding='utf-8'))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(_ClientFilter())
+    server_logger = logging.getLogger("server")
+    server_logger.setLevel(level)
+    server_logger.addHandler(queue_handler)
+    server_logger.propagate = False
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging() -> None:
+    """Flushes queued records and stops the writer thread."""
+    global _listener
+    if _listener:
+        _listener.stop()
+        _listener = None
+
+
+def log_rate_limited(logger: logging.Logger, key: str, level: int, msg: str, *args, **kwargs) -> None:
+    """Logs at most once per LOG_RATE_LIMIT_S for key, noting how many repeats were suppressed."""
+    now = time.monotonic()
+    state = _rate_limits.get(key)
+    if state and now - state[0] < LOG_RATE_LIMIT_S:
+        state[1] += 1
+        return
+    _rate_limits[key] = [now, 0]
+    if state and state[1]:
+        msg = f"{msg} ({state[1]} similar suppressed)"
+    logger.log(level, msg, *args, **kwargs)
@@ -0,0 +1,169 @@
+"""
+Event-loop health for the WebSocket server.
+- A sampler task measures how late the loop wakes from a short sleep
+  (loop lag) and feeds tedtoy_event_loop_lag_seconds.
+- A watchdog thread notices when the loop has not run for SLOW_CALLBACK_MS
+  and captures the loop thread's stack while it is still blocked, so the
+  report shows the code that is stalling every connection.
+- With LOOP_DEBUG=true, asyncio debug mode also reports callbacks slower
+  than loop.slow_callback_duration, with the offending handle.
+Recent stalls and a snapshot of all tasks are served at /debug/loop (to
+local clients only: the stacks show source paths and code) and printed on
+SIGUSR1.
+"""
+import asyncio
+import collections
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+from typing import Deque, Optional
+
+from server import metrics
+from server.http_server import add_route, local_only
+
+logger = logging.getLogger(__name__)
+
+LOOP_LAG_INTERVAL_S = float(os.getenv("LOOP_LAG_INTERVAL_MS", "100")) / 1000
+SLOW_CALLBACK_S = float(os.getenv("SLOW_CALLBACK_MS", "100")) / 1000
+LOOP_DEBUG = os.getenv("LOOP_DEBUG", "false").lower() in ("1", "true", "yes")
+MAX_STALL_REPORTS = 20
+
+
+class LoopMonitor:
+    """Samples loop lag and records stalls of the loop it is started on."""
+
+    def __init__(self, interval_s: float = LOOP_LAG_INTERVAL_S, slow_callback_s: float = SLOW_CALLBACK_S):
+        self.interval_s = interval_s
+        self.slow_callback_s = slow_callback_s
+        # Appended to by the watchdog thread while dump() reads it on the loop thread
+        self.stalls: Deque[dict] = collections.deque(maxlen=MAX_STALL_REPORTS)
+        self._stalls_lock = threading.Lock()
+        self.lags: Deque[float] = collections.deque(maxlen=600)
+        self._heartbeat = time.monotonic()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._sampler: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._sampler = self._loop.create_task(self._sample())
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+        if LOOP_DEBUG:
+            self._loop.set_debug(True)
+            self._loop.slow_callback_duration = self.slow_callback_s
+            logging.getLogger("asyncio").addHandler(_SlowCallbackHandler(self))
+        try:
+            self._loop.add_signal_handler(signal.SIGUSR1, lambda: print(self.format_dump()))
+        except (NotImplementedError, AttributeError, RuntimeError):
+            pass  # No SIGUSR1 / loop signal handlers on Windows
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._sampler:
+            self._sampler.cancel()
+
+    async def _sample(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval_s)
+            now = loop.time()
+            self._heartbeat = time.monotonic()
+            lag = max(0.0, now - start - self.interval_s)
+            self.lags.append(lag)
+            metrics.LOOP_LAG.observe(lag)
+
+    def _watch(self) -> None:
+        """Runs in its own thread; captures the loop thread's stack during a stall."""
+        stall_start, stall = None, None
+        while not self._stop.wait(self.slow_callback_s / 4):
+            blocked_s = time.monotonic() - self._heartbeat - self.interval_s
+            if blocked_s >= self.slow_callback_s and stall is None:
+                stall_start = self._heartbeat
+                frame = sys._current_frames().get(self._loop_thread_id)
+                stack = "".join(traceback.format_stack(frame)) if frame else ""
+                location = f"{frame.f_code.co_filename}:{frame.f_lineno} in {frame.f_code.co_name}" if frame else "?"
+                stall = self._record_stall("blocked", blocked_s, stack, location)
+            elif blocked_s < self.slow_callback_s and stall is not None:
+                # Stall ended: store how long it really lasted
+                with self._stalls_lock:
+                    stall["duration_ms"] = round((self._heartbeat - stall_start - self.interval_s) * 1000, 1)
+                stall = None
+
+    def _record_stall(self, kind: str, duration_s: float, detail: str, location: str = None) -> dict:
+        metrics.LOOP_STALLS.inc(kind=kind)
+        stall = {
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "kind": kind,
+            "duration_ms": round(duration_s * 1000, 1),
+            "detail": detail,
+        }
+        with self._stalls_lock:
+            self.stalls.append(stall)
+        logger.warning("LOOP> Event loop %s for %.0f+ ms at: %s", kind, duration_s * 1000, location or detail[:200])
+        return stall
+
+    def dump(self) -> dict:
+        """Lag statistics, recent stalls and the stack of every pending task."""
+        lags = sorted(self.lags)
+        with self._stalls_lock:
+            stalls = [dict(stall) for stall in self.stalls]
+        tasks = []
+        if self._loop and self._loop.is_running():
+            for task in asyncio.all_tasks(self._loop):
+                frames = task.get_stack(limit=3)
+                tasks.append({
+                    "name": task.get_name(),
+                    "coro": getattr(task.get_coro(), "__qualname__", repr(task.get_coro())),
+                    "at": [f"{f.f_code.co_filename}:{f.f_lineno} {f.f_code.co_name}" for f in frames],
+                })
+        return {
+            "lag_ms": {
+                "samples": len(lags),
+                "p50": round(lags[len(lags) // 2] * 1000, 2) if lags else None,
+                "p99": round(lags[int(len(lags) * 0.99)] * 1000, 2) if lags else None,
+                "max": round(lags[-1] * 1000, 2) if lags else None,
+            },
+            "slow_callback_ms": self.slow_callback_s * 1000,
+            "asyncio_debug": LOOP_DEBUG,
+            "stalls": stalls,
+            "tasks": tasks,
+        }
+
+    def format_dump(self) -> str:
+        dump = self.dump()
+        lines = [f"--- Event loop dump (lag ms: {dump['lag_ms']}) ---"]
+        for stall in dump["stalls"]:
+            lines.append(f"[{stall['time']}] {stall['kind']} {stall['duration_ms']} ms")
+            lines.extend("    " + line for line in stall["detail"].rstrip().splitlines())
+        lines.append(f"{len(dump['tasks'])} tasks:")
+        lines.extend(f"  {t['name']} {t['coro']} {' <- '.join(t['at'])}" for t in dump["tasks"])
+        return "\n".join(lines)
+
+
+class _SlowCallbackHandler(logging.Handler):
+    """Turns asyncio debug-mode 'Executing <handle> took N seconds' warnings into stall reports."""
+
+    def __init__(self, monitor: LoopMonitor):
+        super().__init__(logging.WARNING)
+        self.monitor = monitor
+
+    def emit(self, record: logging.LogRecord) -> None:
+        message = record.getMessage()
+        if message.startswith("Executing ") and " took " in message:
+            try:
+                duration_s = float(message.rsplit(" took ", 1)[1].split()[0])
+            except ValueError:
+                duration_s = 0.0
+            self.monitor._record_stall("slow_callback", duration_s, message)
+
+
+LOOP_MONITOR = LoopMonitor()
+add_route("GET", "/debug/loop", local_only(lambda request: (200, LOOP_MONITOR.dump()), "/debug/loop"))
@@ -1,31 +1,85 @@
 # main_server.py
-import threading
 import time
-import traceback
 
 import asyncio
 import websockets
 import os
-import datetime
-import traceback
 import wave
+import signal
+import logging
 import subprocess
 import sys
 import time
 from dotenv import load_dotenv
 
+# Add the project root to Python path to make imports work
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+# Before the project imports: their modules read their settings from the environment at import time
+load_dotenv()
+
+from server import supervisor
+from server.log import client_context, log_rate_limited, setup_logging, stop_logging
+
+setup_logging()  # after load_dotenv(): SERVER_LOG_LEVEL etc. may come from .env
+logger = logging.getLogger("server.main")
+
+# --- Metrics Endpoint Configuration ---
+# Loopback by default: the endpoint has no authentication (/admin and /stt check for local peers too)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "8766"))
+
+# --- Multi-process Configuration ---
+# SERVER_WORKERS > 1 runs a supervisor that starts that many workers sharing PORT (SO_REUSEPORT)
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", "1"))
+SERVER_AFFINITY = os.getenv("SERVER_AFFINITY", "ip").lower()  # "ip" or "none"
+WORKER_DRAIN_S = float(os.getenv("WORKER_DRAIN_S", "30"))
+WORKER_ID = supervisor.worker_id()
+
+if __name__ == "__main__" and SERVER_WORKERS > 1 and WORKER_ID is None:
+    # The supervisor only runs and scrapes the workers. It stops here, before the imports and
+    # setup below (TTS client, thread pools, archive, STT stage, admin and debug routes)
+    try:
+        supervisor.run_supervisor(os.path.abspath(__file__), SERVER_WORKERS, METRICS_HOST, METRICS_PORT, WORKER_DRAIN_S)
+    except KeyboardInterrupt:
+        print("\nCtrl+C received. Shutting down server...")
+    finally:
+        stop_logging()
+        print("Server shutdown sequence complete.")
+    sys.exit(0)
+
+from utils.tracing import Trace, NullTrace, add_span_listener, set_current_trace
+from server import metrics
+from server.http_server import add_route, local_only, start_http_server
+from server.loop_monitor import LOOP_MONITOR
+from server.scheduler import (PIPELINE_MAX_CONCURRENT, PIPELINE_MAX_QUEUE, PIPELINE_WAIT_CUE_S,
+                              PipelineScheduler, SchedulerFull)
+from server.prefetch import PREFETCH_ENABLED, PREFETCH_REPLIES_ENV, Prefetcher, replies_env, utterance_key
+from server.archive import ARCHIVE_ENABLED, ArchiveWriter
+from server.recording import RECORDING_MAX_S, RecordingBuffer
+from server.sessions import Session, SessionRegistry
+from server import admin
+from server.playback import PlaybackPacer, fixed_frames, probe_rtt
+from server import stt_service
+
+# "mock" swaps Cartesia for the local tone generator in utils/mock_backends.py
+TTS_PROVIDER = os.getenv("TTS_PROVIDER", "cartesia").lower()
+
 try:
-    from cartesia import Cartesia
-    import numpy as np
-    from scipy.signal import resample
+    from server.dsp import DspExecutor, convert_audio_chunk
+    from server.audio_cues import THINKING_CUE_ENABLED, WAIT_CUE, send_cue, thinking_cue
+    if TTS_PROVIDER != "mock":
+        from cartesia import Cartesia
 except ImportError as e:
     print(f"!!! ERROR: Missing TTS dependencies (cartesia, numpy, scipy): {e}")
     print("!!! Please install them: pip install cartesia-api numpy scipy")
     sys.exit(1)
 
-load_dotenv()
 CARTESIA_API_KEY = os.environ.get("CARTESIA_API_KEY")
-if not CARTESIA_API_KEY:
+if TTS_PROVIDER == "mock":
+    from utils.mock_backends import MockTTSClient
+    CARTESIA_CLIENT = MockTTSClient()
+elif not CARTESIA_API_KEY:
     print("!!! FATAL ERROR: CARTESIA_API_KEY not found in environment variables or .env file.")
     CARTESIA_CLIENT = None
 else:
@@ -49,75 +103,69 @@ ESP32_RATE = 16000
 ESP32_WIDTH = 2
 ESP32_CHANNELS = 1
 ESP32_BYTES_PER_SECOND = ESP32_RATE * ESP32_WIDTH * ESP32_CHANNELS
-TTS_SLEEP_MULTIPLIER = 0.5
+CACHED_AUDIO_CHUNK_BYTES = ESP32_BYTES_PER_SECOND // 10  # pre-rendered replies are read out in 100 ms pieces
+
+# Audio the device can hold beyond what has already played (I2S DMA + socket
+# buffers); sending further ahead than this counts as an overrun.
+DEVICE_MAX_BUFFER_S = float(os.getenv("DEVICE_MAX_BUFFER_S", "2.0"))
 
 # --- Pipeline Configuration ---
-PIPELINE_SCRIPT_PATH = "server/pipeline_script.py"
+PIPELINE_SCRIPT_PATH = os.getenv("PIPELINE_SCRIPT_PATH", "server/pipeline_script.py")
+# "subprocess": one pipeline_script.py process per turn. "inprocess": the async pipeline
+# (server/pipeline.py) runs on this event loop, so turns overlap on I/O in one process
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "subprocess").lower()
+PIPELINE_IN_PROCESS = PIPELINE_MODE == "inprocess"
+if PIPELINE_IN_PROCESS:
+    from server import pipeline
 
 print(f"--- Configuration ---")
 print(f"WebSocket Server: ws://{HOST}:{PORT}")
 print(f"Expected ESP32 Audio Format: {ESP32_RATE} Hz, {ESP32_WIDTH*8}-bit PCM, {ESP32_CHANNELS}-ch")
 print(f"Saving received audio as .wav files.")
-print(f"Triggering pipeline script: {PIPELINE_SCRIPT_PATH}")
-if CARTESIA_CLIENT:
+print(f"Pipeline: in-process (async)" if PIPELINE_IN_PROCESS else f"Triggering pipeline script: {PIPELINE_SCRIPT_PATH}")
+print(f"Pipeline concurrency: {PIPELINE_MAX_CONCURRENT} (queue up to {PIPELINE_MAX_QUEUE})")
+print(f"Follow-up prefetch: {'enabled' if PREFETCH_ENABLED else 'disabled'}")
+print(f"Metrics endpoint: http://{METRICS_HOST}:{METRICS_PORT}/metrics (admin API: /admin/sessions)")
+if WORKER_ID is not None:
+    print(f"Worker {WORKER_ID} of {SERVER_WORKERS} (PID: {os.getpid()}, affinity: {SERVER_AFFINITY})")
+if TTS_PROVIDER == "mock":
+    print("TTS Enabled (mock tone generator)")
+elif CARTESIA_CLIENT:
     print(f"TTS Enabled (Cartesia Voice: {TTS_VOICE_ID})")
 else:
     print("!!! TTS Disabled (Cartesia client init failed or key missing)")
 print(f"---")
 
-client_tasks = {}
+# Connected devices with their in-flight turn and counters
+SESSIONS = SessionRegistry()
+tts_tasks = set()
+# Resampling runs on a bounded thread pool so it never blocks the event loop
+DSP_EXECUTOR = DspExecutor()
+# Caps concurrent pipeline subprocesses; one in-flight turn per device
+PIPELINE_SCHEDULER = PipelineScheduler()
+add_span_listener(metrics.observe_span)
 
 AUDIO_SAVE_DIR = "received_audio_wav"
 os.makedirs(AUDIO_SAVE_DIR, exist_ok=True)
 print(f"Saving received audio files to: ./{AUDIO_SAVE_DIR}/")
 
-def convert_audio_chunk(buffer_f32le, source_rate, target_rate):
-    """Converts a float32 little-endian chunk to int16 little-endian and resamples."""
-    try:
-        float32_array = np.frombuffer(buffer_f32le, dtype=np.float32)
-        num_samples_in = len(float32_array)
-        if num_samples_in == 0: return b''
-
-        if source_rate != target_rate:
-            num_samples_out = int(np.round(num_samples_in * target_rate / source_rate))
-            if num_samples_out <= 0: return b''
-            resampled_array = resample(float32_array, num_samples_out)
-        else:
-            resampled_array = float32_array
-
-        int16_array = np.clip(resampled_array * 32767, -32768, 32767).astype(np.int16)
-        return int16_array.tobytes()
-    except Exception as conv_err:
-        print(f"!!! ERROR during audio conversion: {conv_err}")
-        return b''
-
 _GENERATOR_SENTINEL = object()
 
-async def stream_tts_response(websocket, client_id: str, text_to_speak: str):
-    """Generates TTS using Cartesia and streams it to the specified websocket."""
-    if not CARTESIA_CLIENT:
-        print(f"TTS> [{client_id}] Cannot stream: Cartesia client not initialized.")
-        return
-    if not websocket or websocket.closed:
-        print(f"TTS> [{client_id}] Cannot stream: WebSocket is closed.")
-        return
-    if not text_to_speak:
-        print(f"TTS> [{client_id}] Cannot stream: Input text is empty.")
-        return
-
-    print(f"TTS> [{client_id}] Starting TTS stream (Text: '{text_to_speak[:60]}...')")
+async def tts_chunks(client_id: str, text_to_speak: str, trace: Trace = None):
+    """Synthesizes text with Cartesia and yields it as ESP32 PCM chunks (converted on the DSP pool)."""
+    trace = trace or NullTrace("none")
+    # Executor threads do not see client_context, so their records carry the client explicitly
+    exec_log = logging.LoggerAdapter(logger, {"client": client_id})
     loop = asyncio.get_running_loop()
     cartesia_ws = None
     tts_generator = None
 
     try:
         def connect_and_send_cartesia_request_sync():
-            thread_id = threading.get_ident()
-            print(f"TTS EXEC> [{client_id}][T:{thread_id}] Connecting to Cartesia WS...")
+            exec_log.debug("TTS EXEC> Connecting to Cartesia WS...")
             ws = CARTESIA_CLIENT.tts.websocket()
-            print(f"TTS EXEC> [{client_id}][T:{thread_id}] Connected. Sending TTS request...")
-            print(f"TTS EXEC> [{client_id}][T:{thread_id}] Voice={TTS_VOICE_ID}, Model={TTS_MODEL_ID}, Rate={TTS_SOURCE_RATE}")
-            print(f"TTS EXEC> [{client_id}][T:{thread_id}] Text='{text_to_speak[:100]}...'")
+            exec_log.debug("TTS EXEC> Connected. Sending TTS request (Voice=%s, Model=%s, Rate=%s)",
+                           TTS_VOICE_ID, TTS_MODEL_ID, TTS_SOURCE_RATE)
             cartesia_output_format = {
                 "container": "raw", "encoding": TTS_SOURCE_ENCODING, "sample_rate": TTS_SOURCE_RATE
             }
@@ -129,54 +177,43 @@ async def stream_tts_response(websocket, client_id: str, text_to_speak: str):
                     stream=True,
                     output_format=cartesia_output_format,
                 )
-                print(f"TTS EXEC> [{client_id}][T:{thread_id}] Cartesia request sent. Got generator: {type(gen)}")
+                exec_log.debug("TTS EXEC> Cartesia request sent. Got generator: %s", type(gen))
                 return ws, gen
             except Exception as req_err:
-                 print(f"!!! TTS EXEC> [{client_id}][T:{thread_id}] ERROR during Cartesia ws.send(): {req_err}")
-                 traceback.print_exc()
+                 exec_log.exception("TTS EXEC> ERROR during Cartesia ws.send(): %s", req_err)
                  if ws:
                      try: ws.close()
                      except Exception: pass
                  raise
 
         def get_next_item_from_generator_sync(gen):
-            thread_id = threading.get_ident()
             try:
-                item = next(gen)
-                item_type = type(item)
-                item_info = f"Type: {item_type}"
-                if isinstance(item, dict) and 'audio' in item:
-                    audio_data = item.get('audio')
-                    item_info += f", Audio size: {len(audio_data) if audio_data else 0}"
-                elif isinstance(item, bytes):
-                     item_info += f", Bytes size: {len(item)}"
-                return item
+                return next(gen)
             except StopIteration:
-                print(f"TTS EXEC> [{client_id}][T:{thread_id}] Generator StopIteration.")
+                exec_log.debug("TTS EXEC> Generator StopIteration.")
                 return _GENERATOR_SENTINEL
             except Exception as e:
-                 print(f"!!! TTS EXEC> [{client_id}][T:{thread_id}] Error calling next() on generator: {e}")
-                 traceback.print_exc()
+                 exec_log.exception("TTS EXEC> Error calling next() on generator: %s", e)
                  raise
 
-        print(f"TTS> [{client_id}] Awaiting Cartesia connection/request in executor...")
+        logger.debug("TTS> Awaiting Cartesia connection/request in executor...")
+        metrics.API_REQUESTS.inc(api="tts")
         try:
-            cartesia_ws, tts_generator = await loop.run_in_executor(
-                None, connect_and_send_cartesia_request_sync
-            )
+            with trace.span("tts_connect"):
+                cartesia_ws, tts_generator = await loop.run_in_executor(
+                    None, connect_and_send_cartesia_request_sync
+                )
             if tts_generator is None:
-                print(f"!!! TTS> [{client_id}] Failed to get generator from Cartesia (connect function might have raised).")
+                logger.error("TTS> Failed to get generator from Cartesia (connect function might have raised).")
                 return
 
-            print(f"TTS> [{client_id}] Cartesia WS connection seems ready (Generator type: {type(tts_generator)}). Starting stream processing loop.")
+            logger.debug("TTS> Cartesia WS connection ready (Generator type: %s). Starting stream processing loop.", type(tts_generator))
 
         except Exception as setup_err:
-            print(f"!!! TTS> [{client_id}] Error during Cartesia setup executor task: {setup_err}")
+            logger.error("TTS> Error during Cartesia setup executor task: %s", setup_err)
+            metrics.API_ERRORS.inc(api="tts")
             return
 
-        total_bytes_sent = 0
-        start_time = time.monotonic()
-
         while True:
             output_item = None
             try:
@@ -185,73 +222,164 @@ async def stream_tts_response(websocket, client_id: str, text_to_speak: str):
                 )
 
                 if output_item is _GENERATOR_SENTINEL:
-                    print(f"TTS> [{client_id}] Generator finished (sentinel received).")
+                    logger.debug("TTS> Generator finished (sentinel received).")
                     break
 
             except Exception as gen_exec_err:
-                 print(f"\n!!! TTS> [{client_id}] ERROR receiving/processing data via Cartesia generator executor: {gen_exec_err}")
+                 logger.error("TTS> ERROR receiving/processing data via Cartesia generator executor: %s", gen_exec_err)
+                 metrics.API_ERRORS.inc(api="tts")
                  break
 
             source_buffer = None
             if isinstance(output_item, dict) and 'audio' in output_item:
                 source_buffer = output_item.get('audio')
             elif isinstance(output_item, bytes):
-                 print(f"WARN: TTS> [{client_id}] Received raw bytes, expected dict.")
+                 log_rate_limited(logger, "tts_raw_bytes", logging.WARNING, "TTS> Received raw bytes, expected dict.")
                  source_buffer = output_item
             elif hasattr(output_item, 'audio') and output_item.audio is not None:
                  source_buffer = output_item.audio
             else:
-                 print(f"WARN: TTS> [{client_id}] Received unexpected item type from Cartesia generator: {type(output_item)}. Content: {str(output_item)[:100]}")
+                 log_rate_limited(logger, "tts_unexpected_item", logging.WARNING,
+                                  "TTS> Received unexpected item type from Cartesia generator: %s. Content: %s",
+                                  type(output_item), str(output_item)[:100])
 
             if source_buffer:
-                esp32_buffer = convert_audio_chunk(source_buffer, TTS_SOURCE_RATE, ESP32_RATE)
+                esp32_buffer = await DSP_EXECUTOR.run(convert_audio_chunk, source_buffer, TTS_SOURCE_RATE, ESP32_RATE)
+                metrics.CONVERSION_CHUNKS.inc()
+                if esp32_buffer:
+                    yield esp32_buffer
 
-                if not esp32_buffer:
-                    continue
+    finally:
+        if cartesia_ws:
+            logger.debug("TTS> Cleaning up: Closing Cartesia WebSocket connection via executor...")
+            try:
+                 await loop.run_in_executor(None, cartesia_ws.close)
+                 logger.debug("TTS> Cartesia WebSocket closed.")
+            except Exception as close_err:
+                 logger.error("TTS> Error closing Cartesia WebSocket during cleanup: %s", close_err)
+        tts_generator = None
+
+async def pcm_chunks(audio: bytes):
+    """Yields pre-rendered ESP32 PCM in TTS-sized chunks."""
+    for offset in range(0, len(audio), CACHED_AUDIO_CHUNK_BYTES):
+        yield audio[offset:offset + CACHED_AUDIO_CHUNK_BYTES]
+
+async def stream_tts_response(session: Session, text_to_speak: str, trace: Trace = None, audio: bytes = None):
+    """Generates TTS using Cartesia (or plays pre-rendered audio) and streams it to the session's device."""
+    trace = trace or NullTrace("none")
+    websocket = session.websocket
+    if audio is None and not CARTESIA_CLIENT:
+        logger.warning("TTS> Cannot stream: Cartesia client not initialized.")
+        return
+    if not websocket or websocket.closed:
+        logger.info("TTS> Cannot stream: WebSocket is closed.")
+        return
+    if not text_to_speak:
+        logger.warning("TTS> Cannot stream: Input text is empty.")
+        return
 
-                buffer_len = len(esp32_buffer)
-                chunk_duration_s = buffer_len / ESP32_BYTES_PER_SECOND
-                target_send_time = time.monotonic() + chunk_duration_s * TTS_SLEEP_MULTIPLIER
+    logger.info("TTS> Starting %s stream (Text: '%s...')", "TTS" if audio is None else "prefetched", text_to_speak[:60])
+    chunks = tts_chunks(session.session_id, text_to_speak, trace) if audio is None else pcm_chunks(audio)
+    # Whole firmware DMA frames per message, paced to keep the device's jitter margin queued
+    messages = fixed_frames(chunks)
+    pacer = None
 
-                try:
-                    send_start = time.monotonic()
-                    await websocket.send(esp32_buffer)
-                    send_duration = time.monotonic() - send_start
-                    total_bytes_sent += buffer_len
+    try:
+        first_byte_span = trace.start_span("tts_first_byte")
+        total_bytes_sent = 0
+        start_time = time.monotonic()
+        first_send_time = None
 
-                    sleep_duration = target_send_time - time.monotonic()
-                    if sleep_duration > 0.001:
-                         await asyncio.sleep(sleep_duration)
+        async for esp32_buffer in messages:
+            buffer_len = len(esp32_buffer)
 
-                except websockets.exceptions.ConnectionClosed:
-                    print(f"\nTTS> [{client_id}] WebSocket closed while sending. Stopping TTS stream.")
-                    break
-                except Exception as send_err:
-                    print(f"\n!!! TTS> [{client_id}] Error sending TTS data to client WebSocket: {send_err}")
-                    traceback.print_exc()
-                    break
+            try:
+                if pacer is None:
+                    first_byte_span.end()
+                    trace.record_since("stop_recording", "response_latency")
+                    if session.cue_task is not None and not session.cue_task.done():
+                        await asyncio.wait([session.cue_task])  # no interleaving with a cue's messages
+                    # The reply queues on the device behind any cue still playing
+                    lead_in_s = max(0.0, session.audio_until - time.monotonic())
+                    session.audio_until = 0.0
+                    pacer = PlaybackPacer(session.network.prebuffer_s(), lead_in_s)
+                    metrics.TTS_PREBUFFER.observe(pacer.target_s)
+                else:
+                    wait_s = pacer.wait_s(time.monotonic())
+                    if wait_s > 0.001:
+                        await asyncio.sleep(wait_s)
+                    buffered_s = pacer.buffered_s(time.monotonic())
+                    if buffered_s < 0:
+                        metrics.PLAYBACK_UNDERRUNS.inc()
+                        log_rate_limited(logger, "tts_underrun", logging.WARNING,
+                                         "TTS> Reply audio %.0f ms late; the device ran dry.", -buffered_s * 1000)
+                    elif buffered_s > DEVICE_MAX_BUFFER_S:
+                        metrics.PLAYBACK_OVERRUNS.inc()
+                send_start = time.monotonic()
+                if first_send_time is None:
+                    first_send_time = send_start
+                    if session.turn_started is not None:
+                        session.last_response_s = round(send_start - session.turn_started, 3)
+                await websocket.send(esp32_buffer)
+                pacer.sent(send_start, buffer_len)
+                total_bytes_sent += buffer_len
+                session.bytes_out += buffer_len
+                metrics.TTS_BYTES_SENT.inc(buffer_len)
+
+            except websockets.exceptions.ConnectionClosed:
+                logger.info("TTS> WebSocket closed while sending. Stopping TTS stream.")
+                break
+            except Exception as send_err:
+                logger.exception("TTS> Error sending TTS data to client WebSocket: %s", send_err)
+                break
 
         end_time = time.monotonic()
         duration = end_time - start_time
-        print(f"TTS> Finished TTS stream processing loop for {client_id}. Sent {total_bytes_sent} bytes in {duration:.2f}s.")
+        logger.info("TTS> Finished TTS stream. Sent %d bytes in %.2fs.", total_bytes_sent, duration)
+        if first_send_time is not None:
+            trace.record("tts_stream", time.time() - duration, duration * 1000, bytes=total_bytes_sent)
+            if duration > 0:
+                metrics.TTS_STREAM_THROUGHPUT.set(total_bytes_sent / duration)
+            # The device plays in real time, so playback ends when the pacer's estimate runs out
+            audio_s = total_bytes_sent / ESP32_BYTES_PER_SECOND
+            remaining_s = max(0.0, pacer.buffered_s(end_time))
+            trace.record("playback", time.time() - (end_time - first_send_time),
+                         (end_time - first_send_time + remaining_s) * 1000, audio_s=round(audio_s, 3), estimated=True)
+            trace.record_since("stop_recording", "turn", extra_ms=remaining_s * 1000)
 
     except Exception as e:
-        print(f"!!! TTS> [{client_id}] UNHANDLED ERROR in TTS streaming main try/except block: {type(e).__name__} - {e}")
-        traceback.print_exc()
+        logger.exception("TTS> UNHANDLED ERROR in TTS streaming main try/except block: %s - %s", type(e).__name__, e)
     finally:
-        if cartesia_ws:
-            print(f"TTS> [{client_id}] Cleaning up: Closing Cartesia WebSocket connection via executor...")
-            try:
-                 await loop.run_in_executor(None, cartesia_ws.close)
-                 print(f"TTS> [{client_id}] Cartesia WebSocket closed.")
-            except Exception as close_err:
-                 print(f"!!! TTS> [{client_id}] Error closing Cartesia WebSocket during cleanup: {close_err}")
-        tts_generator = None
+        await messages.aclose()
+        await chunks.aclose()
 
-async def monitor_pipeline_and_stream_tts(process: subprocess.Popen, websocket, client_id: str, input_wav_path: str):
-    """Waits for pipeline subprocess, gets result, triggers TTS stream."""
-    print(f"MONITOR> Monitoring pipeline process (PID: {process.pid}) for {client_id}...")
+def remove_input_file(input_wav_path: str) -> None:
+    try:
+       logger.debug("Deleting input file: %s", input_wav_path)
+       os.remove(input_wav_path)
+    except OSError as e:
+       logger.warning("Failed to delete %s: %s", input_wav_path, e)
+
+def parse_pipeline_output(stdout_text: str) -> dict:
+    """Collects the PREFIX:value lines the pipeline prints (FINAL_LLM_RESPONSE, TRANSCRIPT, PREFETCH_HIT)."""
+    output = {}
+    for line in stdout_text.splitlines():
+        for prefix in ("FINAL_LLM_RESPONSE", "TRANSCRIPT", "PREFETCH_HIT"):
+            if line.startswith(prefix + ":") and prefix not in output:
+                output[prefix] = line[len(prefix) + 1:].strip()
+    return output
+
+async def monitor_pipeline_and_stream_tts(process: subprocess.Popen, session: Session, input_wav_path: str,
+                                          trace: Trace = None, prefetched: dict = None):
+    """Waits for pipeline subprocess, gets result, triggers TTS stream (or plays a prefetched reply)."""
+    logger.debug("MONITOR> Monitoring pipeline process (PID: %s)...", process.pid)
+    trace = trace or NullTrace("none")
+    pipeline_span = trace.start_span("pipeline", pid=process.pid)
+    metrics.API_REQUESTS.inc(api="pipeline")
+    metrics.PIPELINES_RUNNING.inc()
     llm_response = None
+    transcript = None
+    prefetched_reply = None
     stdout_data = None
     stderr_data = None
 
@@ -260,170 +388,347 @@ async def monitor_pipeline_and_stream_tts(process: subprocess.Popen, websocket,
             await asyncio.sleep(0.5)
 
         return_code = process.returncode
-        print(f"MONITOR> Pipeline process {process.pid} finished for {client_id} with code {return_code}.")
+        pipeline_span.end(return_code=return_code)
+        logger.info("MONITOR> Pipeline process %s finished with code %s.", process.pid, return_code)
 
         stdout_data, stderr_data = process.communicate()
         if stderr_data:
-             print(f"MONITOR> Pipeline process {process.pid} stderr for {client_id}:\n{stderr_data.decode('utf-8', errors='replace')}")
+             logger.debug("MONITOR> Pipeline process %s stderr:\n%s", process.pid, stderr_data.decode('utf-8', errors='replace'))
 
         if return_code == 0 and stdout_data:
             stdout_text = stdout_data.decode('utf-8', errors='replace')
-            print(f"MONITOR> Pipeline process {process.pid} stdout for {client_id}:\n{stdout_text[:200]}...")
-            prefix = "FINAL_LLM_RESPONSE:"
-            for line in stdout_text.splitlines():
-                if line.startswith(prefix):
-                    llm_response = line[len(prefix):].strip()
-                    print(f"MONITOR> Found LLM response for {client_id}: '{llm_response[:60]}...'")
-                    break
-            if not llm_response:
-                 print(f"WARN> MONITOR> Pipeline process {process.pid} finished successfully but '{prefix}' not found in stdout for {client_id}.")
+            logger.debug("MONITOR> Pipeline process %s stdout:\n%s...", process.pid, stdout_text[:200])
+            output = parse_pipeline_output(stdout_text)
+            llm_response = output.get("FINAL_LLM_RESPONSE")
+            transcript = output.get("TRANSCRIPT")
+            if "PREFETCH_HIT" in output:
+                prefetched_reply = (prefetched or {}).get(output["PREFETCH_HIT"])
+                logger.info("MONITOR> Request '%s' answered from the prefetch cache.", output["PREFETCH_HIT"])
+            if llm_response:
+                logger.debug("MONITOR> Found LLM response: '%s...'", llm_response[:60])
+            elif not prefetched_reply:
+                 logger.warning("MONITOR> Pipeline process %s finished successfully but 'FINAL_LLM_RESPONSE:' not found in stdout.", process.pid)
 
         elif return_code != 0:
-             print(f"!!! MONITOR> Pipeline process {process.pid} failed for {client_id} (Code: {return_code}).")
+             logger.error("MONITOR> Pipeline process %s failed (Code: %s).", process.pid, return_code)
 
+    except asyncio.CancelledError:
+        # Superseded or disconnected: free the slot's CPU right away
+        if process.poll() is None: process.terminate()
+        remove_input_file(input_wav_path)
+        raise
     except Exception as e:
-        print(f"!!! MONITOR> Error monitoring pipeline process {process.pid} for {client_id}: {e}")
-        traceback.print_exc()
+        logger.exception("MONITOR> Error monitoring pipeline process %s: %s", process.pid, e)
         if process.poll() is None: process.terminate()
+    finally:
+        metrics.PIPELINES_RUNNING.dec()
+
+    start_reply(session, transcript, llm_response, prefetched_reply, trace)
+    remove_input_file(input_wav_path)
+
+async def run_pipeline_in_process(session: Session, pcm: bytes, trace: Trace, prefetched: dict):
+    """Runs the async pipeline on this event loop, then triggers the TTS stream (or plays a prefetched reply)."""
+    set_current_trace(trace)  # this task's context only: the pipeline's spans go to the turn's trace
+    pipeline_span = trace.start_span("pipeline", mode="inprocess")
+    metrics.API_REQUESTS.inc(api="pipeline")
+    metrics.PIPELINES_RUNNING.inc()
+    transcript = None
+    prefetched_reply = None
+    parts = []
+
+    def on_transcript(text: str):
+        nonlocal transcript, prefetched_reply
+        transcript = text
+        key = utterance_key(text)
+        prefetched_reply = prefetched.get(key) if key else None
+        if prefetched_reply:
+            logger.info("MONITOR> Request '%s' answered from the prefetch cache.", key)
+            return prefetched_reply.text
+        return None
+
+    try:
+        async for part in pipeline.process_audio(pcm, session.thread_id, session.device_id, session.session_id,
+                                                 on_transcript=on_transcript):
+            parts.append(part)
+        pipeline_span.end(ok=bool(parts or prefetched_reply))
+    except Exception as e:
+        logger.exception("MONITOR> In-process pipeline failed: %s", e)
+        pipeline_span.end(ok=False)
+    finally:
+        metrics.PIPELINES_RUNNING.dec()
+
+    start_reply(session, transcript, "".join(parts).strip() or None, prefetched_reply, trace)
+
+def start_reply(session: Session, transcript: str, llm_response: str, prefetched_reply=None, trace: Trace = None):
+    """Starts streaming a finished turn's reply to the device and updates the prefetcher."""
+    if PREFETCHER and transcript:
+        PREFETCHER.record_turn(prefetched_reply)
+        PREFETCHER.after_reply(utterance_key(transcript), session.device_id)
+    if prefetched_reply:
+        llm_response, reply_audio = prefetched_reply.text, prefetched_reply.audio
+    else:
+        reply_audio = None
 
     if llm_response:
-        print(f"MONITOR> LLM response: {llm_response}")
-        if websocket and not websocket.closed:
-            print(f"MONITOR> Triggering TTS stream back to {client_id}.")
-            asyncio.create_task(stream_tts_response(websocket, client_id, llm_response))
+        logger.info("MONITOR> LLM response: %s", llm_response)
+        if not session.websocket.closed:
+            logger.debug("MONITOR> Triggering TTS stream back to client.")
+            tts_task = session.tts_task = asyncio.create_task(stream_tts_response(session, llm_response, trace, reply_audio))
+            tts_tasks.add(tts_task)
+            tts_task.add_done_callback(tts_tasks.discard)
         else:
-            print(f"MONITOR> Client {client_id} disconnected before TTS could be triggered.")
+            logger.info("MONITOR> Client disconnected before TTS could be triggered.")
     else:
-        print(f"MONITOR> No valid LLM response found for {client_id}. Skipping TTS.")
+        logger.warning("MONITOR> No valid LLM response found. Skipping TTS.")
+        metrics.API_ERRORS.inc(api="pipeline")
+
+def play_cue(session: Session, pcm: bytes, on_first_sent=None) -> asyncio.Task:
+    """
+    Starts sending a cue behind any cue still being sent, and notes when the
+    device will have played what went out, so TTS can follow on without a gap.
+    The turn does not wait for it; the reply's first message does.
+    """
+    previous = session.cue_task
+
+    async def send():
+        if previous is not None and not previous.done():
+            await asyncio.wait([previous])
+        pacer = PlaybackPacer(session.network.prebuffer_s(), max(0.0, session.audio_until - time.monotonic()))
+        try:
+            await send_cue(session.websocket, pcm, pacer, on_first_sent)
+        except websockets.exceptions.ConnectionClosed:
+            logger.debug("WS> Connection closed while playing a cue.")
+        finally:
+            if pacer.play_end is not None:
+                session.audio_until = pacer.play_end
+
+    session.cue_task = asyncio.create_task(send())
+    return session.cue_task
+
+async def run_pipeline_turn(session: Session, utterance, audio_s: float, trace: Trace):
+    """
+    Acknowledges the turn, waits for a pipeline slot, then runs the pipeline and streams its reply.
+    utterance is the recording's WAV path (pipeline subprocess) or its PCM (PIPELINE_MODE=inprocess).
+    """
+    in_process = isinstance(utterance, bytes)
+    input_wav_path = None if in_process else utterance
+    started = in_process  # nothing to clean up
+
+    async def play_wait_cue():
+        if not session.websocket.closed:
+            logger.info("SCHED> Still queued after %.1fs, playing wait cue.", PIPELINE_WAIT_CUE_S)
+            metrics.PIPELINE_WAIT_CUES.inc()
+            play_cue(session, WAIT_CUE)
 
     try:
-       print(f"MONITOR> Deleting input file: {input_wav_path}")
-       os.remove(input_wav_path)
-    except OSError as e:
-       print(f"WARN> MONITOR> Failed to delete {input_wav_path}: {e}")
+        prefetched = PREFETCHER.snapshot(session.device_id) if PREFETCHER else {}
+        if THINKING_CUE_ENABLED and not session.websocket.closed:
+            # Masks STT + LLM + TTS time; the reply is spliced in right after it
+            play_cue(session, thinking_cue(session.persona),
+                     on_first_sent=lambda: trace.record_since("stop_recording", "ack_latency"))
+            metrics.THINKING_CUES.inc()
+        queue_span = trace.start_span("pipeline_queue")
+        async with PIPELINE_SCHEDULER.slot(session.device_id, audio_s, on_long_wait=play_wait_cue):
+            queue_span.end()
+            if in_process:
+                await run_pipeline_in_process(session, utterance, trace, prefetched)
+                return
+            logger.debug("WS Launching pipeline subprocess for: %s", input_wav_path)
+            command = [sys.executable, PIPELINE_SCRIPT_PATH, input_wav_path]
+            logger.debug("WS Running command: %s", ' '.join(command))
+            with trace.span("pipeline_spawn"):
+                pipeline_process = subprocess.Popen(
+                    command,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    text=False,
+                    env={**os.environ, 'PYTHONIOENCODING': 'utf-8', **trace.env(),
+                         # Chat history is recorded per device and connection; it drives the prefetcher
+                         'DEVICE_ID': session.device_id, 'SESSION_ID': session.session_id,
+                         'THREAD_ID': session.thread_id,
+                         PREFETCH_REPLIES_ENV: replies_env(prefetched),
+                         **(STT_STAGE.pipeline_env() if STT_STAGE else {})}
+                )
+            started = True
+            logger.info("WS Pipeline process started (PID: %s)", pipeline_process.pid)
+            await monitor_pipeline_and_stream_tts(pipeline_process, session, input_wav_path, trace, prefetched)
+    except SchedulerFull as e:
+        logger.warning("SCHED> Turn rejected, pipeline queue is full (%s).", e)
+        if input_wav_path:
+            remove_input_file(input_wav_path)
+    except asyncio.CancelledError:
+        if not started:
+            remove_input_file(input_wav_path)
+        raise
+    except Exception as sub_err:
+        logger.exception("WS Failed to launch subprocess: %s", sub_err)
+
+async def generate_prefetched_reply(transcript: str):
+    """Runs the pipeline in text mode for a predicted request and renders the reply to ESP32 PCM."""
+    if not CARTESIA_CLIENT:
+        return None
+    # Lowest priority: the slot goes to real turns first
+    async with PIPELINE_SCHEDULER.slot(f"prefetch:{utterance_key(transcript)}", float("inf"), long_wait_s=None):
+        if PIPELINE_IN_PROCESS:
+            # Speculative: neither reads nor updates the device's conversation memory
+            reply = "".join([part async for part in pipeline.process_text(transcript, use_memory=False)]).strip()
+            return await render_prefetched_reply(reply)
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, PIPELINE_SCRIPT_PATH, "--text", transcript,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL,
+            env={**os.environ, 'PYTHONIOENCODING': 'utf-8'}
+        )
+        try:
+            stdout_data, _ = await process.communicate()
+        except asyncio.CancelledError:
+            if process.returncode is None: process.kill()
+            raise
+    reply = parse_pipeline_output(stdout_data.decode('utf-8', errors='replace')).get("FINAL_LLM_RESPONSE")
+    return await render_prefetched_reply(reply) if process.returncode == 0 else None
+
+async def render_prefetched_reply(reply: str):
+    if not reply:
+        return None
+    audio = b"".join([chunk async for chunk in tts_chunks("prefetch", reply)])
+    return (reply, audio) if audio else None
+
+def scheduler_has_capacity() -> bool:
+    return PIPELINE_SCHEDULER.waiting == 0 and PIPELINE_SCHEDULER.running < PIPELINE_SCHEDULER.max_concurrent
+
+# Speculative replies to likely follow-up requests (off unless PREFETCH_ENABLED)
+PREFETCHER = Prefetcher(generate_prefetched_reply, can_run=scheduler_has_capacity) if PREFETCH_ENABLED else None
+if PREFETCHER:
+    # Lists children's transcripts and replies: local clients only, like the admin API
+    add_route("GET", "/debug/prefetch", local_only(lambda request: (200, PREFETCHER.report()), "/debug/prefetch"))
+# Keeps every recorded utterance for QA; see server/archive.py
+ARCHIVE = ArchiveWriter() if ARCHIVE_ENABLED else None
+admin.install(SESSIONS, PIPELINE_SCHEDULER)
+# Batches the pipelines' STT requests; hosts the offline model (STT_PROVIDER=local) once per worker
+STT_STAGE = stt_service.install()
+
+def start_rtt_probe(session: Session) -> None:
+    if session.rtt_probe is None or session.rtt_probe.done():
+        session.rtt_probe = asyncio.create_task(probe_rtt(session.websocket, session.network))
 
 async def connection_handler(websocket, path):
     """Handles WebSocket connections FROM ESP32 devices."""
-    client_id = f"{websocket.remote_address[0]}:{websocket.remote_address[1]}"
-    print(f"WS> Client connected: {client_id} (Path: {path})")
-    client_tasks[websocket] = None
+    session = Session(websocket, path)
+    client_context.set(session.session_id)
+    logger.info("WS> Client connected (Path: %s)", path)
+    SESSIONS.add(session)
+    metrics.ACTIVE_CONNECTIONS.inc()
+    start_rtt_probe(session)
 
     is_recording = False
-    audio_file: wave.Wave_write = None
+    recording = RecordingBuffer()
     file_path = None
-    bytes_received_this_session = 0
+    trace = None
+    upload_span = None
 
     try:
         async for message in websocket:
-            if isinstance(message, str):
-                print(f"WS [{client_id}] >>> Received Text: {message}")
-                if message == "START_RECORDING" and not is_recording:
-                    if websocket in client_tasks and client_tasks[websocket]:
-                        monitor_task = client_tasks[websocket]
-                        if not monitor_task.done():
-                            print(f"WS [{client_id}] Cancelling previous pipeline monitoring task.")
-                            monitor_task.cancel()
-                        client_tasks[websocket] = None
-
-                    print(f"WS [{client_id}] --- Started Recording ---")
-                    is_recording = True
-                    bytes_received_this_session = 0
-                    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-                    safe_client_id = client_id.replace(":", "_").replace(".","_")
-                    filename = f"esp32_{safe_client_id}_{timestamp}.wav"
-                    file_path = os.path.join(AUDIO_SAVE_DIR, filename)
+            # Audio frames are by far the most frequent message, so they are checked first
+            if type(message) is bytes:
+                if is_recording:
+                    session.frames_in += 1
+                    session.bytes_in += len(message)
+                    if not recording.append(message):
+                        log_rate_limited(logger, "ws_recording_too_long", logging.WARNING,
+                                         "WS Recording is longer than %.0fs; dropping further audio.", RECORDING_MAX_S)
+                continue
+
+            logger.debug("WS >>> Received Text: %s", message)
+            session.last_active = time.monotonic()
+            if message == "START_RECORDING" and not is_recording:
+                if session.busy:
+                    logger.info("WS Cancelling previous pipeline monitoring task.")
+                    session.pipeline_task.cancel()
+                session.pipeline_task = None
+
+                logger.info("WS --- Started Recording ---")
+                is_recording = session.recording = True
+                recording.clear()
+                trace = Trace(device=session.session_id)
+                upload_span = trace.start_span("upload")
+                file_path = os.path.join(AUDIO_SAVE_DIR, session.next_recording_name())
+                metrics.RECORDINGS_IN_PROGRESS.inc()
+                logger.debug("WS Recording audio for: %s", file_path)
+
+            elif (message == "STOP_RECORDING" or message == "STOP_RECORDING_ERROR") and is_recording:
+                log_prefix = "--- Stopped Recording ---" if message == "STOP_RECORDING" else "!!! Received STOP_RECORDING_ERROR from client !!!"
+                logger.info("WS %s", log_prefix)
+                is_recording = session.recording = False
+                session.turn_started = time.monotonic()
+                # Refreshes the jitter estimate while the pipeline runs, before the reply is paced
+                start_rtt_probe(session)
+                metrics.RECORDINGS_IN_PROGRESS.dec()
+                utterance = None  # WAV path, or PCM for the in-process pipeline
+                trace.mark("stop_recording")
+                upload_span.end(bytes=len(recording))
+
+                if message == "STOP_RECORDING" and len(recording) and PIPELINE_IN_PROCESS:
+                    # The async pipeline transcribes the PCM directly; no WAV file
+                    utterance = bytes(recording.pcm())
+                elif message == "STOP_RECORDING" and len(recording):
                     try:
-                        audio_file = wave.open(file_path, 'wb')
-                        audio_file.setnchannels(ESP32_CHANNELS)
-                        audio_file.setsampwidth(ESP32_WIDTH)
-                        audio_file.setframerate(ESP32_RATE)
-                        print(f"WS [{client_id}] Saving audio to: {file_path}")
-                    except Exception as e:
-                        print(f"!!! ERROR [{client_id}] Cannot open/configure WAV file {file_path}: {e}")
-                        is_recording = False
-                        if audio_file: audio_file.close()
-                        audio_file = None
-                        file_path = None
-
-                elif (message == "STOP_RECORDING" or message == "STOP_RECORDING_ERROR") and is_recording:
-                    log_prefix = "--- Stopped Recording ---" if message == "STOP_RECORDING" else "!!! Received STOP_RECORDING_ERROR from client !!!"
-                    print(f"WS [{client_id}] {log_prefix}")
-                    is_recording = False
-                    successfully_saved_path = None
-
-                    if audio_file:
-                        current_file_path = file_path
-                        try:
-                            audio_file.close()
-                            print(f"WS [{client_id}] Closed WAV file: {current_file_path}. Total audio bytes received: {bytes_received_this_session}")
-                            if message == "STOP_RECORDING":
-                                successfully_saved_path = current_file_path
-                        except wave.Error as e:
-                            print(f"!!! ERROR [{client_id}] Error closing WAV file {current_file_path}: {e}")
-                        finally:
-                             audio_file = None
-                             file_path = None
-
-                    if successfully_saved_path:
-                        if not os.path.exists(PIPELINE_SCRIPT_PATH):
-                             print(f"!!! ERROR [{client_id}] Pipeline script not found at: {PIPELINE_SCRIPT_PATH}")
-                        else:
-                            print(f"WS [{client_id}] Launching pipeline subprocess for: {successfully_saved_path}")
-                            try:
-                                command = [sys.executable, PIPELINE_SCRIPT_PATH, successfully_saved_path]
-                                print(f"WS [{client_id}] Running command: {' '.join(command)}")
-                                pipeline_process = subprocess.Popen(
-                                    command,
-                                    stdout=subprocess.PIPE,
-                                    stderr=subprocess.PIPE,
-                                    text=False,
-                                    env={**os.environ, 'PYTHONIOENCODING': 'utf-8'}
-                                )
-                                print(f"WS [{client_id}] Pipeline process started (PID: {pipeline_process.pid})")
-
-                                monitor_task = asyncio.create_task(
-                                    monitor_pipeline_and_stream_tts(pipeline_process, websocket, client_id, successfully_saved_path)
-                                )
-                                client_tasks[websocket] = monitor_task
-
-                            except Exception as sub_err:
-                                 print(f"!!! ERROR [{client_id}] Failed to launch subprocess: {sub_err}")
-                                 traceback.print_exc()
-
-                    elif message == "STOP_RECORDING":
-                         print(f"WARN [{client_id}] Recording stopped, but no valid audio file was saved. Skipping pipeline.")
-
-            elif isinstance(message, bytes):
-                 if is_recording and audio_file:
-                    try:
-                        audio_file.writeframesraw(message)
-                        bytes_received_this_session += len(message)
-                    except Exception as e:
-                        print(f"!!! ERROR [{client_id}] Cannot write WAV frames to {file_path}: {e}")
-                        is_recording = False
-                        if audio_file: audio_file.close()
-                        audio_file = None
-                 elif is_recording and not audio_file:
-                      print(f"WARN [{client_id}] Received binary data while recording flag is set, but no file is open!")
+                        with trace.span("wav_write"):
+                            recording.write_wav(file_path)
+                        logger.debug("WS Wrote WAV file: %s. Total audio bytes received: %d", file_path, len(recording))
+                        utterance = file_path
+                    except (OSError, wave.Error) as e:
+                        logger.error("WS Cannot write WAV file %s: %s", file_path, e)
+                file_path = None
+
+                if utterance and ARCHIVE:
+                    archive_id = ARCHIVE.submit(bytes(recording.pcm()), session.device_id, trace.trace_id)
+                    logger.info("WS Archived utterance as %s", archive_id or "(dropped, archive writer backed up)")
+
+                if utterance:
+                    if not PIPELINE_IN_PROCESS and not os.path.exists(PIPELINE_SCRIPT_PATH):
+                         logger.error("WS Pipeline script not found at: %s", PIPELINE_SCRIPT_PATH)
+                    else:
+                        session.pipeline_task = asyncio.create_task(
+                            run_pipeline_turn(session, utterance, recording.seconds, trace)
+                        )
+
+                elif message == "STOP_RECORDING":
+                     logger.warning("WS Recording stopped, but no valid audio file was saved. Skipping pipeline.")
 
     except websockets.exceptions.ConnectionClosedError as close_err:
-        print(f"WS> Client {client_id} disconnected abruptly: {close_err}")
+        logger.info("WS> Client disconnected abruptly: %s", close_err)
     except websockets.exceptions.ConnectionClosedOK:
-        print(f"WS> Client {client_id} disconnected normally.")
+        logger.info("WS> Client disconnected normally.")
     except Exception as e:
-        print(f"WS> Error handling client {client_id}: {type(e).__name__} - {e}")
-        traceback.print_exc()
+        logger.exception("WS> Error handling client: %s - %s", type(e).__name__, e)
     finally:
-        print(f"WS> Cleaning up connection for client {client_id}")
-        if websocket in client_tasks:
-            monitor_task = client_tasks.pop(websocket)
-            if monitor_task and not monitor_task.done():
-                print(f"WS> Cancelling pipeline monitoring task for disconnected client {client_id}.")
-                monitor_task.cancel()
-        if audio_file:
-            print(f"WS [{client_id}] Closing WAV file due to disconnection: {file_path}")
-            try: audio_file.close()
-            except wave.Error as e: print(f"!!! ERROR closing WAV file {file_path}: {e}")
+        logger.debug("WS> Cleaning up connection")
+        metrics.ACTIVE_CONNECTIONS.dec()
+        SESSIONS.remove(session)
+        if is_recording:
+            logger.info("WS Discarding %.1fs of audio recorded before disconnection.", recording.seconds)
+            metrics.RECORDINGS_IN_PROGRESS.dec()
+        if session.rtt_probe:
+            session.rtt_probe.cancel()
+        if session.cue_task:
+            session.cue_task.cancel()
+        if session.busy:
+            logger.info("WS> Cancelling pipeline monitoring task for disconnected client.")
+            session.pipeline_task.cancel()
+
+def server_is_idle() -> bool:
+    """True when no client is recording, waiting on a pipeline or receiving TTS."""
+    return (metrics.RECORDINGS_IN_PROGRESS.value() <= 0
+            and not tts_tasks
+            and not any(session.busy for session in SESSIONS))
+
+async def drain_connections(server) -> None:
+    """Stops accepting new clients and waits (up to WORKER_DRAIN_S) for in-flight turns to finish."""
+    logger.info("Draining: no longer accepting connections, waiting up to %.0fs for active turns...", WORKER_DRAIN_S)
+    server.server.close()
+    deadline = time.monotonic() + WORKER_DRAIN_S
+    while not server_is_idle() and time.monotonic() < deadline:
+        await asyncio.sleep(0.2)
+    logger.info("Drained (%d idle connections will be closed; devices reconnect to another worker).", len(server.websockets))
 
 async def start_server():
     """Starts the WebSocket server."""
@@ -432,14 +737,55 @@ async def start_server():
     server_settings = {
         "ping_interval": 20, "ping_timeout": 15, "close_timeout": 10, "max_size": 1024 * 1024
     }
+    LOOP_MONITOR.start()
+    # Workers expose their metrics on a private port; the supervisor aggregates them on METRICS_PORT
+    # (port 0: the kernel picks a free one, reported back to the supervisor)
+    metrics_host, metrics_port = (METRICS_HOST, METRICS_PORT) if WORKER_ID is None else ("127.0.0.1", 0)
+    try:
+        metrics_server = await start_http_server(metrics_host, metrics_port)
+        metrics_port = metrics_server.sockets[0].getsockname()[1]
+        print(f"Metrics available at http://{metrics_host}:{metrics_port}/metrics")
+    except OSError as metrics_err:
+        print(f"!!! WARNING: Could not start metrics endpoint on port {metrics_port}: {metrics_err}")
+        metrics_server = None
+    supervisor.report_metrics_port(metrics_port if metrics_server else None)
+    if STT_STAGE and metrics_server:
+        STT_STAGE.url = stt_service.service_url(metrics_port)
+
+    stop = asyncio.get_running_loop().create_future()
     try:
-        async with websockets.serve(connection_handler, HOST, PORT, **server_settings):
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, lambda: stop.done() or stop.set_result(None))
+    except (NotImplementedError, AttributeError):
+        pass  # No loop signal handlers on Windows
+
+    try:
+        if WORKER_ID is not None:
+            affinity_workers = SERVER_WORKERS if SERVER_AFFINITY == "ip" else 0
+            listen_args = {"sock": supervisor.reuseport_socket(HOST, PORT, affinity_workers)}
+        else:
+            listen_args = {"host": HOST, "port": PORT}
+        async with websockets.serve(connection_handler, **listen_args, **server_settings) as server:
             print(f"WebSocket server listening. Press Ctrl+C to stop.")
-            await asyncio.Future()
+            await stop
+            await drain_connections(server)
     except OSError as os_err:
         if "address already in use" in str(os_err).lower(): print(f"!!! FATAL ERROR: Port {PORT} is already in use on {HOST}.")
         else: print(f"!!! FATAL ERROR: Could not start server: {os_err}")
     except Exception as start_err: print(f"!!! FATAL ERROR: Failed to start WebSocket server: {start_err}")
+    finally:
+        if metrics_server:
+            metrics_server.close()
+        if PREFETCHER:
+            PREFETCHER.cancel()
+        if ARCHIVE:
+            ARCHIVE.close()
+        if STT_STAGE:
+            STT_STAGE.close()
+        if PIPELINE_IN_PROCESS:
+            await pipeline.close()
+        DSP_EXECUTOR.shutdown()
+        LOOP_MONITOR.stop()
+        stop_logging()
 
 if __name__ == "__main__":
     try:
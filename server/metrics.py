@@ -0,0 +1,238 @@
+"""
+In-process metrics in the Prometheus text exposition format.
+Counters, gauges and histograms are plain Python numbers behind a per-metric
+lock, so updating them on hot paths costs well under a microsecond; text is
+only rendered when /metrics is scraped.
+"""
+import math
+import threading
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+DEFAULT_LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames: Sequence[str], labelvalues: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class MetricsRegistry:
+    """Holds every metric and renders them for a scrape."""
+
+    def __init__(self):
+        self._metrics: List["_Metric"] = []
+
+    def register(self, metric: "_Metric") -> None:
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), registry: MetricsRegistry = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], float] = {}
+        if not self.labelnames:
+            self._values[()] = 0.0
+        registry.register(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS, registry: MetricsRegistry = REGISTRY):
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # key -> [bucket counts..., sum, count]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+        super().__init__(name, documentation, labelnames, registry)
+        self._values.clear()
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._series.items()]
+        lines = []
+        for key, series in items:
+            cumulative = 0.0
+            for i, bound in enumerate(self.buckets):
+                cumulative += series[i]
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {_format_value(cumulative)}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{labels} {_format_value(series[-1])}")
+        return lines
+
+
+def _with_label(series: str, label: str) -> str:
+    name, brace, rest = series.partition("{")
+    return f"{name}{{{label},{rest}" if brace else f"{name}{{{label}}}"
+
+
+def merge_expositions(texts: Iterable[str], worker_ids: Sequence[str] = None) -> str:
+    """Merges several scrapes (one per worker). Counters and histograms are summed;
+    gauges are point-in-time values that may not add up ("last stream"), so each
+    worker's sample is kept with a worker label (summed only without worker_ids)."""
+    headers: Dict[str, List[str]] = {}
+    types: Dict[str, str] = {}
+    values: Dict[str, float] = {}
+    series_of: Dict[str, List[str]] = {}  # metric name from # TYPE -> its series, grouped for the output
+    for position, text in enumerate(texts):
+        worker = f'worker="{worker_ids[position]}"' if worker_ids is not None else None
+        current = ""
+        for line in text.splitlines():
+            if line.startswith("# "):
+                parts = line.split(" ", 3)
+                if len(parts) >= 3:
+                    current = parts[2]
+                    headers.setdefault(current, [])
+                    if line not in headers[current]:
+                        headers[current].append(line)
+                    if parts[1] == "TYPE" and len(parts) == 4:
+                        types[current] = parts[3].strip()
+                continue
+            series, _, value = line.rpartition(" ")
+            if not series:
+                continue
+            if worker and types.get(current) == "gauge":
+                series = _with_label(series, worker)
+            if series not in values:
+                series_of.setdefault(current, []).append(series)
+                values[series] = 0.0
+            values[series] += float(value)
+    lines = []
+    for name, keys in series_of.items():
+        lines.extend(headers.get(name, []))
+        lines.extend(f"{series} {_format_value(values[series])}" for series in keys)
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+# --- Server metrics ---
+ACTIVE_CONNECTIONS = Gauge("tedtoy_active_connections", "Connected WebSocket clients.")
+RECORDINGS_IN_PROGRESS = Gauge("tedtoy_recordings_in_progress", "Clients currently streaming microphone audio.")
+PIPELINES_RUNNING = Gauge("tedtoy_pipelines_running", "STT/LLM pipelines currently running.")
+PIPELINE_QUEUE_DEPTH = Gauge("tedtoy_pipeline_queue_depth", "Pipelines waiting to start.")
+PIPELINE_QUEUE_WAIT = Histogram("tedtoy_pipeline_queue_wait_seconds", "Time turns waited for a pipeline slot.",
+                                buckets=(0.01, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0))
+PIPELINE_REJECTED = Counter("tedtoy_pipeline_rejected_total", "Turns refused because the pipeline queue was full.")
+PIPELINE_SUPERSEDED = Counter("tedtoy_pipeline_superseded_total", "In-flight turns cancelled by a newer turn from the same device.")
+PIPELINE_WAIT_CUES = Counter("tedtoy_pipeline_wait_cues_total", "'Please wait' cues played to queued devices.")
+THINKING_CUES = Counter("tedtoy_thinking_cues_total", "'Thinking' earcons played when a recording stops.")
+PREFETCH_LOOKUPS = Counter("tedtoy_prefetch_lookups_total", "Turns served from the prefetch cache (hit) or not (miss).", ["result"])
+PREFETCH_GENERATED = Counter("tedtoy_prefetch_generated_total", "Speculative reply generations.", ["result"])
+PREFETCH_SKIPPED = Counter("tedtoy_prefetch_skipped_total", "Speculative generations skipped.", ["reason"])
+PREFETCH_CACHE_BYTES = Gauge("tedtoy_prefetch_cache_bytes", "Audio held in the prefetch cache.")
+ARCHIVE_UTTERANCES = Counter("tedtoy_archive_utterances_total", "Utterances written to the archive, or dropped or failed.", ["result"])
+ARCHIVE_BYTES = Counter("tedtoy_archive_bytes_total", "Archived audio before (raw) and after (stored) compression.", ["kind"])
+STT_BATCH_SIZE = Histogram("tedtoy_stt_batch_size", "Utterances per batch sent to the STT provider.",
+                           buckets=(1, 2, 3, 4, 6, 8, 12, 16, 32))
+STT_BATCH_WAIT = Histogram("tedtoy_stt_batch_wait_seconds", "Time utterances waited for their STT batch to start.",
+                           buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25))
+STT_BATCH_SECONDS = Histogram("tedtoy_stt_batch_seconds", "Wall time to transcribe a batch.",
+                              buckets=(0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0))
+STT_UTTERANCES = Counter("tedtoy_stt_utterances_total", "Utterances transcribed by the STT stage, by result.", ["result"])
+STT_AUDIO_SECONDS = Counter("tedtoy_stt_audio_seconds_total", "Audio transcribed by the STT stage (rate() is its throughput).")
+STAGE_LATENCY = Histogram("tedtoy_stage_latency_seconds", "Latency of each traced turn stage.", ["stage"])
+TTS_BYTES_SENT = Counter("tedtoy_tts_bytes_sent_total", "TTS audio bytes sent to devices.")
+TTS_STREAM_THROUGHPUT = Gauge("tedtoy_tts_stream_bytes_per_second", "Send throughput of the last finished TTS stream.")
+CONVERSION_CPU_SECONDS = Counter("tedtoy_audio_conversion_cpu_seconds_total", "CPU time spent converting/resampling TTS audio.")
+DSP_JOB_SECONDS = Histogram("tedtoy_dsp_job_seconds", "Wall time of audio DSP jobs on the DSP pool.",
+                            buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25))
+DSP_QUEUE_WAIT = Histogram("tedtoy_dsp_queue_wait_seconds", "Time audio DSP jobs waited for a free pool slot.",
+                           buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25))
+DSP_JOBS_PENDING = Gauge("tedtoy_dsp_jobs_pending", "Audio DSP jobs submitted to the pool and not yet finished.")
+CONVERSION_CHUNKS = Counter("tedtoy_audio_conversion_chunks_total", "TTS audio chunks converted.")
+PLAYBACK_UNDERRUNS = Counter("tedtoy_playback_underruns_total", "TTS chunks sent after the device buffer was estimated to be empty.")
+PLAYBACK_OVERRUNS = Counter("tedtoy_playback_overruns_total", "TTS chunks sent while the device buffer was estimated to be over capacity.")
+DEVICE_RTT = Histogram("tedtoy_device_rtt_seconds", "WebSocket ping round trips to devices.",
+                       buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0))
+TTS_PREBUFFER = Histogram("tedtoy_tts_prebuffer_seconds", "Playback lead targeted per reply, from the device's network jitter.",
+                          buckets=(0.15, 0.2, 0.3, 0.5, 0.75, 1.0, 2.0))
+LOOP_LAG = Histogram("tedtoy_event_loop_lag_seconds", "How late the event loop woke from a timed sleep.",
+                     buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+LOOP_STALLS = Counter("tedtoy_event_loop_stalls_total", "Event loop stalls longer than SLOW_CALLBACK_MS.", ["kind"])
+API_REQUESTS = Counter("tedtoy_api_requests_total", "Requests to external processing stages.", ["api"])
+API_ERRORS = Counter("tedtoy_api_errors_total", "Failed requests to external processing stages.", ["api"])
+
+
+def observe_span(name: str, duration_ms: float, attributes: dict) -> None:
+    """Tracing listener that feeds every recorded span into STAGE_LATENCY."""
+    STAGE_LATENCY.observe(duration_ms / 1000, stage=name)
@@ -0,0 +1,120 @@
+"""
+Async STT -> agent pipeline that runs on the server's event loop.
+
+The subprocess pipeline (pipeline_script.py) blocks on every HTTP call, so
+each turn needs a process of its own. Here the same steps are coroutines:
+STT over async clients (utils.transcribe_audio_async), the agent graph
+with an async node and checkpointer, and the chat history written on a
+worker thread. Turns overlap on I/O within one process, and the model
+clients, the compiled graph and the memory database stay open between
+them. Used by the server when PIPELINE_MODE=inprocess.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import AsyncIterator, Callable, Optional
+
+from database.sql_utils import create_db, get_db_path, get_or_create_conversation, save_message
+from langgraph.agent import Agent
+from utils.tracing import get_current_trace
+from utils.utils import setup_llm, transcribe_audio_async
+
+logger = logging.getLogger(__name__)
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PERSONALITY_PATH = os.getenv("PERSONALITY_PATH", os.path.join(project_root, "chat", "toy.json"))
+
+_agents = {}  # use_memory -> Agent
+_agents_lock = asyncio.Lock()
+_memory_conn = None
+
+
+async def _get_agent(use_memory: bool) -> Agent:
+    """The process's agent with (or without) conversation memory, built on first use."""
+    global _memory_conn
+    async with _agents_lock:
+        agent = _agents.get(use_memory)
+        if agent is None:
+            checkpointer = None
+            if use_memory:
+                import aiosqlite
+                from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+                _memory_conn = await aiosqlite.connect(get_db_path())
+                checkpointer = AsyncSqliteSaver(_memory_conn)
+                await checkpointer.setup()
+            agent = _agents[use_memory] = Agent(model=setup_llm(), checkpointer=checkpointer,
+                                                personality_path=PERSONALITY_PATH, asynchronous=True)
+        return agent
+
+
+def record_message(device_id: str, session_id: str, role: str, content: str) -> None:
+    """Appends a message to the device's conversation (blocking; run it on a thread)."""
+    try:
+        conn, cursor = create_db()
+        try:
+            save_message(cursor, get_or_create_conversation(cursor, device_id, session_id), role, content)
+        finally:
+            conn.close()
+    except Exception as e:
+        logger.warning("Could not record %s message: %s", role, e)
+
+
+async def process_text(text: str, thread_id: str = None, use_memory: bool = True,
+                       device_id: str = None, session_id: str = None) -> AsyncIterator[str]:
+    """
+    Yields the agent's reply to text as it is generated.
+    thread_id selects the conversation memory; without use_memory the
+    memory is neither read nor updated (speculative replies). With
+    device_id the finished reply is saved to the chat history.
+    """
+    agent = await _get_agent(use_memory)
+    parts = []
+    with get_current_trace().span("agent"):
+        async for part in agent.astream_reply(text, thread_id):
+            parts.append(part)
+            yield part
+    if device_id and parts:
+        await asyncio.to_thread(record_message, device_id, session_id or device_id, "assistant", "".join(parts))
+
+
+async def process_audio(pcm: bytes, thread_id: str = None, device_id: str = None, session_id: str = None,
+                        on_transcript: Callable[[str], Optional[str]] = None) -> AsyncIterator[str]:
+    """
+    Transcribes an utterance (16 kHz 16-bit mono PCM) and yields the
+    agent's reply as it is generated; nothing if transcription fails.
+    on_transcript(text) is called with the transcript; if it returns a
+    reply the caller already has (prefetched), that reply is recorded in
+    the chat history and memory instead of running the agent, and nothing
+    is yielded.
+    """
+    started = time.monotonic()
+    trace = get_current_trace()
+    with trace.span("stt"):
+        transcript = await transcribe_audio_async(pcm)
+    if not transcript:
+        logger.error("Transcription failed (%.1fs of audio)", len(pcm) / 32000)
+        return
+    if device_id:
+        await asyncio.to_thread(record_message, device_id, session_id or device_id, "user", transcript)
+    known_reply = on_transcript(transcript) if on_transcript else None
+    if known_reply:
+        agent = await _get_agent(True)
+        await agent.aremember_turn(transcript, known_reply, thread_id)
+        if device_id:
+            await asyncio.to_thread(record_message, device_id, session_id or device_id, "assistant", known_reply)
+    else:
+        async for part in process_text(transcript, thread_id, device_id=device_id, session_id=session_id):
+            yield part
+    elapsed = time.monotonic() - started
+    logger.info("Pipeline completed (Took %.2fs)", elapsed)
+    trace.record("pipeline_total", time.time() - elapsed, elapsed * 1000)
+
+
+async def close() -> None:
+    """Closes the memory database."""
+    global _memory_conn
+    _agents.clear()
+    if _memory_conn is not None:
+        await _memory_conn.close()
+        _memory_conn = None
@@ -1,6 +1,10 @@
 """
 Speech-to-text and LLM processing pipeline script.
 Takes an audio file path as input, transcribes it, and processes the text with an LLM.
+With --text <utterance> it skips STT and conversation memory (speculative
+replies for the server's prefetcher, see server/prefetch.py). When the
+transcript matches a reply the server has prefetched (PREFETCH_REPLIES),
+that reply is recorded instead of running the agent.
 """
 
 import os
@@ -30,23 +34,22 @@ if sys.platform == 'win32':
             pass
 
 # Third-party imports
-import assemblyai as aai
+# Provider SDKs (openai, langchain_together, assemblyai, ...) are imported
+# lazily by the utils factories; see benchmarks/import_time.py.
 from dotenv import load_dotenv
-from langchain_core.messages import HumanMessage
-from langchain_together import ChatTogether
-from openai import OpenAI
+
+# Before the local imports, which read their settings from the environment
+load_dotenv()
 
 # Local imports
 from utils.utils import (
     setup_llm,
-    transcribe_audio_whisper,
-    run_llm_sync,
-    setup_llm_services
+    transcribe_audio
 )
-from langgraph.tools import history_search, story_teller, input_validator
-from database.sql_utils import initialize_db
-from config.config import langgraph_config
+from database.sql_utils import create_db, get_or_create_conversation, initialize_db, save_message
 from langgraph.agent import Agent
+from utils.tracing import get_current_trace, set_current_trace, trace_from_env
+from server.prefetch import replies_from_env, utterance_key
 
 logging.basicConfig(
     level=logging.INFO,
@@ -55,14 +58,41 @@ logging.basicConfig(
 )
 logger = logging.getLogger('pipeline')
 
-load_dotenv()
+def record_message(role: str, content: str) -> None:
+    """Appends a message to the device's conversation (DEVICE_ID/SESSION_ID from the server)."""
+    device_id = os.getenv("DEVICE_ID")
+    if not device_id:
+        return
+    try:
+        conn, cursor = create_db()
+        try:
+            conversation_id = get_or_create_conversation(cursor, device_id, os.getenv("SESSION_ID", device_id))
+            save_message(cursor, conversation_id, role, content)
+        finally:
+            conn.close()
+    except Exception as e:
+        logger.warning(f"Could not record {role} message: {e}")
+
+def remember_reply(text: str, reply: str) -> None:
+    """Records a turn answered without the agent (a prefetched reply) in the chat history and memory."""
+    record_message("assistant", reply)
+    try:
+        conn, cursor, memory = initialize_db()
+        try:
+            personality_path = os.getenv("PERSONALITY_PATH", os.path.join(project_root, "chat", "toy.json"))
+            Agent(model=None, checkpointer=memory, personality_path=personality_path).remember_turn(text, reply)
+        finally:
+            conn.close()
+    except Exception as e:
+        logger.warning(f"Could not add the prefetched reply to the conversation memory: {e}")
 
-def run_agent_graph(text: str) -> Optional[str]:
+def run_agent_graph(text: str, use_memory: bool = True) -> Optional[str]:
     """
     Process transcribed text using the Agent graph.
     
     Args:
         text: The text to process from the audio transcription
+        use_memory: Whether to read and update the conversation memory
         
     Returns:
         Agent response or None if failed
@@ -72,7 +102,7 @@ def run_agent_graph(text: str) -> Optional[str]:
     try:
         llm = llm_validate = setup_llm()
         
-        conn, cursor, memory = initialize_db()
+        conn, cursor, memory = initialize_db() if use_memory else (None, None, None)
         
         current_dir = os.path.dirname(os.path.abspath(__file__))
         personality_path = os.getenv("PERSONALITY_PATH", os.path.join(project_root, "chat", "toy.json"))
@@ -120,24 +150,40 @@ def process_audio_file(audio_file_path: str) -> Optional[str]:
     """
     logger.info(f"--- PIPELINE PROCESSING: {audio_file_path} ---")
     start_time = time.monotonic()
+    trace = get_current_trace()
     
     file_basename = os.path.basename(audio_file_path)
     logger.info(f"Processing file: {file_basename}")
 
-    transcribed_text = transcribe_audio_whisper(audio_file_path)
+    with trace.span("stt"):
+        transcribed_text = transcribe_audio(audio_file_path)
     
     if not transcribed_text:
         logger.error(f"Transcription failed for {file_basename}")
         return None
 
-    llm_final_response = run_agent_graph(transcribed_text)
+    print(f"TRANSCRIPT:{transcribed_text}")
+    record_message("user", transcribed_text)
+    key = utterance_key(transcribed_text)
+    prefetched_reply = replies_from_env().get(key) if key else None
+    if prefetched_reply:
+        # The server already holds this reply's audio and plays it; the history must still show it
+        logger.info(f"Prefetched reply available for '{key}', skipping the agent")
+        print(f"PREFETCH_HIT:{key}")
+        remember_reply(transcribed_text, prefetched_reply)
+        llm_final_response = prefetched_reply
+    else:
+        with trace.span("agent"):
+            llm_final_response = run_agent_graph(transcribed_text)
 
-    if not llm_final_response:
-        logger.error(f"LLM processing failed for {file_basename}")
-        return None
+        if not llm_final_response:
+            logger.error(f"LLM processing failed for {file_basename}")
+            return None
+        record_message("assistant", llm_final_response)
 
     end_time = time.monotonic()
     logger.info(f"Pipeline completed for {file_basename} (Took {end_time - start_time:.2f}s)")
+    trace.record("pipeline_total", time.time() - (end_time - start_time), (end_time - start_time) * 1000)
     
     return llm_final_response
 
@@ -145,14 +191,18 @@ def main() -> None:
     """Main pipeline execution function."""
     logger.info(f"--- PIPELINE SCRIPT ({os.getpid()}) START ---")
     
-    if len(sys.argv) != 2:
+    if len(sys.argv) == 3 and sys.argv[1] == "--text":
+        # Speculative reply for the prefetcher: no STT, and the conversation memory is left alone
+        result = run_agent_graph(sys.argv[2], use_memory=False)
+    elif len(sys.argv) == 2:
+        input_wav_path = sys.argv[1]
+        # Spans are recorded against the turn's trace id passed by the server
+        set_current_trace(trace_from_env())
+        result = process_audio_file(input_wav_path)
+    else:
         logger.error("Incorrect arguments")
-        logger.info("Usage: python pipeline_script.py <path_to_wav_file>")
+        logger.info("Usage: python pipeline_script.py <path_to_wav_file> | --text <utterance>")
         sys.exit(1)
-
-    input_wav_path = sys.argv[1]
-    
-    result = process_audio_file(input_wav_path)
     
     if result:
         try:
@@ -0,0 +1,141 @@
+"""
+Framing and pacing of reply audio sent to a device.
+The firmware writes every WebSocket message straight into its I2S DAC DMA
+ring (8 buffers of I2S_DAC_BUFFER_LENGTH = 512 bytes, 128 ms) and drops
+the message if it does not fit within I2S_WRITE_TIMEOUT_MS (100 ms). Reply
+audio is therefore re-cut into messages of whole 512-byte frames, each
+shorter than that timeout, whatever chunk sizes the TTS service produces.
+
+The server keeps the device a target lead ahead of playback: enough to
+ride out the network jitter measured for that device (WebSocket ping RTT
+variation, as in TCP's retransmission timer), and no more. The first
+frame goes out as soon as it is synthesized.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import AsyncIterator, List, Optional
+
+from server import metrics
+
+logger = logging.getLogger(__name__)
+
+PLAYBACK_BYTES_PER_SECOND = 16000 * 2  # ESP32 playback format: 16 kHz, 16-bit mono
+# Firmware I2S_DAC_BUFFER_LENGTH; messages are whole multiples of it
+TTS_FRAME_BYTES = int(os.getenv("TTS_FRAME_BYTES", "512"))
+# 4 x 512 bytes = 64 ms per message, below the firmware's 100 ms I2S write timeout
+TTS_FRAMES_PER_MESSAGE = int(os.getenv("TTS_FRAMES_PER_MESSAGE", "4"))
+# Lead kept ahead of device playback: PREBUFFER_MIN_S + JITTER_FACTOR x RTT variation, at most PREBUFFER_MAX_S
+TTS_PREBUFFER_MIN_S = float(os.getenv("TTS_PREBUFFER_MIN_S", "0.15"))
+TTS_PREBUFFER_MAX_S = float(os.getenv("TTS_PREBUFFER_MAX_S", "1.0"))
+TTS_JITTER_FACTOR = float(os.getenv("TTS_JITTER_FACTOR", "4"))
+RTT_PROBE_TIMEOUT_S = 2.0
+
+
+class Rechunker:
+    """Re-cuts a PCM stream into messages of frames_per_message whole frames."""
+    __slots__ = ("frame_bytes", "message_bytes", "_pending")
+
+    def __init__(self, frame_bytes: int = TTS_FRAME_BYTES, frames_per_message: int = TTS_FRAMES_PER_MESSAGE):
+        self.frame_bytes = frame_bytes
+        self.message_bytes = frame_bytes * max(1, frames_per_message)
+        self._pending = bytearray()
+
+    def push(self, data: bytes) -> List[bytes]:
+        """Adds audio; returns the full messages it completes."""
+        self._pending += data
+        count = len(self._pending) // self.message_bytes
+        if not count:
+            return []
+        end = count * self.message_bytes
+        view = memoryview(self._pending)
+        messages = [bytes(view[offset:offset + self.message_bytes]) for offset in range(0, end, self.message_bytes)]
+        view.release()
+        del self._pending[:end]
+        return messages
+
+    def flush(self) -> List[bytes]:
+        """The remaining audio, padded with silence to a whole frame so no stale DMA data plays."""
+        if not self._pending:
+            return []
+        remainder = len(self._pending) % self.frame_bytes
+        if remainder:
+            self._pending += bytes(self.frame_bytes - remainder)
+        message = bytes(self._pending)
+        self._pending.clear()
+        return [message]
+
+
+async def fixed_frames(chunks: AsyncIterator[bytes], rechunker: Rechunker = None) -> AsyncIterator[bytes]:
+    """Yields chunks re-cut into firmware-sized messages."""
+    rechunker = rechunker or Rechunker()
+    async for chunk in chunks:
+        for message in rechunker.push(chunk):
+            yield message
+    for message in rechunker.flush():
+        yield message
+
+
+class NetworkEstimate:
+    """Smoothed RTT and RTT variation of one device (RFC 6298 estimator)."""
+    __slots__ = ("srtt_s", "rttvar_s", "samples")
+
+    def __init__(self):
+        self.srtt_s: Optional[float] = None
+        self.rttvar_s = 0.0
+        self.samples = 0
+
+    def observe(self, rtt_s: float) -> None:
+        if self.srtt_s is None:
+            self.srtt_s, self.rttvar_s = rtt_s, rtt_s / 2
+        else:
+            self.rttvar_s = 0.75 * self.rttvar_s + 0.25 * abs(self.srtt_s - rtt_s)
+            self.srtt_s = 0.875 * self.srtt_s + 0.125 * rtt_s
+        self.samples += 1
+
+    def prebuffer_s(self) -> float:
+        """Lead to keep ahead of playback on this device."""
+        return min(TTS_PREBUFFER_MAX_S, TTS_PREBUFFER_MIN_S + TTS_JITTER_FACTOR * self.rttvar_s)
+
+
+async def probe_rtt(websocket, estimate: NetworkEstimate, timeout_s: float = RTT_PROBE_TIMEOUT_S) -> Optional[float]:
+    """Measures one WebSocket ping round trip into estimate; None if the device did not answer in time."""
+    try:
+        started = time.monotonic()
+        pong = await websocket.ping()
+        await asyncio.wait_for(pong, timeout_s)
+    except Exception as e:  # timeout or connection closed
+        logger.debug("Ping to device failed: %s", e)
+        return None
+    rtt_s = time.monotonic() - started
+    estimate.observe(rtt_s)
+    metrics.DEVICE_RTT.observe(rtt_s)
+    return rtt_s
+
+
+class PlaybackPacer:
+    """
+    Tracks how much audio the device has queued, assuming it plays each
+    message in real time on arrival (after lead_in_s of audio it already
+    holds, such as a cue), and how long to wait to keep target_s queued.
+    """
+    __slots__ = ("target_s", "lead_in_s", "play_end")
+
+    def __init__(self, target_s: float, lead_in_s: float = 0.0):
+        self.target_s = target_s
+        self.lead_in_s = lead_in_s
+        self.play_end: Optional[float] = None  # when the device finishes what it has been sent
+
+    def buffered_s(self, now: float) -> float:
+        """Audio queued on the device; negative once it has run dry."""
+        return self.lead_in_s if self.play_end is None else self.play_end - now
+
+    def wait_s(self, now: float) -> float:
+        """How long to hold the next message so the device keeps target_s queued; the first is never held."""
+        return 0.0 if self.play_end is None else max(0.0, self.play_end - now - self.target_s)
+
+    def sent(self, now: float, nbytes: int) -> None:
+        # A device that ran dry starts again when the next message arrives
+        start = now + self.lead_in_s if self.play_end is None else max(now, self.play_end)
+        self.play_end = start + nbytes / PLAYBACK_BYTES_PER_SECOND
@@ -0,0 +1,261 @@
+"""
+Predictive prefetch of likely follow-up replies.
+Toy conversations follow patterns (greeting -> "tell me a story" -> "another
+one"). After each reply the Prefetcher looks up which requests most often
+followed this one in the `messages` table, generates replies to the top
+PREFETCH_TOP_K of them in the background and keeps their audio in memory.
+When the next transcript matches a cached request, the pipeline stops after
+STT, records the cached reply in the chat history and conversation memory as
+if the agent had given it, and the server plays the cached audio right
+away. Replies are cached
+for the device whose conversation predicted them and played at most once,
+so "another one" gets a new story each time.
+
+Speculative generations are capped per hour (PREFETCH_BUDGET_PER_HOUR) and
+only run when the pipeline scheduler has a free slot; the cache is capped
+by size (PREFETCH_CACHE_MB) and age (PREFETCH_TTL_S). Hit rate and budget
+use are exported as metrics and served at /debug/prefetch (to local clients).
+"""
+import asyncio
+import collections
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from server import metrics
+
+logger = logging.getLogger(__name__)
+
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "false").lower() in ("1", "true", "yes")
+PREFETCH_TOP_K = int(os.getenv("PREFETCH_TOP_K", "2"))
+# A follow-up must have been seen this many times before it is worth generating speculatively
+PREFETCH_MIN_COUNT = int(os.getenv("PREFETCH_MIN_COUNT", "2"))
+PREFETCH_BUDGET_PER_HOUR = int(os.getenv("PREFETCH_BUDGET_PER_HOUR", "60"))
+PREFETCH_CACHE_MB = float(os.getenv("PREFETCH_CACHE_MB", "32"))
+PREFETCH_TTL_S = float(os.getenv("PREFETCH_TTL_S", "3600"))
+PREFETCH_REFRESH_S = float(os.getenv("PREFETCH_REFRESH_S", "300"))
+PREFETCH_HISTORY = int(os.getenv("PREFETCH_HISTORY", "5000"))
+
+PCM_BYTES_PER_SECOND = 16000 * 2  # ESP32 playback format
+
+# Environment variable of the pipeline subprocess: the device's cached replies, {key: text} as JSON
+PREFETCH_REPLIES_ENV = "PREFETCH_REPLIES"
+
+_NON_WORD = re.compile(r"[^\w\s]+")
+_SPACES = re.compile(r"\s+")
+
+
+def utterance_key(text: str) -> str:
+    """Normalizes a transcript so that trivially different phrasings of a request match."""
+    return _SPACES.sub(" ", _NON_WORD.sub(" ", text.lower().replace("ё", "е"))).strip()
+
+
+class TransitionModel:
+    """Counts which request followed which within a conversation."""
+
+    def __init__(self):
+        self.counts: Dict[str, collections.Counter] = collections.defaultdict(collections.Counter)
+        self.texts: Dict[str, str] = {}  # key -> latest transcript with that key
+
+    @classmethod
+    def from_turns(cls, turns: List[Tuple[int, str]]) -> "TransitionModel":
+        """Builds the model from (conversation_id, user message) rows in conversation order."""
+        model = cls()
+        previous_conversation, previous_key = None, None
+        for conversation_id, text in turns:
+            key = utterance_key(text)
+            if not key:
+                continue
+            model.texts[key] = text
+            if conversation_id == previous_conversation and previous_key:
+                model.counts[previous_key][key] += 1
+            previous_conversation, previous_key = conversation_id, key
+        return model
+
+    def likely_next(self, key: str, k: int = PREFETCH_TOP_K, min_count: int = PREFETCH_MIN_COUNT) -> List[Tuple[str, str, int]]:
+        """Up to k (key, transcript, count) follow-ups of key, most frequent first."""
+        return [(next_key, self.texts[next_key], count)
+                for next_key, count in self.counts.get(key, collections.Counter()).most_common(k)
+                if count >= min_count]
+
+
+def load_transition_model(limit: int = PREFETCH_HISTORY) -> TransitionModel:
+    """Reads recent user turns from the chat database; an absent database gives an empty model."""
+    from database.sql_utils import get_db_path, get_recent_user_turns
+    db_path = get_db_path()
+    if not os.path.exists(db_path):
+        return TransitionModel()
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        return TransitionModel.from_turns(get_recent_user_turns(conn.cursor(), limit))
+    except sqlite3.Error as e:
+        logger.warning("PREFETCH> Cannot read chat history: %s", e)
+        return TransitionModel()
+    finally:
+        conn.close()
+
+
+def replies_env(entries: Dict[str, "CachedReply"]) -> str:
+    """PREFETCH_REPLIES for a pipeline subprocess."""
+    return json.dumps({key: entry.text for key, entry in entries.items()})
+
+
+def replies_from_env() -> Dict[str, str]:
+    """The cached replies the server passed in PREFETCH_REPLIES, by key."""
+    try:
+        replies = json.loads(os.getenv(PREFETCH_REPLIES_ENV) or "{}")
+    except ValueError:
+        return {}
+    return replies if isinstance(replies, dict) else {}
+
+
+class CachedReply:
+    __slots__ = ("scope", "key", "text", "audio", "created", "hits")
+
+    def __init__(self, scope: str, key: str, text: str, audio: bytes):
+        self.scope = scope  # device the reply was predicted for
+        self.key = key
+        self.text = text
+        self.audio = audio
+        self.created = time.monotonic()
+        self.hits = 0
+
+
+class Prefetcher:
+    """
+    Caches replies to predicted follow-ups. generate(transcript) returns
+    (reply text, ESP32 PCM) or None and is only called while can_run() is true.
+    """
+
+    def __init__(self, generate: Callable[[str], Awaitable[Optional[Tuple[str, bytes]]]],
+                 can_run: Callable[[], bool] = lambda: True, top_k: int = PREFETCH_TOP_K,
+                 budget_per_hour: int = PREFETCH_BUDGET_PER_HOUR, cache_bytes: int = int(PREFETCH_CACHE_MB * 1024 * 1024),
+                 ttl_s: float = PREFETCH_TTL_S):
+        self.generate = generate
+        self.can_run = can_run
+        self.top_k = top_k
+        self.budget_per_hour = budget_per_hour
+        self.cache_bytes = cache_bytes
+        self.ttl_s = ttl_s
+        self.model = TransitionModel()
+        self._model_loaded = float("-inf")
+        # (device, key) -> reply, least recently stored first
+        self._cache: "collections.OrderedDict[Tuple[str, str], CachedReply]" = collections.OrderedDict()
+        self._cached_bytes = 0
+        self._generations: Deque[float] = collections.deque()
+        self._in_flight: set = set()
+        self._tasks: set = set()
+        self.stats = collections.Counter()
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        for slot in [slot for slot, entry in self._cache.items() if now - entry.created > self.ttl_s]:
+            self._evict(slot)
+
+    def _evict(self, slot: Tuple[str, str]) -> None:
+        entry = self._cache.pop(slot)
+        self._cached_bytes -= len(entry.audio)
+        if not entry.hits:
+            self.stats["wasted"] += 1
+        metrics.PREFETCH_CACHE_BYTES.set(self._cached_bytes)
+
+    def snapshot(self, scope: str) -> Dict[str, CachedReply]:
+        """The replies cached for a device, by key; pass them to the pipeline with replies_env()."""
+        self._expire()
+        return {key: entry for (entry_scope, key), entry in self._cache.items() if entry_scope == scope}
+
+    def record_turn(self, hit: Optional[CachedReply]) -> None:
+        """Counts a real turn as served from the cache (hit is the entry used) or not.
+        A reply is played once: the entry used is dropped, so asking again gets a new one."""
+        self.stats["hits" if hit else "misses"] += 1
+        metrics.PREFETCH_LOOKUPS.inc(result="hit" if hit else "miss")
+        if hit:
+            hit.hits += 1
+            slot = (hit.scope, hit.key)
+            if self._cache.get(slot) is hit:
+                self._evict(slot)
+
+    def after_reply(self, key: str, scope: str) -> None:
+        """Starts prefetching, for the device, the likely follow-ups of the request just answered."""
+        if not key:
+            return
+        task = asyncio.create_task(self._prefetch_after(key, scope))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _budget_left(self) -> bool:
+        now = time.monotonic()
+        while self._generations and now - self._generations[0] > 3600:
+            self._generations.popleft()
+        return len(self._generations) < self.budget_per_hour
+
+    async def _prefetch_after(self, key: str, scope: str) -> None:
+        if time.monotonic() - self._model_loaded > PREFETCH_REFRESH_S:
+            self._model_loaded = time.monotonic()
+            self.model = await asyncio.get_running_loop().run_in_executor(None, load_transition_model)
+        self._expire()
+        for next_key, transcript, count in self.model.likely_next(key, self.top_k):
+            slot = (scope, next_key)
+            if slot in self._cache or slot in self._in_flight:
+                continue
+            if not self._budget_left():
+                self.stats["budget_skipped"] += 1
+                metrics.PREFETCH_SKIPPED.inc(reason="budget")
+                logger.info("PREFETCH> Hourly budget of %d generations used up.", self.budget_per_hour)
+                return
+            if not self.can_run():
+                self.stats["busy_skipped"] += 1
+                metrics.PREFETCH_SKIPPED.inc(reason="busy")
+                return
+            self._generations.append(time.monotonic())
+            self._in_flight.add(slot)
+            try:
+                logger.info("PREFETCH> Generating reply to likely follow-up '%s' (seen %d times).", transcript[:60], count)
+                result = await self.generate(transcript)
+            except Exception as e:
+                logger.warning("PREFETCH> Generation failed for '%s': %s", transcript[:60], e)
+                result = None
+            finally:
+                self._in_flight.discard(slot)
+            metrics.PREFETCH_GENERATED.inc(result="ok" if result else "failed")
+            if result:
+                self._store(CachedReply(scope, next_key, *result))
+
+    def _store(self, entry: CachedReply) -> None:
+        if len(entry.audio) > self.cache_bytes:
+            return
+        slot = (entry.scope, entry.key)
+        if slot in self._cache:
+            self._evict(slot)
+        while self._cache and self._cached_bytes + len(entry.audio) > self.cache_bytes:
+            self._evict(next(iter(self._cache)))  # oldest first
+        self._cache[slot] = entry
+        self._cached_bytes += len(entry.audio)
+        self.stats["generated"] += 1
+        metrics.PREFETCH_CACHE_BYTES.set(self._cached_bytes)
+
+    def cancel(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+
+    def report(self) -> dict:
+        """Hit rate, budget use and cache contents."""
+        lookups = self.stats["hits"] + self.stats["misses"]
+        self._expire()
+        self._budget_left()  # drops generations older than an hour
+        return {
+            "enabled": PREFETCH_ENABLED,
+            "hit_rate": round(self.stats["hits"] / lookups, 3) if lookups else None,
+            "stats": dict(self.stats),
+            "budget": {"per_hour": self.budget_per_hour, "used_last_hour": len(self._generations)},
+            "cache": {
+                "bytes": self._cached_bytes,
+                "max_bytes": self.cache_bytes,
+                "entries": [{"key": e.key, "reply": e.text[:80], "audio_s": round(len(e.audio) / PCM_BYTES_PER_SECOND, 2),
+                             "hits": e.hits} for e in self._cache.values()],
+            },
+        }
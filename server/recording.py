@@ -0,0 +1,73 @@
+"""
+Per-connection buffer for microphone audio streamed by a device.
+Frames are copied into a preallocated bytearray through a memoryview, and
+the WAV file the pipeline reads is written once when the recording stops,
+instead of a wave.writeframesraw() call (and header rewrite) per frame.
+"""
+import os
+import wave
+
+RECORDING_RATE = 16000  # ESP32 microphone format: 16 kHz, 16-bit mono
+RECORDING_WIDTH = 2
+RECORDING_BYTES_PER_SECOND = RECORDING_RATE * RECORDING_WIDTH
+# Initial capacity of a connection's buffer; it doubles as needed up to RECORDING_MAX_S
+RECORDING_BUFFER_S = float(os.getenv("RECORDING_BUFFER_S", "10"))
+RECORDING_MAX_S = float(os.getenv("RECORDING_MAX_S", "120"))
+
+
+class RecordingBuffer:
+    """Microphone PCM of the current recording; reused for every recording on a connection."""
+    __slots__ = ("_buffer", "_view", "_length", "_max_bytes", "overflowed")
+
+    def __init__(self, initial_s: float = RECORDING_BUFFER_S, max_s: float = RECORDING_MAX_S):
+        self._max_bytes = int(max_s * RECORDING_BYTES_PER_SECOND)
+        self._buffer = bytearray(min(int(initial_s * RECORDING_BYTES_PER_SECOND), self._max_bytes))
+        self._view = memoryview(self._buffer)
+        self._length = 0
+        self.overflowed = False
+
+    def __len__(self) -> int:
+        return self._length
+
+    @property
+    def samples(self) -> int:
+        return self._length // RECORDING_WIDTH
+
+    @property
+    def seconds(self) -> float:
+        return self._length / RECORDING_BYTES_PER_SECOND
+
+    def clear(self) -> None:
+        self._length = 0
+        self.overflowed = False
+
+    def append(self, frame: bytes) -> bool:
+        """Copies a frame in; returns False (and drops it) once the recording is RECORDING_MAX_S long."""
+        end = self._length + len(frame)
+        if end > len(self._buffer):
+            if end > self._max_bytes:
+                self.overflowed = True
+                return False
+            self._grow(end)
+        self._view[self._length:end] = frame
+        self._length = end
+        return True
+
+    def _grow(self, needed: int) -> None:
+        capacity = min(self._max_bytes, max(needed, 2 * len(self._buffer)))
+        self._view.release()
+        self._buffer.extend(bytes(capacity - len(self._buffer)))
+        self._view = memoryview(self._buffer)
+
+    def pcm(self) -> memoryview:
+        """The recorded PCM; only valid until the next clear() or append()."""
+        return self._view[:self._length]
+
+    def write_wav(self, path: str) -> None:
+        """Writes the recording as a 16 kHz, 16-bit mono WAV file with a single header write."""
+        with wave.open(path, 'wb') as wf:
+            wf.setnchannels(1)
+            wf.setsampwidth(RECORDING_WIDTH)
+            wf.setframerate(RECORDING_RATE)
+            wf.setnframes(self.samples)  # the header is final up front, so closing does not rewrite it
+            wf.writeframesraw(self._view[:self.samples * RECORDING_WIDTH])
@@ -0,0 +1,124 @@
+"""
+Admission control for pipeline subprocesses.
+At most PIPELINE_MAX_CONCURRENT pipelines run at once; later turns wait in
+a queue of at most PIPELINE_MAX_QUEUE. Each toy has at most one turn in
+flight: a newer turn from the same device cancels the older one. When a
+slot frees up, the shortest utterance goes first, aged by how long each turn
+has waited so long ones are not starved.
+"""
+import asyncio
+import contextlib
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from server import metrics
+
+logger = logging.getLogger(__name__)
+
+PIPELINE_MAX_CONCURRENT = int(os.getenv("PIPELINE_MAX_CONCURRENT", str(os.cpu_count() or 2)))
+PIPELINE_MAX_QUEUE = int(os.getenv("PIPELINE_MAX_QUEUE", "32"))
+# Seconds of utterance one second of waiting is worth when picking the next turn
+PIPELINE_AGING = float(os.getenv("PIPELINE_AGING", "1.0"))
+PIPELINE_WAIT_CUE_S = float(os.getenv("PIPELINE_WAIT_CUE_S", "2.0"))
+
+
+class SchedulerFull(Exception):
+    """Raised when the pipeline queue is full and a turn is not admitted."""
+
+
+class _Ticket:
+    __slots__ = ("device", "audio_s", "enqueued", "admitted", "granted", "task")
+
+    def __init__(self, device: str, audio_s: float):
+        self.device = device
+        self.audio_s = audio_s
+        self.enqueued = time.monotonic()
+        self.admitted = False
+        self.granted = asyncio.get_running_loop().create_future()
+        self.task = asyncio.current_task()
+
+
+class PipelineScheduler:
+    """Grants pipeline slots to device turns; use `async with scheduler.slot(...)`."""
+
+    def __init__(self, max_concurrent: int = PIPELINE_MAX_CONCURRENT, max_queue: int = PIPELINE_MAX_QUEUE,
+                 aging: float = PIPELINE_AGING):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max_queue
+        self.aging = aging
+        self._running = 0
+        self._waiting: List[_Ticket] = []
+        self._by_device: Dict[str, _Ticket] = {}
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiting)
+
+    def _priority(self, ticket: _Ticket, now: float) -> float:
+        return ticket.audio_s - self.aging * (now - ticket.enqueued)
+
+    def queue_position(self, device: str) -> Optional[int]:
+        """1-based place of device's turn in the order slots would be granted now; None if it is not waiting."""
+        ticket = self._by_device.get(device)
+        if ticket is None or ticket not in self._waiting:
+            return None
+        now = time.monotonic()
+        return 1 + sum(1 for other in self._waiting if self._priority(other, now) < self._priority(ticket, now))
+
+    def _dispatch(self) -> None:
+        now = time.monotonic()
+        while self._running < self.max_concurrent and self._waiting:
+            ticket = min(self._waiting, key=lambda t: self._priority(t, now))
+            self._waiting.remove(ticket)
+            if ticket.granted.done():
+                continue
+            ticket.admitted = True
+            self._running += 1
+            ticket.granted.set_result(None)
+        metrics.PIPELINE_QUEUE_DEPTH.set(len(self._waiting))
+
+    @contextlib.asynccontextmanager
+    async def slot(self, device: str, audio_s: float, on_long_wait: Optional[Callable[[], Awaitable]] = None,
+                   long_wait_s: Optional[float] = PIPELINE_WAIT_CUE_S):
+        """Waits for a pipeline slot for device; yields the seconds spent queued. long_wait_s=None never cues."""
+        previous = self._by_device.get(device)
+        if previous and previous.task is not asyncio.current_task() and not previous.task.done():
+            logger.info("SCHED> Newer turn from %s supersedes its in-flight turn.", device)
+            metrics.PIPELINE_SUPERSEDED.inc()
+            previous.task.cancel()
+        if len(self._waiting) >= self.max_queue:
+            metrics.PIPELINE_REJECTED.inc()
+            raise SchedulerFull(f"{len(self._waiting)} turns already queued")
+
+        ticket = _Ticket(device, audio_s)
+        self._by_device[device] = ticket
+        try:
+            self._waiting.append(ticket)
+            self._dispatch()
+            if not ticket.admitted:
+                logger.info("SCHED> Queued (%d running, %d waiting).", self._running, len(self._waiting))
+                try:
+                    await asyncio.wait_for(asyncio.shield(ticket.granted), long_wait_s)
+                except asyncio.TimeoutError:
+                    if on_long_wait:
+                        await on_long_wait()
+                    await ticket.granted
+            wait_s = time.monotonic() - ticket.enqueued
+            metrics.PIPELINE_QUEUE_WAIT.observe(wait_s)
+            yield wait_s
+        finally:
+            if ticket in self._waiting:
+                self._waiting.remove(ticket)
+            if not ticket.granted.done():
+                ticket.granted.cancel()
+            if ticket.admitted:
+                self._running -= 1
+            if self._by_device.get(device) is ticket:
+                del self._by_device[device]
+            self._dispatch()
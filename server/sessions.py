@@ -0,0 +1,116 @@
+"""
+Registry of connected devices.
+A Session is created once per WebSocket connection and carries everything
+the server keeps about it: identity from the URL, the in-flight pipeline
+task, playback bookkeeping and traffic counters. Lookups by connection,
+session id or device id are dict hits, so per-message code only touches
+attributes of an object it already holds.
+"""
+import datetime
+import time
+from typing import Dict, Iterator, Optional
+from urllib.parse import parse_qs, urlparse
+
+from server.playback import NetworkEstimate
+
+# LangGraph memory thread of devices that do not send ?device_id= (the single-toy setup)
+DEFAULT_THREAD_ID = "main_thread"
+DEFAULT_CODEC = "pcm16"
+
+
+class Session:
+    """One device connection."""
+    __slots__ = ("websocket", "session_id", "device_id", "persona", "firmware", "codec", "thread_id",
+                 "file_prefix", "connected_at", "recording", "pipeline_task", "tts_task", "audio_until",
+                 "turn_started", "last_response_s", "network", "rtt_probe", "cue_task",
+                 "turns", "frames_in", "bytes_in", "bytes_out", "last_active")
+
+    def __init__(self, websocket, path: str = None):
+        host, port = websocket.remote_address[:2]
+        self.websocket = websocket
+        self.session_id = f"{host}:{port}"
+        # Firmware may identify the toy with ?device_id=..., its persona with ?persona=...,
+        # and itself with ?firmware=... and ?codec=...; otherwise each connection is its own
+        # device with the default persona
+        query = parse_qs(urlparse(path or "").query)
+        device_id = query.get("device_id", [None])[0]
+        self.device_id = device_id or self.session_id
+        self.persona = query.get("persona", [None])[0]
+        self.firmware = query.get("firmware", [None])[0]
+        self.codec = query.get("codec", [DEFAULT_CODEC])[0]
+        # Conversation memory follows the toy across reconnects when it says who it is
+        self.thread_id = f"device:{device_id}" if device_id else DEFAULT_THREAD_ID
+        self.connected_at = time.time()
+        safe_id = self.session_id.replace(":", "_").replace(".", "_")
+        self.file_prefix = f"esp32_{safe_id}_{datetime.datetime.now():%Y%m%d_%H%M%S}"
+        self.recording = False
+        self.pipeline_task = None
+        self.tts_task = None
+        self.audio_until = 0.0  # monotonic time at which the cues already sent finish playing
+        self.cue_task = None  # cue still being sent; reply audio waits for it
+        self.turn_started = None  # monotonic time the current turn's recording stopped
+        self.last_response_s = None  # stop of recording -> first reply audio, last turn
+        self.network = NetworkEstimate()  # RTT and jitter, for pacing replies
+        self.rtt_probe = None
+        self.turns = 0
+        self.frames_in = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.last_active = time.monotonic()
+
+    def next_recording_name(self) -> str:
+        """WAV file name for the next utterance; numbered, so two in the same second do not collide."""
+        self.turns += 1
+        return f"{self.file_prefix}_{self.turns:04d}.wav"
+
+    @property
+    def busy(self) -> bool:
+        return self.pipeline_task is not None and not self.pipeline_task.done()
+
+    @property
+    def speaking(self) -> bool:
+        return self.tts_task is not None and not self.tts_task.done()
+
+    @property
+    def state(self) -> str:
+        """idle, recording, processing (queued or in the pipeline) or speaking (reply being synthesized and sent)."""
+        if self.recording:
+            return "recording"
+        if self.speaking:
+            return "speaking"
+        return "processing" if self.busy else "idle"
+
+
+class SessionRegistry:
+    """Connected sessions, indexed by connection, session id and device id."""
+
+    def __init__(self):
+        self._by_websocket: Dict[object, Session] = {}
+        self._by_id: Dict[str, Session] = {}
+        self._by_device: Dict[str, Session] = {}
+
+    def add(self, session: Session) -> None:
+        self._by_websocket[session.websocket] = session
+        self._by_id[session.session_id] = session
+        self._by_device[session.device_id] = session  # the newest connection of a device wins
+
+    def remove(self, session: Session) -> None:
+        self._by_websocket.pop(session.websocket, None)
+        self._by_id.pop(session.session_id, None)
+        if self._by_device.get(session.device_id) is session:
+            del self._by_device[session.device_id]
+
+    def for_websocket(self, websocket) -> Optional[Session]:
+        return self._by_websocket.get(websocket)
+
+    def get(self, session_id: str) -> Optional[Session]:
+        return self._by_id.get(session_id)
+
+    def for_device(self, device_id: str) -> Optional[Session]:
+        return self._by_device.get(device_id)
+
+    def __iter__(self) -> Iterator[Session]:
+        return iter(list(self._by_id.values()))
+
+    def __len__(self) -> int:
+        return len(self._by_id)
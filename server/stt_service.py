@@ -0,0 +1,203 @@
+"""
+STT stage of a server worker. The pipelines a worker starts send it the
+path of their recording instead of calling the STT provider themselves:
+
+    POST /stt  {"path": "<audio file>"}  ->  {"text": "<transcript>"}
+
+(STT_SERVICE_URL in the pipeline's environment, see
+utils.transcribe_audio()). Requests that arrive within STT_BATCH_WAIT_MS
+of the first one, up to STT_BATCH_MAX, form a batch. The offline model
+(STT_PROVIDER=local) decodes a batch in one call; remote providers get its
+requests concurrently over the worker's warm connection pool, not a new
+client and TLS handshake per pipeline.
+
+The stage runs when STT_BATCH_ENABLED is set, and always for the offline
+model, which is loaded once per worker. Only loopback clients are served:
+the server reads the file the request names.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, List, Optional
+
+from server import metrics
+from server.http_server import add_route
+
+logger = logging.getLogger(__name__)
+
+STT_BATCH_ENABLED = os.getenv("STT_BATCH_ENABLED", "false").lower() in ("1", "true", "yes")
+STT_BATCH_MAX = int(os.getenv("STT_BATCH_MAX", "8"))
+STT_BATCH_WAIT_MS = float(os.getenv("STT_BATCH_WAIT_MS", "5"))
+
+STT_SERVICE_PATH = "/stt"
+# Set for the pipelines a worker starts; utils.transcribe_audio() posts there
+STT_SERVICE_URL_ENV = "STT_SERVICE_URL"
+_LOOPBACK = ("127.0.0.1", "::1", "::ffff:127.0.0.1")
+
+
+def local_stt_configured() -> bool:
+    """Whether STT_PROVIDER or STT_PROVIDERS selects the local model."""
+    specs = [os.getenv("STT_PROVIDER", "")] + os.getenv("STT_PROVIDERS", "").split(",")
+    return any(spec.strip().lower().split(":", 1)[0] == "local" for spec in specs)
+
+
+def _only_local() -> bool:
+    providers = [p.strip() for p in os.getenv("STT_PROVIDERS", "").split(",") if p.strip()]
+    specs = providers if len(providers) > 1 else [os.getenv("STT_PROVIDER", "deepinfra")]
+    return all(spec.lower().split(":", 1)[0] == "local" for spec in specs)
+
+
+def _audio_seconds(paths: List[str]) -> float:
+    total = 0.0
+    for path in paths:
+        try:
+            with wave.open(path, 'rb') as wf:
+                total += wf.getnframes() / wf.getframerate()
+        except (OSError, wave.Error, EOFError, ZeroDivisionError):
+            pass
+    return total
+
+
+class MicroBatcher:
+    """
+    Collects items submitted within max_wait_s of the first, up to
+    max_batch, and hands each group to run_batch, a coroutine function
+    returning one result (or exception) per item. Batches run concurrently.
+    """
+
+    def __init__(self, run_batch: Callable[[list], Awaitable[list]], max_batch: int = STT_BATCH_MAX,
+                 max_wait_s: float = STT_BATCH_WAIT_MS / 1000):
+        self.run_batch = run_batch
+        self.max_batch = max(1, max_batch)
+        self.max_wait_s = max_wait_s
+        self._pending = []  # (item, future, submitted at)
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._running = set()
+
+    async def submit(self, item):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((item, future, time.monotonic()))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait_s, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch: list) -> None:
+        started = time.monotonic()
+        metrics.STT_BATCH_SIZE.observe(len(batch))
+        for _, _, submitted in batch:
+            metrics.STT_BATCH_WAIT.observe(started - submitted)
+        try:
+            results = await self.run_batch([item for item, _, _ in batch])
+        except Exception as e:
+            results = [e] * len(batch)
+        metrics.STT_BATCH_SECONDS.observe(time.monotonic() - started)
+        for (_, future, _), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def cancel(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        for task in list(self._running):
+            task.cancel()
+
+
+class SttStage:
+    """Batched transcription for the pipelines of this worker."""
+
+    def __init__(self, max_batch: int = STT_BATCH_MAX, max_wait_s: float = STT_BATCH_WAIT_MS / 1000):
+        # Imported here: utils.utils pulls in the provider SDKs, and faster-whisper takes a while to import
+        from utils.utils import transcribe_audio
+        self._transcribe_audio = transcribe_audio
+        self.local = None
+        if local_stt_configured():
+            from utils.local_stt import get_local_transcriber
+            self.local = get_local_transcriber()  # starts loading now; also used by routed calls in this process
+        self._pool = None if _only_local() else ThreadPoolExecutor(max(1, max_batch), thread_name_prefix="stt")
+        self.batcher = MicroBatcher(self._run_batch, max_batch, max_wait_s)
+        self.url: Optional[str] = None  # set once the metrics server is listening
+
+    def pipeline_env(self) -> dict:
+        """Environment that points a pipeline at this stage."""
+        return {STT_SERVICE_URL_ENV: self.url} if self.url else {}
+
+    async def transcribe(self, path: str) -> Optional[str]:
+        return await self.batcher.submit(path)
+
+    async def _run_batch(self, paths: List[str]) -> list:
+        loop = asyncio.get_running_loop()
+        audio_s = await loop.run_in_executor(None, _audio_seconds, paths)
+        if self._pool is None:
+            # One decoder call for the whole batch
+            futures = [asyncio.wrap_future(f) for f in self.local.submit_many(paths)]
+        else:
+            futures = [loop.run_in_executor(self._pool, self._transcribe_audio, path) for path in paths]
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        metrics.STT_AUDIO_SECONDS.inc(audio_s)
+        for path, result in zip(paths, results):
+            if isinstance(result, BaseException):
+                logger.error("STT of %s failed: %s", path, result)
+                metrics.STT_UTTERANCES.inc(result="error")
+            else:
+                metrics.STT_UTTERANCES.inc(result="ok" if result else "empty")
+        return [result if isinstance(result, BaseException) else result or None for result in results]
+
+    def close(self) -> None:
+        self.batcher.cancel()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+        if self.local is not None:
+            self.local.close()
+
+
+def service_url(port: int) -> str:
+    """STT_SERVICE_URL of a worker whose metrics server listens on port."""
+    return f"http://127.0.0.1:{port}{STT_SERVICE_PATH}"
+
+
+def install() -> Optional[SttStage]:
+    """Creates the STT stage and registers /stt, if batching or the local model is configured."""
+    if not (STT_BATCH_ENABLED or local_stt_configured()):
+        return None
+    # This process is the stage; its own transcribe_audio() calls go to the providers
+    os.environ.pop(STT_SERVICE_URL_ENV, None)
+    try:
+        stage = SttStage()
+    except RuntimeError as e:
+        logger.error("STT stage unavailable: %s", e)
+        return None
+
+    async def transcribe(request):
+        if request.peer not in _LOOPBACK:
+            return 403, {"error": "the STT stage is only served to local clients"}
+        try:
+            path = json.loads(request.body)["path"]
+        except (ValueError, KeyError, TypeError):
+            return 400, {"error": 'expected {"path": "<audio file>"}'}
+        return 200, {"text": await stage.transcribe(path)}
+
+    add_route("POST", STT_SERVICE_PATH, transcribe)
+    logger.info("STT stage: batches of up to %d within %.0f ms%s.", stage.batcher.max_batch,
+                stage.batcher.max_wait_s * 1000, " (local model)" if stage.local else "")
+    return stage
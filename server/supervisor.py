@@ -0,0 +1,323 @@
+"""
+Multi-process mode for the WebSocket server.
+The supervisor starts SERVER_WORKERS copies of server/main.py. Each worker
+binds the same port with SO_REUSEPORT, so the kernel spreads devices across
+processes (and cores). With SERVER_AFFINITY=ip a classic BPF program picks
+the listening socket from the device's IPv4 address, so a toy that
+reconnects usually lands on the same worker. This is best-effort: the
+program returns a position in the kernel's reuseport group, not a worker
+id, and the group changes when a worker restarts (the last socket moves
+into the freed slot) and holds both generations during a reload. Nothing
+depends on it; conversation memory is in the shared database. SIGHUP starts a fresh set of workers and then drains
+the old ones; /metrics on the supervisor sums every worker's metrics, and
+/admin/sessions on the supervisor asks every worker and merges the answers.
+"""
+import asyncio
+import ctypes
+import json
+import os
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import time
+from typing import List, Optional, Tuple
+
+from server import metrics
+from server.admin import SESSION_PATH
+from server.http_server import add_route, local_only, start_http_server
+
+WORKER_ID_ENV = "SERVER_WORKER_ID"
+# Pipe the worker writes its metrics port to, once it has bound one (port 0: any free port)
+WORKER_PORT_FD_ENV = "SERVER_WORKER_PORT_FD"
+WORKER_READY_TIMEOUT_S = 30.0
+WORKER_RESTART_DELAY_S = 1.0
+
+# Linux socket option numbers (not exported by the socket module)
+SO_ATTACH_REUSEPORT_CBPF = 51
+# Classic BPF opcodes
+BPF_LD_W_ABS = 0x20   # BPF_LD | BPF_W | BPF_ABS
+BPF_ALU_MOD_K = 0x94  # BPF_ALU | BPF_MOD | BPF_K
+BPF_RET_A = 0x16      # BPF_RET | BPF_A
+SKF_NET_OFF = -0x100000
+
+
+class _SockFprog(ctypes.Structure):
+    _fields_ = [("len", ctypes.c_ushort), ("filter", ctypes.c_void_p)]
+
+
+def _attach_ip_affinity(sock: socket.socket, workers: int) -> None:
+    """Selects the reuseport socket by IPv4 source address modulo workers.
+    The result indexes the reuseport group as it is now, so the mapping to
+    workers shifts when sockets join or leave (restarts, reloads)."""
+    program = [
+        (BPF_LD_W_ABS, 0, 0, (SKF_NET_OFF + 12) & 0xFFFFFFFF),  # A = ip->saddr
+        (BPF_ALU_MOD_K, 0, 0, workers),                         # A %= workers
+        (BPF_RET_A, 0, 0, 0),                                   # socket index
+    ]
+    code = b"".join(struct.pack("HBBI", *instruction) for instruction in program)
+    buffer = ctypes.create_string_buffer(code)
+    fprog = _SockFprog(len(program), ctypes.addressof(buffer))
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_REUSEPORT_CBPF, bytes(fprog))
+
+
+def reuseport_socket(host: str, port: int, affinity_workers: int = 0) -> socket.socket:
+    """Returns a listening socket that shares host:port with the other workers."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(socket.SOMAXCONN)
+    # Only after listen(): attaching earlier gives the socket a reuseport group of its own
+    if affinity_workers > 1:
+        try:
+            _attach_ip_affinity(sock, affinity_workers)
+        except OSError as e:
+            print(f"WARN> Device affinity unavailable, using kernel connection hashing: {e}")
+    sock.setblocking(False)
+    return sock
+
+
+def _read_port(fd: int) -> Optional[int]:
+    """Blocks until the worker reports its metrics port; None if it exits first."""
+    with os.fdopen(fd, 'rb') as pipe:
+        line = pipe.readline().strip()
+    return int(line) if line.isdigit() else None
+
+
+async def _worker_request(port: int, method: str, path: str, body: bytes = b"") -> Tuple[int, bytes]:
+    """Sends one request to a worker's metrics server; returns (status, body)."""
+    reader, writer = await asyncio.wait_for(asyncio.open_connection("127.0.0.1", port), 2.0)
+    try:
+        writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\n"
+                     f"Connection: close\r\n\r\n".encode('latin-1') + body)
+        await writer.drain()
+        response = await asyncio.wait_for(reader.read(), 5.0)
+    finally:
+        writer.close()
+    head, _, payload = response.partition(b"\r\n\r\n")
+    status_line = head.split(b"\r\n", 1)[0].split()
+    if len(status_line) < 2 or not status_line[1].isdigit():
+        raise ConnectionError(f"malformed response from port {port}")
+    return int(status_line[1]), payload
+
+
+async def _fetch_metrics(port: int) -> str:
+    status, body = await _worker_request(port, "GET", "/metrics")
+    if status != 200:
+        raise ConnectionError(f"HTTP {status}")
+    return body.decode('utf-8')
+
+
+class Worker:
+    __slots__ = ("worker_id", "metrics_port", "process", "retiring", "port_reported")
+
+    def __init__(self, worker_id: int, process: subprocess.Popen, port_reported: asyncio.Future):
+        self.worker_id = worker_id
+        self.metrics_port: Optional[int] = None  # known once the worker reports it
+        self.process = process
+        self.retiring = False
+        self.port_reported = port_reported
+        port_reported.add_done_callback(self._set_port)
+
+    def _set_port(self, future: asyncio.Future) -> None:
+        if not future.cancelled() and future.exception() is None:
+            self.metrics_port = future.result()
+
+
+class Supervisor:
+    """Runs, restarts, reloads and scrapes the server workers."""
+
+    def __init__(self, script_path: str, workers: int, metrics_host: str, metrics_port: int, drain_s: float):
+        self.script_path = script_path
+        self.workers = workers
+        self.metrics_host = metrics_host
+        self.metrics_port = metrics_port
+        self.drain_s = drain_s
+        self._workers: List[Worker] = []
+        self._stopping = False
+        self._reload_requested = False
+
+    def _spawn(self, worker_id: int) -> Worker:
+        # The worker binds its own metrics port and writes the number back, so no port is probed and reused
+        read_fd, write_fd = os.pipe()
+        env = {**os.environ, WORKER_ID_ENV: str(worker_id), WORKER_PORT_FD_ENV: str(write_fd)}
+        try:
+            # Own session: a Ctrl+C in the terminal reaches only the supervisor, which drains the workers
+            process = subprocess.Popen([sys.executable, self.script_path], env=env, start_new_session=True,
+                                       pass_fds=(write_fd,))
+        except OSError:
+            os.close(read_fd)
+            raise
+        finally:
+            os.close(write_fd)
+        print(f"SUPERVISOR> Started worker {worker_id} (PID: {process.pid})")
+        port_reported = asyncio.get_running_loop().run_in_executor(None, _read_port, read_fd)
+        return Worker(worker_id, process, port_reported)
+
+    async def _wait_ready(self, worker: Worker) -> bool:
+        deadline = time.monotonic() + WORKER_READY_TIMEOUT_S
+        try:
+            port = await asyncio.wait_for(asyncio.shield(worker.port_reported), WORKER_READY_TIMEOUT_S)
+        except asyncio.TimeoutError:
+            return False
+        if port is None:
+            return False
+        while time.monotonic() < deadline and worker.process.poll() is None:
+            try:
+                await _fetch_metrics(worker.metrics_port)
+                return True
+            except (OSError, ConnectionError, asyncio.TimeoutError):
+                await asyncio.sleep(0.2)
+        return False
+
+    def _retire(self, worker: Worker) -> None:
+        worker.retiring = True
+        if worker.process.poll() is None:
+            print(f"SUPERVISOR> Draining worker {worker.worker_id} (PID: {worker.process.pid})")
+            worker.process.send_signal(signal.SIGTERM)
+
+    async def reload(self) -> None:
+        """Starts a new generation of workers, then drains the current one once the new one is ready."""
+        print("SUPERVISOR> Reloading workers...")
+        old = [w for w in self._workers if not w.retiring]
+        new = [self._spawn(worker_id) for worker_id in range(self.workers)]
+        self._workers.extend(new)
+        ready = await asyncio.gather(*(self._wait_ready(w) for w in new))
+        if not all(ready):
+            print("!!! SUPERVISOR> New workers failed to start; keeping the current ones.")
+            for worker in new:
+                self._retire(worker)
+            return
+        for worker in old:
+            self._retire(worker)
+
+    def _live_workers(self) -> List[Worker]:
+        return [w for w in self._workers if w.process.poll() is None and w.metrics_port]
+
+    async def render_metrics(self) -> str:
+        live = self._live_workers()
+        results = await asyncio.gather(*(_fetch_metrics(w.metrics_port) for w in live), return_exceptions=True)
+        scraped = [(w, r) for w, r in zip(live, results) if isinstance(r, str)]
+        return metrics.merge_expositions([r for _, r in scraped], [str(w.worker_id) for w, _ in scraped])
+
+    async def _metrics_route(self, request):
+        return 200, await self.render_metrics(), "text/plain; version=0.0.4; charset=utf-8"
+
+    async def _admin_sessions_route(self, request):
+        """Every worker's sessions, each tagged with its worker, and every worker's pipeline counts."""
+        live = self._live_workers()
+        results = await asyncio.gather(*(_worker_request(w.metrics_port, "GET", "/admin/sessions") for w in live),
+                                       return_exceptions=True)
+        sessions, workers = [], []
+        for worker, result in zip(live, results):
+            info = {"worker": worker.worker_id, "pid": worker.process.pid}
+            if isinstance(result, Exception) or result[0] != 200:
+                workers.append({**info, "error": str(result) if isinstance(result, Exception) else f"HTTP {result[0]}"})
+                continue
+            answer = json.loads(result[1])
+            sessions.extend({**session, **info} for session in answer["sessions"])
+            workers.append({**info, "pipelines": answer["pipelines"]})
+        return 200, {"sessions": sessions, "workers": workers}
+
+    async def _admin_session_route(self, request):
+        """Passes a request about one session to the workers; the worker that has it answers."""
+        live = self._live_workers()
+        results = await asyncio.gather(*(_worker_request(w.metrics_port, request.method, request.path, request.body)
+                                         for w in live), return_exceptions=True)
+        answered = False
+        for worker, result in zip(live, results):
+            if isinstance(result, Exception):
+                continue
+            answered = True
+            status, body = result
+            if status != 404:
+                answer = json.loads(body)
+                if isinstance(answer, dict):
+                    answer.update(worker=worker.worker_id, pid=worker.process.pid)
+                return status, answer
+        if not answered and live:
+            return 502, {"error": "no worker answered"}
+        return 404, {"error": "no such session"}
+
+    async def _reap(self) -> None:
+        for worker in list(self._workers):
+            return_code = worker.process.poll()
+            if return_code is None:
+                continue
+            self._workers.remove(worker)
+            if worker.retiring or self._stopping:
+                print(f"SUPERVISOR> Worker {worker.worker_id} (PID: {worker.process.pid}) exited.")
+                continue
+            print(f"!!! SUPERVISOR> Worker {worker.worker_id} (PID: {worker.process.pid}) died with code {return_code}; restarting.")
+            await asyncio.sleep(WORKER_RESTART_DELAY_S)
+            self._workers.append(self._spawn(worker.worker_id))
+
+    def _request_stop(self) -> None:
+        self._stopping = True
+
+    def _request_reload(self) -> None:
+        self._reload_requested = True
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, self._request_stop)
+        loop.add_signal_handler(signal.SIGHUP, self._request_reload)
+
+        add_route("GET", "/metrics", self._metrics_route)
+        add_route("GET", "/admin/sessions", local_only(self._admin_sessions_route, "admin API"))
+        for method, suffix in (("GET", ""), ("POST", "/cancel"), ("POST", "/disconnect")):
+            add_route(method, SESSION_PATH + suffix, local_only(self._admin_session_route, "admin API"))
+        try:
+            metrics_server = await start_http_server(self.metrics_host, self.metrics_port)
+            print(f"SUPERVISOR> Aggregated metrics at http://{self.metrics_host}:{self.metrics_port}/metrics")
+        except OSError as e:
+            print(f"!!! WARNING: Could not start metrics endpoint on port {self.metrics_port}: {e}")
+            metrics_server = None
+
+        self._workers = [self._spawn(worker_id) for worker_id in range(self.workers)]
+        print(f"SUPERVISOR> {self.workers} workers started (PID: {os.getpid()}). SIGHUP reloads, Ctrl+C stops.")
+        try:
+            while not self._stopping:
+                if self._reload_requested:
+                    self._reload_requested = False
+                    await self.reload()
+                await self._reap()
+                await asyncio.sleep(0.5)
+        finally:
+            print("SUPERVISOR> Stopping workers...")
+            for worker in self._workers:
+                self._retire(worker)
+            deadline = time.monotonic() + self.drain_s + 5
+            while any(w.process.poll() is None for w in self._workers) and time.monotonic() < deadline:
+                await asyncio.sleep(0.2)
+            for worker in self._workers:
+                if worker.process.poll() is None:
+                    worker.process.kill()
+            if metrics_server:
+                metrics_server.close()
+
+
+def run_supervisor(script_path: str, workers: int, metrics_host: str, metrics_port: int, drain_s: float) -> None:
+    asyncio.run(Supervisor(script_path, workers, metrics_host, metrics_port, drain_s).run())
+
+
+def worker_id() -> Optional[int]:
+    """Returns this process's worker id when started by the supervisor, else None."""
+    value = os.getenv(WORKER_ID_ENV)
+    return int(value) if value is not None else None
+
+
+def report_metrics_port(port: Optional[int]) -> None:
+    """Tells the supervisor which metrics port this worker bound (None: it has none)."""
+    value = os.environ.pop(WORKER_PORT_FD_ENV, None)
+    if value is None:
+        return
+    try:
+        with os.fdopen(int(value), 'wb') as pipe:
+            if port:
+                pipe.write(f"{port}\n".encode('ascii'))
+    except OSError as e:
+        print(f"WARN> Could not report the metrics port to the supervisor: {e}")
@@ -0,0 +1,203 @@
+"""
+Offline speech-to-text on the CPU with faster-whisper (CTranslate2, int8).
+
+Loading a model takes seconds, so a server worker loads it once, keeps it
+warm and transcribes for every pipeline it starts: the pipeline subprocess
+posts the WAV path to the worker's STT stage (server/stt_service.py). A
+process with no server to ask, such as a pipeline run by hand, loads its
+own copy.
+
+Utterances that arrive while the model is busy are decoded together: each
+is padded to Whisper's 30 s window and the batch goes through a single
+encoder/decoder call, which on a multi-core CPU costs far less than
+decoding them one after another. Longer utterances take the regular
+segment-by-segment transcribe().
+
+Needs `pip install faster-whisper`. Models are downloaded to the Hugging
+Face cache on first use; LOCAL_STT_MODEL may also be a model directory.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+import wave
+from concurrent.futures import Future
+from typing import List, Optional, Union
+
+import numpy as np
+
+try:
+    import ctranslate2
+    from faster_whisper import WhisperModel
+    from faster_whisper.audio import decode_audio
+    from faster_whisper.tokenizer import Tokenizer
+except ImportError:
+    WhisperModel = None
+
+logger = logging.getLogger(__name__)
+
+# Model size (tiny, base, small, medium, large-v3, ...) or a CTranslate2 model directory
+LOCAL_STT_MODEL = os.getenv("LOCAL_STT_MODEL", "small")
+LOCAL_STT_COMPUTE_TYPE = os.getenv("LOCAL_STT_COMPUTE_TYPE", "int8")
+LOCAL_STT_THREADS = int(os.getenv("LOCAL_STT_THREADS", "0"))  # 0: CTranslate2's default
+LOCAL_STT_LANGUAGE = os.getenv("LOCAL_STT_LANGUAGE", "ru")
+LOCAL_STT_BEAM_SIZE = int(os.getenv("LOCAL_STT_BEAM_SIZE", "1"))  # greedy decoding is the fastest on a CPU
+# Most queued utterances decoded in one call
+LOCAL_STT_BATCH_MAX = int(os.getenv("LOCAL_STT_BATCH_MAX", "8"))
+
+SAMPLE_RATE = 16000
+WINDOW_SAMPLES = 30 * SAMPLE_RATE  # Whisper's input window
+WINDOW_FRAMES = 3000  # log-mel frames in it
+MAX_LENGTH = 448  # decoder positions
+
+
+def load_wav(path: str) -> np.ndarray:
+    """Float32 16 kHz mono samples of an audio file."""
+    try:
+        with wave.open(path, 'rb') as wf:
+            if wf.getframerate() == SAMPLE_RATE and wf.getnchannels() == 1 and wf.getsampwidth() == 2:
+                return np.frombuffer(wf.readframes(wf.getnframes()), dtype="<i2").astype(np.float32) / 32768.0
+    except wave.Error:
+        pass  # not PCM WAV; PyAV decodes the rest
+    return decode_audio(path, sampling_rate=SAMPLE_RATE)
+
+
+class LocalTranscriber:
+    """A warm Whisper model and the thread that feeds it batches of queued utterances."""
+
+    def __init__(self, model: str = LOCAL_STT_MODEL, compute_type: str = LOCAL_STT_COMPUTE_TYPE,
+                 cpu_threads: int = LOCAL_STT_THREADS, language: str = LOCAL_STT_LANGUAGE,
+                 beam_size: int = LOCAL_STT_BEAM_SIZE, batch_max: int = LOCAL_STT_BATCH_MAX):
+        if WhisperModel is None:
+            raise RuntimeError("STT_PROVIDER=local needs faster-whisper: pip install faster-whisper")
+        self.model_name = model
+        self.compute_type = compute_type
+        self.cpu_threads = cpu_threads
+        self.language = language
+        self.beam_size = beam_size
+        self.batch_max = max(1, batch_max)
+        self._model = None
+        self._tokenizer = None
+        self._load_error: Optional[Exception] = None
+        self._queue: queue.Queue = queue.Queue()
+        # Loads the model right away, so the first turn does not wait for it
+        self._thread = threading.Thread(target=self._run, name="local-stt", daemon=True)
+        self._thread.start()
+
+    def submit(self, source: Union[str, np.ndarray]) -> Future:
+        """Queues an audio file path or 16 kHz float32 samples; the future resolves to the transcript."""
+        return self.submit_many([source])[0]
+
+    def submit_many(self, sources: List[Union[str, np.ndarray]]) -> List[Future]:
+        """Queues utterances to be decoded in the same batch (up to batch_max each)."""
+        items = [(source, Future()) for source in sources]
+        self._queue.put(items)
+        return [future for _, future in items]
+
+    def transcribe_file(self, path: str) -> Optional[str]:
+        return self.submit(path).result() or None
+
+    def close(self, timeout: float = 10.0) -> None:
+        """Finishes the queued utterances and stops the decoding thread."""
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _load(self) -> None:
+        started = time.perf_counter()
+        self._model = WhisperModel(self.model_name, device="cpu", compute_type=self.compute_type,
+                                   cpu_threads=self.cpu_threads)
+        self._tokenizer = Tokenizer(self._model.hf_tokenizer, self._model.model.is_multilingual,
+                                    task="transcribe", language=self.language)
+        self.transcribe_batch([np.zeros(SAMPLE_RATE, dtype=np.float32)])  # first call allocates its buffers
+        logger.info("Local STT model %s (%s) loaded in %.1fs.", self.model_name, self.compute_type,
+                    time.perf_counter() - started)
+
+    def _run(self) -> None:
+        try:
+            self._load()
+        except Exception as e:
+            logger.exception("Failed to load local STT model %s", self.model_name)
+            self._load_error = e
+        closing = False
+        while not closing:
+            items = self._queue.get()
+            if items is None:
+                break
+            # Whatever queued up while the last batch was decoding goes in this one
+            batch = list(items)
+            while len(batch) < self.batch_max:
+                try:
+                    items = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if items is None:
+                    closing = True
+                    break
+                batch.extend(items)
+            for start in range(0, len(batch), self.batch_max):
+                self._decode(batch[start:start + self.batch_max])
+
+    def _decode(self, batch: list) -> None:
+        audios, futures = [], []
+        for source, future in batch:
+            if not future.set_running_or_notify_cancel():
+                continue
+            if self._load_error is not None:
+                future.set_exception(RuntimeError(f"local STT model failed to load: {self._load_error}"))
+                continue
+            try:
+                audios.append(load_wav(source) if isinstance(source, str) else source)
+                futures.append(future)
+            except Exception as e:
+                future.set_exception(e)
+        if not audios:
+            return
+        try:
+            texts = self.transcribe_batch(audios)
+        except Exception as e:
+            logger.exception("Local STT batch of %d failed", len(audios))
+            for future in futures:
+                future.set_exception(e)
+            return
+        for future, text in zip(futures, texts):
+            future.set_result(text)
+
+    def _features(self, audio: np.ndarray) -> np.ndarray:
+        # Padding the audio (not the features) with silence, as Whisper was trained
+        padded = np.pad(audio, (0, WINDOW_SAMPLES - len(audio)))
+        return np.ascontiguousarray(self._model.feature_extractor(padded)[:, :WINDOW_FRAMES], dtype=np.float32)
+
+    def transcribe_batch(self, audios: List[np.ndarray]) -> List[str]:
+        """Transcripts of 16 kHz float32 utterances; those within the 30 s window are decoded as one batch.
+        Called from the decoding thread only."""
+        texts = [""] * len(audios)
+        short = []
+        for i, audio in enumerate(audios):
+            if len(audio) <= WINDOW_SAMPLES:
+                short.append(i)
+            else:
+                segments, _ = self._model.transcribe(audio, language=self.language, beam_size=self.beam_size,
+                                                     condition_on_previous_text=False)
+                texts[i] = " ".join(segment.text.strip() for segment in segments)
+        if short:
+            features = ctranslate2.StorageView.from_array(np.stack([self._features(audios[i]) for i in short]))
+            prompt = list(self._tokenizer.sot_sequence) + [self._tokenizer.no_timestamps]
+            results = self._model.model.generate(features, [prompt] * len(short), beam_size=self.beam_size,
+                                                 max_length=MAX_LENGTH, suppress_blank=True, suppress_tokens=[-1])
+            for i, result in zip(short, results):
+                texts[i] = self._tokenizer.decode(result.sequences_ids[0]).strip()
+        return texts
+
+
+_transcriber: Optional[LocalTranscriber] = None
+_transcriber_lock = threading.Lock()
+
+
+def get_local_transcriber() -> LocalTranscriber:
+    """The process-wide transcriber, loading the model on first use."""
+    global _transcriber
+    with _transcriber_lock:
+        if _transcriber is None:
+            _transcriber = LocalTranscriber()
+        return _transcriber
@@ -0,0 +1,241 @@
+"""
+Local stand-in backends for load testing and offline runs.
+They mimic the interfaces the server and pipeline use from the real
+providers, with configurable latency and no network access:
+
+- STT (STT_PROVIDER=mock): canned transcripts, picked deterministically per file.
+- LLM (MODEL_PROVIDER=mock): scripted rules, then echo, streamed word by word.
+- TTS (TTS_PROVIDER=mock): a sine tone in the requested PCM format.
+
+STT and LLM calls can also fail or stall at random (MOCK_*_ERROR_RATE,
+MOCK_*_SLOW_RATE, MOCK_*_SLOW_S) to exercise provider failover and hedging.
+"""
+import asyncio
+import json
+import math
+import os
+import random
+import struct
+import time
+import wave
+from typing import AsyncIterator, Iterator, List, Tuple
+
+MOCK_TTS_SAMPLE_RATE = 24000
+MOCK_TTS_FIRST_BYTE_S = float(os.getenv("MOCK_TTS_FIRST_BYTE_S", "0.3"))
+MOCK_TTS_REALTIME_FACTOR = float(os.getenv("MOCK_TTS_REALTIME_FACTOR", "4.0"))
+MOCK_TTS_CHUNK_MS = int(os.getenv("MOCK_TTS_CHUNK_MS", "40"))
+MOCK_TTS_SECONDS_PER_CHAR = float(os.getenv("MOCK_TTS_SECONDS_PER_CHAR", "0.06"))
+MOCK_TTS_TONE_HZ = 440.0
+
+MOCK_STT_LATENCY_S = float(os.getenv("MOCK_STT_LATENCY_S", "0.2"))
+# "|"-separated; a file always maps to the same entry
+MOCK_STT_TRANSCRIPTS = os.getenv("MOCK_STT_TRANSCRIPTS", "Привет, Мишка!|Расскажи мне сказку про зайца.|Как дела?")
+
+MOCK_STT_ERROR_RATE = float(os.getenv("MOCK_STT_ERROR_RATE", "0"))
+MOCK_STT_SLOW_RATE = float(os.getenv("MOCK_STT_SLOW_RATE", "0"))
+MOCK_STT_SLOW_S = float(os.getenv("MOCK_STT_SLOW_S", "5"))
+
+MOCK_LLM_FIRST_TOKEN_S = float(os.getenv("MOCK_LLM_FIRST_TOKEN_S", "0.3"))
+MOCK_LLM_TOKENS_PER_S = float(os.getenv("MOCK_LLM_TOKENS_PER_S", "50"))
+# JSON file with [{"match": "<substring of prompt>", "response": "<reply>"}, ...]
+MOCK_LLM_SCRIPT_PATH = os.getenv("MOCK_LLM_SCRIPT_PATH")
+# Fixed reply when no rule matches; empty means echo the prompt's last line
+MOCK_LLM_RESPONSE = os.getenv("MOCK_LLM_RESPONSE", "")
+
+MOCK_LLM_ERROR_RATE = float(os.getenv("MOCK_LLM_ERROR_RATE", "0"))
+MOCK_LLM_SLOW_RATE = float(os.getenv("MOCK_LLM_SLOW_RATE", "0"))
+MOCK_LLM_SLOW_S = float(os.getenv("MOCK_LLM_SLOW_S", "5"))
+
+# Built-in rules so the agent's JSON router and the safety validator get replies they can parse
+DEFAULT_LLM_SCRIPT = [
+    ("need_tool", '{"need_tool": false, "tool": "", "tool_input": ""}'),
+    ('"FINE"', "FINE"),
+]
+
+
+def inject_fault(error_rate: float, slow_rate: float, slow_s: float) -> bool:
+    """Rolls for a simulated provider fault: sleeps slow_s on a stall; returns True on a failure."""
+    roll = random.random()
+    if roll < error_rate:
+        return True
+    if roll < error_rate + slow_rate:
+        time.sleep(slow_s)
+    return False
+
+
+async def inject_fault_async(error_rate: float, slow_rate: float, slow_s: float) -> bool:
+    """inject_fault() for coroutines: a stall sleeps without blocking the event loop."""
+    roll = random.random()
+    if roll < error_rate:
+        return True
+    if roll < error_rate + slow_rate:
+        await asyncio.sleep(slow_s)
+    return False
+
+
+# --- STT ---
+def transcribe_audio_mock(file_path: str) -> str | None:
+    """Returns a canned transcript after MOCK_STT_LATENCY_S; the choice depends only on the audio length."""
+    try:
+        with wave.open(file_path, 'rb') as wf:
+            frames = wf.getnframes()
+    except (OSError, wave.Error, EOFError):
+        return None
+    if inject_fault(MOCK_STT_ERROR_RATE, MOCK_STT_SLOW_RATE, MOCK_STT_SLOW_S):
+        return None  # like the real backends, which log and return None
+    time.sleep(MOCK_STT_LATENCY_S)
+    transcripts = [t.strip() for t in MOCK_STT_TRANSCRIPTS.split("|") if t.strip()]
+    return transcripts[frames % len(transcripts)] if transcripts else None
+
+
+async def transcribe_pcm_mock(pcm: bytes) -> str | None:
+    """transcribe_audio_mock() for 16-bit PCM in memory, without blocking the event loop."""
+    if await inject_fault_async(MOCK_STT_ERROR_RATE, MOCK_STT_SLOW_RATE, MOCK_STT_SLOW_S):
+        return None
+    await asyncio.sleep(MOCK_STT_LATENCY_S)
+    transcripts = [t.strip() for t in MOCK_STT_TRANSCRIPTS.split("|") if t.strip()]
+    return transcripts[(len(pcm) // 2) % len(transcripts)] if transcripts else None
+
+
+# --- LLM ---
+def load_llm_script(path: str = None) -> List[Tuple[str, str]]:
+    """Returns (match, response) rules from a JSON script file followed by the built-in rules."""
+    rules = []
+    if path:
+        with open(path, 'r', encoding='utf-8') as f:
+            rules = [(rule["match"], rule["response"]) for rule in json.load(f)]
+    return rules + DEFAULT_LLM_SCRIPT
+
+
+class MockChatModel:
+    """
+    Stands in for the LangChain chat models used by the agent and tools
+    (invoke() and stream(), and ainvoke() and astream() for the async
+    pipeline). The first rule whose match occurs in the prompt wins;
+    otherwise MOCK_LLM_RESPONSE, or the last line of the prompt echoed back.
+    """
+
+    def __init__(self, model_name: str = "mock", script: List[Tuple[str, str]] = None,
+                 first_token_s: float = MOCK_LLM_FIRST_TOKEN_S, tokens_per_s: float = MOCK_LLM_TOKENS_PER_S):
+        self.model_name = model_name
+        self.script = script if script is not None else load_llm_script(MOCK_LLM_SCRIPT_PATH)
+        self.first_token_s = first_token_s
+        self.tokens_per_s = tokens_per_s
+
+    @staticmethod
+    def _prompt_text(prompt) -> str:
+        if isinstance(prompt, str):
+            return prompt
+        if isinstance(prompt, (list, tuple)) and prompt:
+            last = prompt[-1]
+            return getattr(last, "content", None) or str(last)
+        return str(prompt)
+
+    def respond(self, prompt) -> str:
+        text = self._prompt_text(prompt)
+        for match, response in self.script:
+            if match in text:
+                return response
+        if MOCK_LLM_RESPONSE:
+            return MOCK_LLM_RESPONSE
+        lines = [line.strip() for line in text.splitlines() if line.strip()]
+        return f"Echo: {lines[-1][:200]}" if lines else "Echo"
+
+    def _tokens(self, prompt) -> Iterator[str]:
+        words = self.respond(prompt).split(" ")
+        if inject_fault(MOCK_LLM_ERROR_RATE, MOCK_LLM_SLOW_RATE, MOCK_LLM_SLOW_S):
+            raise ConnectionError(f"Mock model {self.model_name}: simulated provider error")
+        time.sleep(self.first_token_s)
+        for i, word in enumerate(words):
+            if i:
+                time.sleep(1 / self.tokens_per_s)
+            yield word if i == len(words) - 1 else word + " "
+
+    def invoke(self, prompt, *args, **kwargs):
+        from langchain_core.messages import AIMessage
+        return AIMessage(content="".join(self._tokens(prompt)))
+
+    def stream(self, prompt, *args, **kwargs):
+        from langchain_core.messages import AIMessageChunk
+        for token in self._tokens(prompt):
+            yield AIMessageChunk(content=token)
+
+    async def _atokens(self, prompt) -> AsyncIterator[str]:
+        words = self.respond(prompt).split(" ")
+        if await inject_fault_async(MOCK_LLM_ERROR_RATE, MOCK_LLM_SLOW_RATE, MOCK_LLM_SLOW_S):
+            raise ConnectionError(f"Mock model {self.model_name}: simulated provider error")
+        await asyncio.sleep(self.first_token_s)
+        for i, word in enumerate(words):
+            if i:
+                await asyncio.sleep(1 / self.tokens_per_s)
+            yield word if i == len(words) - 1 else word + " "
+
+    async def ainvoke(self, prompt, *args, **kwargs):
+        from langchain_core.messages import AIMessage
+        return AIMessage(content="".join([token async for token in self._atokens(prompt)]))
+
+    async def astream(self, prompt, *args, **kwargs):
+        from langchain_core.messages import AIMessageChunk
+        async for token in self._atokens(prompt):
+            yield AIMessageChunk(content=token)
+
+
+# --- TTS ---
+
+
+def tone_f32le(duration_s: float, sample_rate: int = MOCK_TTS_SAMPLE_RATE, frequency: float = MOCK_TTS_TONE_HZ,
+               amplitude: float = 0.3, start_sample: int = 0) -> bytes:
+    """Returns a sine tone as raw float32 little-endian PCM."""
+    count = int(duration_s * sample_rate)
+    step = 2 * math.pi * frequency / sample_rate
+    samples = [amplitude * math.sin(step * (start_sample + i)) for i in range(count)]
+    return struct.pack(f"<{count}f", *samples)
+
+
+def tone_pcm(encoding: str, duration_s: float, sample_rate: int = MOCK_TTS_SAMPLE_RATE, start_sample: int = 0) -> bytes:
+    """Returns a sine tone in a Cartesia raw encoding (pcm_f32le or pcm_s16le)."""
+    if encoding == "pcm_s16le":
+        count = int(duration_s * sample_rate)
+        step = 2 * math.pi * MOCK_TTS_TONE_HZ / sample_rate
+        samples = [int(0.3 * 32767 * math.sin(step * (start_sample + i))) for i in range(count)]
+        return struct.pack(f"<{count}h", *samples)
+    return tone_f32le(duration_s, sample_rate, start_sample=start_sample)
+
+
+class _MockTTSWebSocket:
+    """Shaped like cartesia's TTS websocket: send(...) returns a generator of {'audio': bytes}."""
+
+    def send(self, model_id: str, transcript: str, voice: dict, stream: bool = True,
+             output_format: dict = None) -> Iterator[dict]:
+        sample_rate = (output_format or {}).get("sample_rate", MOCK_TTS_SAMPLE_RATE)
+        encoding = (output_format or {}).get("encoding", "pcm_f32le")
+        duration_s = max(0.5, len(transcript) * MOCK_TTS_SECONDS_PER_CHAR)
+        chunk_s = MOCK_TTS_CHUNK_MS / 1000
+        chunk_samples = int(chunk_s * sample_rate)
+
+        def generate():
+            time.sleep(MOCK_TTS_FIRST_BYTE_S)
+            produced = 0
+            total = int(duration_s * sample_rate)
+            while produced < total:
+                count = min(chunk_samples, total - produced)
+                yield {"audio": tone_pcm(encoding, count / sample_rate, sample_rate, start_sample=produced)}
+                produced += count
+                time.sleep(chunk_s / MOCK_TTS_REALTIME_FACTOR)
+
+        return generate()
+
+    def close(self) -> None:
+        pass
+
+
+class _MockTTS:
+    def websocket(self) -> _MockTTSWebSocket:
+        return _MockTTSWebSocket()
+
+
+class MockTTSClient:
+    """Drop-in for the Cartesia client: client.tts.websocket().send(...)."""
+
+    def __init__(self):
+        self.tts = _MockTTS()
@@ -0,0 +1,348 @@
+"""
+Failover and hedged requests across interchangeable providers (LLM, STT).
+A ProviderRouter tries providers in order of health and latency EWMA. If
+the first has not answered after its recent ROUTER_HEDGE_PERCENTILE latency,
+a hedged request goes to the next provider and the first good answer wins;
+an error fails over to the next provider at once and puts the failed one in
+cooldown. The pipeline is a new process per turn, so per-provider
+statistics are kept in a small JSON file (ROUTER_STATS_PATH) shared by turns.
+A process adds the latencies and errors it saw to the file at exit (and every
+ROUTER_SAVE_INTERVAL_S while it runs), under an exclusive lock on a sidecar
+.lock file, so overlapping turns combine their statistics.
+"""
+import asyncio
+import atexit
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Sequence, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: turns are only serialized within a process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ROUTER_HEDGING = os.getenv("ROUTER_HEDGING", "true").lower() in ("1", "true", "yes")
+ROUTER_HEDGE_PERCENTILE = float(os.getenv("ROUTER_HEDGE_PERCENTILE", "0.95"))
+# Hedge delay until a provider has MIN_SAMPLES latencies, and the bounds it is kept within
+ROUTER_HEDGE_DEFAULT_S = float(os.getenv("ROUTER_HEDGE_DEFAULT_S", "2.0"))
+ROUTER_HEDGE_MIN_S = float(os.getenv("ROUTER_HEDGE_MIN_S", "0.2"))
+ROUTER_HEDGE_MAX_S = float(os.getenv("ROUTER_HEDGE_MAX_S", "10"))
+ROUTER_EWMA_ALPHA = float(os.getenv("ROUTER_EWMA_ALPHA", "0.2"))
+ROUTER_COOLDOWN_S = float(os.getenv("ROUTER_COOLDOWN_S", "30"))
+# Empty keeps statistics in memory only
+ROUTER_STATS_PATH = os.getenv("ROUTER_STATS_PATH", os.path.join(PROJECT_ROOT, "logs", "router_stats.json"))
+ROUTER_SAVE_INTERVAL_S = float(os.getenv("ROUTER_SAVE_INTERVAL_S", "10"))
+MIN_SAMPLES = 5
+MAX_SAMPLES = 64
+
+_stats_file_lock = threading.Lock()
+
+
+class AllProvidersFailed(Exception):
+    """Raised when no provider returned a usable result before the deadline."""
+
+
+class ProviderStats:
+    """Latency EWMA, recent latencies and error state of one provider."""
+    __slots__ = ("ewma_s", "samples", "errors", "cooldown_until")
+
+    def __init__(self, ewma_s: float = None, samples: List[float] = None, errors: int = 0, cooldown_until: float = 0.0):
+        self.ewma_s = ewma_s
+        self.samples = samples or []
+        self.errors = errors
+        self.cooldown_until = cooldown_until  # wall clock, so it holds across processes
+
+    def observe(self, latency_s: float, alpha: float = ROUTER_EWMA_ALPHA) -> None:
+        self.ewma_s = latency_s if self.ewma_s is None else alpha * latency_s + (1 - alpha) * self.ewma_s
+        self.samples = (self.samples + [round(latency_s, 4)])[-MAX_SAMPLES:]
+
+    def fail(self, cooldown_s: float = ROUTER_COOLDOWN_S) -> None:
+        self.errors += 1
+        self.cooldown_until = time.time() + cooldown_s
+
+    @property
+    def healthy(self) -> bool:
+        return time.time() >= self.cooldown_until
+
+    def hedge_delay(self, percentile: float = ROUTER_HEDGE_PERCENTILE) -> float:
+        if len(self.samples) < MIN_SAMPLES:
+            return ROUTER_HEDGE_DEFAULT_S
+        ordered = sorted(self.samples)
+        value = ordered[min(len(ordered) - 1, int(len(ordered) * percentile))]
+        return min(ROUTER_HEDGE_MAX_S, max(ROUTER_HEDGE_MIN_S, value))
+
+    def to_dict(self) -> dict:
+        return {"ewma_s": self.ewma_s, "samples": self.samples, "errors": self.errors,
+                "cooldown_until": self.cooldown_until}
+
+
+@contextlib.contextmanager
+def _stats_file_locked(path: str):
+    """Holds the stats file's lock (path + ".lock") across processes for a read-modify-write."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with _stats_file_lock, open(path + ".lock", 'a') as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        yield  # closing the file releases the lock
+
+
+def _read_stats_file(path: str) -> dict:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _run_in_thread(fn: Callable, *args) -> Future:
+    """Runs fn in a daemon thread, so abandoned hedges never hold up process exit."""
+    future = Future()
+
+    def target():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn(*args))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=target, name="router", daemon=True).start()
+    return future
+
+
+class ProviderRouter:
+    """
+    Routes calls across providers given as (name, target) pairs: call(fn)
+    runs fn(target) on the best provider, hedging and failing over as needed.
+    """
+
+    def __init__(self, name: str, providers: Sequence[Tuple[str, Any]], timeout_s: float,
+                 hedging: bool = ROUTER_HEDGING, stats_path: str = ROUTER_STATS_PATH):
+        if not providers:
+            raise ValueError(f"Router {name} needs at least one provider")
+        self.name = name
+        self.providers = list(providers)
+        self.timeout_s = timeout_s
+        self.hedging = hedging
+        self.stats_path = stats_path
+        self._lock = threading.Lock()
+        saved = _read_stats_file(stats_path) if stats_path else {}
+        self.stats: Dict[str, ProviderStats] = {
+            provider: ProviderStats(**saved.get(self._key(provider), {})) for provider, _ in self.providers
+        }
+        # Latencies and error counts not yet added to the stats file
+        self._unsaved = self._no_unsaved()
+        self._last_save = time.monotonic()
+        if stats_path:
+            atexit.register(self.save)
+
+    def _key(self, provider: str) -> str:
+        return f"{self.name}/{provider}"
+
+    def ordered(self) -> List[Tuple[str, Any]]:
+        """Healthy providers first, then by latency EWMA; unmeasured ones go first so they get measured."""
+        with self._lock:
+            ranks = {name: (not self.stats[name].healthy, self.stats[name].ewma_s or 0.0, index)
+                     for index, (name, _) in enumerate(self.providers)}
+        return sorted(self.providers, key=lambda provider: ranks[provider[0]])
+
+    def _no_unsaved(self) -> Dict[str, Tuple[List[float], int]]:
+        return {name: ([], 0) for name, _ in self.providers}
+
+    def _observe(self, provider: str, latency_s: float) -> None:
+        """Records a latency (call with self._lock held)."""
+        self.stats[provider].observe(latency_s)
+        self._unsaved[provider][0].append(latency_s)
+
+    def _fail(self, provider: str) -> None:
+        """Records an error and starts the provider's cooldown (call with self._lock held)."""
+        self.stats[provider].fail()
+        samples, errors = self._unsaved[provider]
+        self._unsaved[provider] = (samples, errors + 1)
+
+    def _apply_unsaved(self, name: str, stats: ProviderStats) -> None:
+        samples, errors = self._unsaved[name]
+        for latency_s in samples:
+            stats.observe(latency_s)
+        stats.errors += errors
+        stats.cooldown_until = max(stats.cooldown_until, self.stats[name].cooldown_until)
+
+    def save(self) -> None:
+        """
+        Adds the latencies and errors seen since the last save to the shared
+        stats file, replaying them onto what other processes have saved
+        meanwhile, and takes on the combined statistics.
+        """
+        self._last_save = time.monotonic()
+        if not self.stats_path:
+            return
+        with self._lock:
+            if not any(samples or errors for samples, errors in self._unsaved.values()):
+                return
+            unsaved, self._unsaved = self._unsaved, self._no_unsaved()
+            cooldowns = {name: stats.cooldown_until for name, stats in self.stats.items()}
+        merged = {}
+        try:
+            with _stats_file_locked(self.stats_path):
+                shared = _read_stats_file(self.stats_path)
+                for name, (samples, errors) in unsaved.items():
+                    stats = ProviderStats(**shared.get(self._key(name), {}))
+                    for latency_s in samples:
+                        stats.observe(latency_s)
+                    stats.errors += errors
+                    stats.cooldown_until = max(stats.cooldown_until, cooldowns[name])
+                    shared[self._key(name)] = stats.to_dict()
+                    merged[name] = stats
+                tmp_path = f"{self.stats_path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(shared, f)
+                os.replace(tmp_path, self.stats_path)
+        except OSError as e:
+            logger.warning(f"Could not save router statistics to {self.stats_path}: {e}")
+            return
+        with self._lock:
+            for name, stats in merged.items():
+                self._apply_unsaved(name, stats)  # calls that finished while saving
+                self.stats[name] = stats
+
+    def call(self, fn: Callable[[Any], Any], accept: Callable[[Any], bool] = lambda result: result is not None) -> Any:
+        """Returns the first result of fn(target) that accept() takes; raises AllProvidersFailed otherwise."""
+        order = self.ordered()
+        deadline = time.monotonic() + self.timeout_s
+        pending: Dict[Future, Tuple[str, float]] = {}
+        errors = []
+        hedge_at = float("inf")
+
+        def launch():
+            nonlocal hedge_at
+            provider, target = order[len(pending) + len(errors)]
+            started = time.monotonic()
+            pending[_run_in_thread(fn, target)] = (provider, started)
+            hedge_at = started + self.stats[provider].hedge_delay()
+
+        launch()
+        try:
+            while pending:
+                can_launch = len(pending) + len(errors) < len(order)
+                now = time.monotonic()
+                wake = min(deadline, hedge_at) if self.hedging and can_launch else deadline
+                done, _ = wait(list(pending), timeout=max(0.0, wake - now), return_when=FIRST_COMPLETED)
+                for future in done:
+                    provider, started = pending.pop(future)
+                    latency_s = time.monotonic() - started
+                    try:
+                        result, error = future.result(), None
+                    except Exception as e:
+                        result, error = None, e
+                    if error is None and accept(result):
+                        with self._lock:
+                            self._observe(provider, latency_s)
+                            # Losing hedges took at least this long; count that so traffic moves away from them
+                            for other, other_started in pending.values():
+                                self._observe(other, time.monotonic() - other_started)
+                        if len(order) > 1 and (pending or errors or provider != order[0][0]):
+                            logger.info(f"{self.name}: answered by {provider} in {latency_s:.2f}s "
+                                        f"({len(errors)} failed, {len(pending)} abandoned)")
+                        return result
+                    with self._lock:
+                        self._fail(provider)
+                    errors.append(f"{provider}: {error or 'empty result'}")
+                    logger.warning(f"{self.name}: {provider} failed after {latency_s:.2f}s ({error or 'empty result'})")
+                if time.monotonic() >= deadline:
+                    break
+                can_launch = len(pending) + len(errors) < len(order)
+                if can_launch and (not pending or (self.hedging and time.monotonic() >= hedge_at)):
+                    if pending:
+                        logger.info(f"{self.name}: no answer after {time.monotonic() - min(s for _, s in pending.values()):.2f}s, "
+                                    f"hedging to {order[len(pending) + len(errors)][0]}")
+                    launch()
+        finally:
+            # Saved at exit too; a pipeline process makes only a few calls
+            if time.monotonic() - self._last_save >= ROUTER_SAVE_INTERVAL_S:
+                self.save()
+        raise AllProvidersFailed(f"{self.name}: no provider answered within {self.timeout_s:.0f}s "
+                                 f"({'; '.join(errors) or 'timed out'})")
+
+    def call_stream(self, fn: Callable[[Any], Iterator]) -> Iterator:
+        """
+        Like call() for streaming APIs: providers race to the first item, then
+        the winner's stream is passed through. Errors after the first item
+        are raised to the caller, since the reply has already started.
+        """
+        lock = threading.Lock()
+        started: List[Iterator] = []
+        decided = False
+
+        def first_item(target):
+            iterator = iter(fn(target))
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return None
+            with lock:
+                late = decided
+                if not late:
+                    started.append(iterator)
+            if late:
+                _close(iterator)
+            return item, iterator
+
+        first, iterator = self.call(first_item)
+        with lock:
+            decided = True
+            losers = [other for other in started if other is not iterator]
+        for other in losers:
+            _close(other)  # releases the losing providers' connections
+        yield first
+        yield from iterator
+
+
+def _close(iterator: Iterator) -> None:
+    close = getattr(iterator, "close", None)
+    if callable(close):
+        try:
+            close()
+        except Exception as e:
+            logger.debug(f"Closing an abandoned stream failed: {e}")
+
+
+class RoutedChatModel:
+    """Chat model with invoke() and stream() routed across (name, chat model) pairs."""
+
+    def __init__(self, models: Sequence[Tuple[str, Any]], timeout_s: float,
+                 hedging: bool = ROUTER_HEDGING, stats_path: str = ROUTER_STATS_PATH):
+        self.models = list(models)
+        # Whole replies and time to first token are measured separately
+        self._invoke_router = ProviderRouter("llm", self.models, timeout_s, hedging, stats_path)
+        self._stream_router = ProviderRouter("llm_stream", self.models, timeout_s, hedging, stats_path)
+
+    def invoke(self, prompt, *args, **kwargs):
+        return self._invoke_router.call(lambda model: model.invoke(prompt, *args, **kwargs))
+
+    def stream(self, prompt, *args, **kwargs):
+        return self._stream_router.call_stream(lambda model: model.stream(prompt, *args, **kwargs))
+
+    # Routing and hedging run on threads, so the async methods drive the sync ones from a worker thread
+    async def ainvoke(self, prompt, *args, **kwargs):
+        return await asyncio.to_thread(self.invoke, prompt, *args, **kwargs)
+
+    async def astream(self, prompt, *args, **kwargs) -> AsyncIterator:
+        stream = self.stream(prompt, *args, **kwargs)
+        done = object()
+        try:
+            while True:
+                chunk = await asyncio.to_thread(next, stream, done)
+                if chunk is done:
+                    break
+                yield chunk
+        finally:
+            _close(stream)
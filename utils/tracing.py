@@ -0,0 +1,178 @@
+"""
+Per-turn latency tracing.
+Each utterance gets a trace id when recording starts. The server and the
+pipeline subprocess (which receives the id in TURN_TRACE_ID) record named
+spans against it and append them as JSON lines to logs/traces.jsonl, one
+write() per span. Spans from both processes are joined by trace id, and
+aggregate_traces() turns the file into p50/p95/p99 per span name.
+
+Usage: python utils/tracing.py [traces.jsonl]
+"""
+import contextvars
+import json
+import math
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TRACE_ENV_VAR = "TURN_TRACE_ID"
+TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH", os.path.join(PROJECT_ROOT, "logs", "traces.jsonl"))
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() != "false"
+
+_fd = None
+_fd_lock = threading.Lock()
+_span_listeners: List[Callable[[str, float, dict], None]] = []
+
+
+def add_span_listener(listener: Callable[[str, float, dict], None]) -> None:
+    """Calls listener(name, duration_ms, attributes) for every span recorded in this process."""
+    _span_listeners.append(listener)
+
+
+def _write_line(record: dict) -> None:
+    global _fd
+    line = (json.dumps(record, ensure_ascii=False) + "\n").encode('utf-8')
+    with _fd_lock:
+        if _fd is None:
+            os.makedirs(os.path.dirname(TRACE_LOG_PATH), exist_ok=True)
+            _fd = os.open(TRACE_LOG_PATH, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        # O_APPEND + a single write keeps lines from both processes intact
+        os.write(_fd, line)
+
+
+class Span:
+    """A timed section of a turn; call end() once (extra attributes are recorded with it)."""
+
+    def __init__(self, trace: "Trace", name: str, **attributes):
+        self.trace = trace
+        self.name = name
+        self.attributes = attributes
+        self.start_wall = time.time()
+        self.start = time.perf_counter()
+        self.duration_ms: Optional[float] = None
+
+    def end(self, **attributes) -> float:
+        if self.duration_ms is None:
+            self.duration_ms = (time.perf_counter() - self.start) * 1000
+            self.attributes.update(attributes)
+            self.trace.record(self.name, self.start_wall, self.duration_ms, **self.attributes)
+        return self.duration_ms
+
+
+class Trace:
+    """Collects the spans of one turn."""
+
+    def __init__(self, trace_id: str = None, **attributes):
+        self.trace_id = trace_id or uuid.uuid4().hex[:16]
+        self.attributes = attributes
+        self._marks = {}
+
+    def record(self, name: str, start_wall: float, duration_ms: float, **attributes) -> None:
+        for listener in _span_listeners:
+            listener(name, duration_ms, attributes)
+        if not TRACING_ENABLED:
+            return
+        record = {"trace_id": self.trace_id, "span": name, "start": round(start_wall, 6),
+                  "duration_ms": round(duration_ms, 3), "pid": os.getpid()}
+        record.update(self.attributes)
+        record.update(attributes)
+        try:
+            _write_line(record)
+        except OSError:
+            pass
+
+    def start_span(self, name: str, **attributes) -> Span:
+        return Span(self, name, **attributes)
+
+    def mark(self, name: str) -> None:
+        """Remembers a point in time that later spans can be measured from."""
+        self._marks[name] = (time.time(), time.perf_counter())
+
+    def record_since(self, mark: str, name: str, extra_ms: float = 0.0, **attributes) -> None:
+        """Records a span from a mark until now (plus extra_ms, e.g. audio still playing)."""
+        if mark in self._marks:
+            start_wall, start = self._marks[mark]
+            self.record(name, start_wall, (time.perf_counter() - start) * 1000 + extra_ms, **attributes)
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        span = Span(self, name, **attributes)
+        try:
+            yield span
+        finally:
+            span.end()
+
+    def env(self) -> Dict[str, str]:
+        """Environment entries that hand this trace to a subprocess."""
+        return {TRACE_ENV_VAR: self.trace_id}
+
+
+class NullTrace(Trace):
+    """Trace used when no turn is active; spans are timed but not written."""
+
+    def record(self, name, start_wall, duration_ms, **attributes) -> None:
+        pass
+
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("current_trace", default=NullTrace("none"))
+
+
+def get_current_trace() -> Trace:
+    return _current_trace.get()
+
+
+def set_current_trace(trace: Trace) -> None:
+    _current_trace.set(trace)
+
+
+def trace_from_env(**attributes) -> Trace:
+    """Returns the trace handed over by the parent process, or a NullTrace."""
+    trace_id = os.getenv(TRACE_ENV_VAR)
+    return Trace(trace_id, **attributes) if trace_id else NullTrace("none")
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an unsorted list."""
+    ordered = sorted(values)
+    rank = math.ceil(fraction * len(ordered))
+    return ordered[max(0, min(len(ordered), rank) - 1)]
+
+
+def aggregate_traces(path: str = TRACE_LOG_PATH) -> Dict[str, Dict[str, float]]:
+    """Returns {span: {count, p50, p95, p99, max}} in milliseconds from a traces file."""
+    durations: Dict[str, List[float]] = defaultdict(list)
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+                durations[record["span"]].append(float(record["duration_ms"]))
+            except (ValueError, KeyError):
+                continue
+    return {
+        name: {
+            "count": len(values),
+            "p50": percentile(values, 0.50),
+            "p95": percentile(values, 0.95),
+            "p99": percentile(values, 0.99),
+            "max": max(values),
+        }
+        for name, values in durations.items()
+    }
+
+
+def main() -> None:
+    path = sys.argv[1] if len(sys.argv) > 1 else TRACE_LOG_PATH
+    stats = aggregate_traces(path)
+    print(f"{'span':<24} {'count':>7} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'max ms':>10}")
+    for name, row in sorted(stats.items(), key=lambda item: item[1]["p50"], reverse=True):
+        print(f"{name:<24} {row['count']:>7} {row['p50']:>10.1f} {row['p95']:>10.1f} {row['p99']:>10.1f} {row['max']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,15 @@
 import os
-import requests
-import asyncio
 from dotenv import load_dotenv
 import logging
-from langchain_together import ChatTogether
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_mistralai.chat_models import ChatMistralAI
-from openai import OpenAI
 import traceback
-import assemblyai as aai
 import json
 from pathlib import Path
 import time
+import threading
+from typing import TYPE_CHECKING, Any, Callable, Hashable
+
+if TYPE_CHECKING:
+    from langchain_together import ChatTogether
 
 load_dotenv()
 
@@ -36,27 +34,123 @@ logger = logging.getLogger(__name__)
 
 
 
-def setup_llm():
-    """Initialize the LLM based on environment configuration"""
+# --- Shared client registry ---
+# Clients are created once per process and keyed by provider/model, so
+# repeated turns reuse the same HTTP connection pool (and warm TLS sessions)
+# instead of building a new client per call.
+LLM_TIMEOUT_S = float(os.getenv("LLM_TIMEOUT_S", "60"))
+STT_TIMEOUT_S = float(os.getenv("STT_TIMEOUT_S", "30"))
+HTTP_CONNECT_TIMEOUT_S = float(os.getenv("HTTP_CONNECT_TIMEOUT_S", "5"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_S = float(os.getenv("HTTP_KEEPALIVE_S", "90"))
+
+DEEP_INFRA_BASE_URL = "https://api.deepinfra.com/v1/openai"
+
+# Speech-to-text backend used by transcribe_audio(): deepinfra, assemblyai, local (offline Whisper) or mock
+STT_PROVIDER = os.getenv("STT_PROVIDER", "deepinfra").lower()
+# Failover/hedging across several backends (utils/routing.py), e.g. "deepinfra,assemblyai"
+# and "together:<model>,mistral:<model>"; a list of one or none means STT_PROVIDER / MODEL_PROVIDER
+STT_PROVIDERS = [p.strip().lower() for p in os.getenv("STT_PROVIDERS", "").split(",") if p.strip()]
+MODEL_PROVIDERS = [p.strip() for p in os.getenv("MODEL_PROVIDERS", "").split(",") if p.strip()]
+
+_clients: dict = {}
+_clients_lock = threading.RLock()  # factories may register nested clients
+
+
+def get_client(key: Hashable, factory: Callable[[], Any]) -> Any:
+    """Returns the process-wide client for key, creating it with factory() on first use."""
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = factory()
+                _clients[key] = client
+    return client
+
+
+def close_clients() -> None:
+    """Closes every registered client that owns connections and empties the registry."""
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        close = getattr(client, "close", None)
+        if callable(close):
+            try:
+                close()
+            except Exception as e:
+                logger.warning(f"Failed to close client {type(client).__name__}: {e}")
+
+
+def get_http_client(timeout: float):
+    """Returns a pooled keep-alive HTTP client for OpenAI-compatible SDKs."""
+    def create():
+        import httpx
+        from openai import DefaultHttpxClient
+        return DefaultHttpxClient(
+            timeout=httpx.Timeout(timeout, connect=HTTP_CONNECT_TIMEOUT_S),
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+                keepalive_expiry=HTTP_KEEPALIVE_S
+            )
+        )
+    return get_client(("http", timeout), create)
+
+
+def get_async_http_client(timeout: float):
+    """Returns the pooled keep-alive async HTTP client for OpenAI-compatible SDKs (used by the async pipeline)."""
+    def create():
+        import httpx
+        from openai import DefaultAsyncHttpxClient
+        return DefaultAsyncHttpxClient(
+            timeout=httpx.Timeout(timeout, connect=HTTP_CONNECT_TIMEOUT_S),
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+                keepalive_expiry=HTTP_KEEPALIVE_S
+            )
+        )
+    return get_client(("http_async", timeout), create)
+
+
+def setup_llm(provider: str = None, model_name: str = None):
+    """Return the shared LLM client for provider/model (defaults from environment configuration)"""
+    if provider is None and model_name is None and len(MODEL_PROVIDERS) > 1:
+        return get_client(("llm", "routed", tuple(MODEL_PROVIDERS)), _create_routed_llm)
+    provider = (provider or os.getenv("MODEL_PROVIDER", "")).lower()
+    model_name = model_name or os.getenv("MODEL_NAME")
+    return get_client(("llm", provider, model_name), lambda: _create_llm(provider, model_name))
+
+
+def _create_llm(MODEL_PROVIDER: str, MODEL_NAME: str):
+    """Initialize the LLM for a provider"""
     logger.info("Setting up main LLM...")
     
-    MODEL_PROVIDER = os.getenv("MODEL_PROVIDER").lower()
-    MODEL_NAME = os.getenv("MODEL_NAME")
     TOGETHER_API_KEY = os.getenv("TOGETHER_API_KEY")
     GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
     MISTRAL_API_KEY = os.getenv("MISTRAL_API_KEY")
     
     logger.info(f"Using model provider: {MODEL_PROVIDER}, model: {MODEL_NAME}")
     
-    if MODEL_PROVIDER == "together":
+    if MODEL_PROVIDER == "mock":
+        logger.info("Initializing local mock model")
+        from utils.mock_backends import MockChatModel
+        return MockChatModel(MODEL_NAME or "mock")
+    elif MODEL_PROVIDER == "together":
         if not TOGETHER_API_KEY:
             logger.error("TOGETHER_API_KEY environment variable is required for Together AI")
             raise ValueError("TOGETHER_API_KEY environment variable is required for Together AI")
         try:
             logger.info("Initializing Together AI model")
+            from langchain_together import ChatTogether
             return ChatTogether(
                 together_api_key=TOGETHER_API_KEY,
-                model=MODEL_NAME
+                model=MODEL_NAME,
+                timeout=LLM_TIMEOUT_S,
+                http_client=get_http_client(LLM_TIMEOUT_S),
+                http_async_client=get_async_http_client(LLM_TIMEOUT_S)
             )
         except Exception as e:
             logger.error(f"Failed to initialize Together AI model: {e}")
@@ -67,9 +161,11 @@ def setup_llm():
             raise ValueError("GOOGLE_API_KEY environment variable is required for Google AI")
         try:
             logger.info("Initializing Google AI model")
+            from langchain_google_genai import ChatGoogleGenerativeAI
             return ChatGoogleGenerativeAI(
                 google_api_key=GOOGLE_API_KEY,
-                model=MODEL_NAME
+                model=MODEL_NAME,
+                timeout=LLM_TIMEOUT_S
             )
         except Exception as e:
             logger.error(f"Failed to initialize Google AI model: {e}")
@@ -80,9 +176,11 @@ def setup_llm():
             raise ValueError("MISTRAL_API_KEY environment variable is required for Mistral AI")
         try:
             logger.info("Initializing Mistral AI model")
+            from langchain_mistralai.chat_models import ChatMistralAI
             return ChatMistralAI(
                 api_key=MISTRAL_API_KEY,
-                model=MODEL_NAME
+                model=MODEL_NAME,
+                timeout=int(LLM_TIMEOUT_S)
             )
         except Exception as e:
             logger.error(f"Failed to initialize Mistral AI model: {e}")
@@ -90,6 +188,48 @@ def setup_llm():
     else:
         logger.error(f"Unsupported model provider: {MODEL_PROVIDER}")
         raise ValueError(f"Unsupported model provider: {MODEL_PROVIDER}")
+
+
+def _create_routed_llm():
+    """Builds a RoutedChatModel over the MODEL_PROVIDERS entries that can be initialized."""
+    from utils.routing import RoutedChatModel
+    models = []
+    for spec in MODEL_PROVIDERS:
+        provider, _, model_name = spec.partition(":")
+        try:
+            models.append((spec, setup_llm(provider, model_name or None)))
+        except Exception as e:
+            logger.warning(f"Skipping LLM provider {spec}: {e}")
+    if not models:
+        raise ValueError(f"None of MODEL_PROVIDERS could be initialized: {MODEL_PROVIDERS}")
+    logger.info(f"Routing LLM requests across: {', '.join(spec for spec, _ in models)}")
+    return RoutedChatModel(models, timeout_s=LLM_TIMEOUT_S)
+
+
+def get_stt_client(base_url: str = DEEP_INFRA_BASE_URL):
+    """Return the shared OpenAI-compatible client used for Whisper transcription"""
+    def create():
+        from openai import OpenAI
+        return OpenAI(
+            api_key=os.getenv("DEEP_INFRA_KEY"),
+            base_url=base_url,
+            timeout=STT_TIMEOUT_S,
+            http_client=get_http_client(STT_TIMEOUT_S)
+        )
+    return get_client(("stt", base_url), create)
+
+
+def get_async_stt_client(base_url: str = DEEP_INFRA_BASE_URL):
+    """Return the shared async OpenAI-compatible client used by transcribe_audio_async()"""
+    def create():
+        from openai import AsyncOpenAI
+        return AsyncOpenAI(
+            api_key=os.getenv("DEEP_INFRA_KEY"),
+            base_url=base_url,
+            timeout=STT_TIMEOUT_S,
+            http_client=get_async_http_client(STT_TIMEOUT_S)
+        )
+    return get_client(("stt_async", base_url), create)
     
 
 def transcribe_audio_whisper(file_path: str) -> str | None:
@@ -105,10 +245,7 @@ def transcribe_audio_whisper(file_path: str) -> str | None:
     logger.info(f"Running Whisper STT on {file_path}...")
 
     try:
-        client = OpenAI(
-            api_key=os.getenv("DEEP_INFRA_KEY"),
-            base_url="https://api.deepinfra.com/v1/openai",
-        )
+        client = get_stt_client()
     except Exception as e:
         logger.error(f"Failed to initialize OpenAI client: {e}")
         raise
@@ -151,6 +288,7 @@ def transcribe_audio_assemblyai(file_path: str) -> str | None:
     logger.info(f"[{file_path.name}] Running STT...")
 
     try:
+        import assemblyai as aai
         aai.settings.api_key = os.getenv("ASSEMBLYAI_API_KEY")
     except Exception as e:
         logger.error(f"Failed to initialize AssemblyAI client: {e}")
@@ -184,6 +322,168 @@ def transcribe_audio_assemblyai(file_path: str) -> str | None:
         return None
 
 
+def transcribe_audio_local(file_path: str) -> str | None:
+    """
+    Transcribe audio file with the offline Whisper model (utils/local_stt.py),
+    loaded once per process. Pipelines started by the server reach the
+    worker's warm copy through transcribe_audio_service() instead.
+
+    Args:
+        file_path: Path to the audio file
+
+    Returns:
+        Transcribed text or None if failed
+    """
+    logger.info(f"Running local STT on {file_path}...")
+    try:
+        from utils.local_stt import get_local_transcriber
+        return get_local_transcriber().transcribe_file(file_path)
+    except Exception as e:
+        logger.error(f"Local transcription failed: {e}")
+        logger.debug(traceback.format_exc())
+        return None
+
+
+def transcribe_audio_service(file_path: str, url: str) -> str | None:
+    """
+    Transcribe audio file through the server worker's STT stage
+    (server/stt_service.py), which batches utterances across pipelines.
+
+    Returns None if the stage fails or times out; the stage may still be
+    working on the file, so the caller must not transcribe it again.
+
+    Raises:
+        ConnectionRefusedError: nothing is listening at url
+    """
+    import urllib.error
+    import urllib.request
+    request = urllib.request.Request(url, data=json.dumps({"path": os.path.abspath(file_path)}).encode("utf-8"),
+                                     headers={"Content-Type": "application/json"})
+    try:
+        # One loopback call per turn; the server closes the connection after it, so there is no pool to reuse
+        with urllib.request.urlopen(request, timeout=STT_TIMEOUT_S) as response:
+            return json.loads(response.read()).get("text") or None
+    except urllib.error.HTTPError as e:
+        logger.error(f"STT stage failed: {e.code} {e.read().decode('utf-8', errors='replace')}")
+        return None
+    except urllib.error.URLError as e:
+        if isinstance(e.reason, ConnectionRefusedError):
+            raise e.reason
+        logger.error(f"STT stage at {url} failed: {e.reason}")
+        return None
+    except ConnectionRefusedError:
+        raise
+    except OSError as e:  # timeouts, resets
+        logger.error(f"STT stage at {url} failed: {e}")
+        return None
+
+
+def get_stt_router():
+    """Return the shared router over STT_PROVIDERS."""
+    from utils.routing import ProviderRouter
+    return get_client(("router", "stt", tuple(STT_PROVIDERS)),
+                      lambda: ProviderRouter("stt", [(p, p) for p in STT_PROVIDERS], timeout_s=STT_TIMEOUT_S))
+
+
+def transcribe_audio(file_path: str, provider: str = None) -> str | None:
+    """Transcribe an audio file with the configured STT backend (STT_PROVIDER), or route across STT_PROVIDERS.
+    A pipeline started by the server hands the file to the server's STT stage (STT_SERVICE_URL)."""
+    service_url = os.getenv("STT_SERVICE_URL")
+    if provider is None and service_url:
+        try:
+            return transcribe_audio_service(file_path, service_url)
+        except ConnectionRefusedError as e:
+            # Only when the stage is certainly not running; after a timeout it may still be transcribing
+            logger.warning(f"STT stage at {service_url} unreachable ({e}), transcribing in this process")
+    if provider is None and len(STT_PROVIDERS) > 1:
+        from utils.routing import AllProvidersFailed
+        try:
+            return get_stt_router().call(lambda name: transcribe_audio(file_path, name))
+        except AllProvidersFailed as e:
+            logger.error(f"Transcription failed on every provider: {e}")
+            return None
+    provider = (provider or STT_PROVIDER).lower()
+    # "name:label" lets one backend appear in STT_PROVIDERS more than once
+    kind = provider.split(":", 1)[0]
+    if kind == "deepinfra":
+        return transcribe_audio_whisper(file_path)
+    elif kind == "assemblyai":
+        return transcribe_audio_assemblyai(file_path)
+    elif kind == "local":
+        return transcribe_audio_local(file_path)
+    elif kind == "mock":
+        from utils.mock_backends import transcribe_audio_mock
+        logger.info(f"Running mock STT on {file_path}...")
+        return transcribe_audio_mock(file_path)
+    else:
+        logger.error(f"Unsupported STT provider: {provider}")
+        raise ValueError(f"Unsupported STT provider: {provider}")
+
+
+def pcm_to_wav(pcm: bytes, sample_rate: int = 16000) -> bytes:
+    """A WAV file in memory holding 16-bit mono PCM."""
+    import io
+    import wave
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(sample_rate)
+        wf.writeframes(pcm)
+    return buffer.getvalue()
+
+
+async def transcribe_audio_async(pcm: bytes, provider: str = None) -> str | None:
+    """
+    Transcribe 16 kHz 16-bit mono PCM without blocking the event loop.
+    DeepInfra is called over the shared async client, the local model
+    through its batching queue. Other backends, and routing across
+    STT_PROVIDERS, run transcribe_audio() on a worker thread.
+    """
+    import asyncio
+    if provider is None and len(STT_PROVIDERS) > 1:
+        kind = "routed"
+    else:
+        provider = (provider or STT_PROVIDER).lower()
+        kind = provider.split(":", 1)[0]
+    try:
+        if kind == "deepinfra":
+            logger.info("Running Whisper STT (async)...")
+            transcript = await get_async_stt_client().audio.transcriptions.create(
+                model="openai/whisper-large-v3",
+                file=("utterance.wav", pcm_to_wav(pcm)),
+                language="ru"
+            )
+            return (transcript.text or None) if transcript else None
+        elif kind == "local":
+            import numpy as np
+            from utils.local_stt import get_local_transcriber
+            samples = np.frombuffer(pcm, dtype="<i2").astype(np.float32) / 32768.0
+            return await asyncio.wrap_future(get_local_transcriber().submit(samples)) or None
+        elif kind == "mock":
+            from utils.mock_backends import transcribe_pcm_mock
+            return await transcribe_pcm_mock(pcm)
+    except Exception as e:
+        logger.error(f"Transcription failed: {e}")
+        logger.debug(traceback.format_exc())
+        return None
+
+    return await asyncio.to_thread(_transcribe_pcm_file, pcm, None if kind == "routed" else provider)
+
+
+def _transcribe_pcm_file(pcm: bytes, provider: str = None) -> str | None:
+    """transcribe_audio() of PCM, through a temporary WAV file for the backends that only take a file."""
+    import tempfile
+    with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as f:
+        f.write(pcm_to_wav(pcm))
+    try:
+        return transcribe_audio(f.name, provider)
+    except ValueError as e:
+        logger.error(str(e))
+        return None
+    finally:
+        os.remove(f.name)
+
 
 def run_llm_sync(text: str) -> str | None:
     """
@@ -229,7 +529,7 @@ def run_llm_sync(text: str) -> str | None:
         logger.debug(traceback.format_exc())
         return None
 
-def setup_llm_services() -> tuple[ChatTogether, ChatTogether]:
+def setup_llm_services() -> tuple["ChatTogether", "ChatTogether"]:
     """Set up LLM services with proper error handling."""
     try:
         TOGETHER_API_KEY = os.getenv("TOGETHER_API_KEY")
@@ -237,15 +537,8 @@ def setup_llm_services() -> tuple[ChatTogether, ChatTogether]:
         if not TOGETHER_API_KEY:
             raise ValueError("TOGETHER_API_KEY not found in environment variables")
             
-        llm = ChatTogether(
-            together_api_key=TOGETHER_API_KEY,
-            model="meta-llama/Llama-3.3-70B-Instruct-Turbo"
-        )
-
-        llm_validate = ChatTogether(
-            together_api_key=TOGETHER_API_KEY,
-            model="meta-llama/Llama-3.3-70B-Instruct-Turbo"
-        )
+        # Both roles share one registered client (and its connection pool)
+        llm = llm_validate = setup_llm("together", "meta-llama/Llama-3.3-70B-Instruct-Turbo")
         
         return llm, llm_validate
     except Exception as e: